@@ -0,0 +1,232 @@
+import os
+import time
+import logging
+import argparse
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from db_schema import DB_PATH, open_database
+from enrollment_repository import get_repository
+from fmd_parser import parse_fmd
+from identification_engine import DPFJ_FMD_ANSI_378_2004, create_fmd, get_sdk_version, load_dpfj_dll
+from wsq_codec import decode_wsq
+
+# Name of this job in backfill_state
+BACKFILL_NAME = "sample_metadata"
+# Rows read, processed and written per transaction
+DEFAULT_BATCH_SIZE = 256
+# Batches submitted to the pool ahead of the one being written
+PIPELINE_DEPTH = 2
+
+CHECKPOINT_TABLE = '''
+    CREATE TABLE IF NOT EXISTS backfill_state (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL,
+        updated_at TEXT
+    )
+'''
+
+# Rows still missing a template of the target format or their sample metadata.
+# The WSQ image is never part of the result: rows that need a new template are
+# flagged and their image is read by the worker that decodes it, the others
+# are filled from their FMD header.
+PENDING_ROWS = '''
+    SELECT id,
+           fmd IS NULL OR fmd_type IS NOT ?,
+           CASE WHEN fmd_type IS ? THEN fmd END
+    FROM fingerprints
+    WHERE id > ?
+      AND (fmd IS NULL OR fmd_type IS NOT ? OR quality IS NULL OR finger_pos IS NULL
+           OR width IS NULL OR height IS NULL)
+    ORDER BY id
+    LIMIT ?
+'''
+
+UPDATE_ROW = '''
+    UPDATE fingerprints
+    SET fmd = ?, fmd_type = ?, sdk_version = COALESCE(?, sdk_version),
+        quality = ?, finger_pos = ?, width = ?, height = ?
+    WHERE id = ?
+'''
+
+# Connection the images are read from, one per worker process
+_image_conn = None
+
+def _init_worker(db_path):
+    global _image_conn
+    # Every worker process loads its own copy of the SDK and opens its own connection
+    load_dpfj_dll()
+    _image_conn = open_database(db_path)
+
+def process_row(row_id, compressed_data, fmd_data, fmd_type=DPFJ_FMD_ANSI_378_2004):
+    """
+    Compute the template and sample metadata of one fingerprint row.
+
+    :param row_id: The fingerprints row ID.
+    :param compressed_data: The WSQ image (bytes or a file-like BLOB handle), or None when
+                            fmd_data is already usable.
+    :param fmd_data: The stored FMD of the target format, or None.
+    :param fmd_type: The target FMD format.
+    :return: A (row_id, fmd, quality, finger_pos, width, height, extracted) tuple,
+             or (row_id, None, ...) if the row could not be processed.
+    """
+    width = height = None
+    extracted = False
+    if fmd_data is None:
+        image = decode_wsq(compressed_data) if compressed_data else None
+        if image is None:
+            return (row_id, None, None, None, None, None, False)
+        fmd_data = create_fmd(image["data"], image["width"], image["height"], image["dpi"], fmd_type=fmd_type)
+        if fmd_data is None:
+            return (row_id, None, None, None, None, None, False)
+        width, height = image["width"], image["height"]
+        extracted = True
+
+    parsed = parse_fmd(fmd_data, fmd_type)
+    if parsed is None or not parsed["views"]:
+        return (row_id, None, None, None, None, None, False)
+    view = parsed["views"][0]
+    width = width if width is not None else parsed["width"]
+    height = height if height is not None else parsed["height"]
+    return (row_id, bytes(fmd_data), view["quality"], view["finger_pos"], width, height, extracted)
+
+def _process_task(task):
+    row_id, needs_image, fmd_data, fmd_type = task
+    if not needs_image:
+        return process_row(row_id, None, fmd_data, fmd_type)
+    try:
+        blob = _image_conn.blobopen("fingerprints", "fingerprint", row_id, readonly=True)
+    except sqlite3.OperationalError:
+        # Deleted since the batch was read
+        return (row_id, None, None, None, None, None, False)
+    with blob:
+        return process_row(row_id, blob, fmd_data, fmd_type)
+
+def _read_checkpoint(conn, name):
+    row = conn.execute("SELECT last_id FROM backfill_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def _read_batch(conn, last_id, batch_size, fmd_type):
+    # A fresh short query per batch: no read snapshot is held while the pool works,
+    # so the WAL can be checkpointed and the GUI never waits on this job
+    cursor = conn.execute(PENDING_ROWS, (fmd_type, fmd_type, last_id, fmd_type, batch_size))
+    rows = []
+    while True:
+        chunk = cursor.fetchmany(64)
+        if not chunk:
+            break
+        rows.extend((row_id, bool(needs_image), fmd, fmd_type) for row_id, needs_image, fmd in chunk)
+    return rows
+
+def run_backfill(db_path=DB_PATH, workers=None, batch_size=DEFAULT_BATCH_SIZE, fmd_type=DPFJ_FMD_ANSI_378_2004,
+                 restart=False, name=BACKFILL_NAME):
+    """
+    Fill the template and sample metadata columns of existing fingerprint rows.
+
+    Rows are fetched in id order, decoded and extracted on a process pool that
+    opens each image lazily through a BLOB handle, and
+    written back one batch per transaction together with the checkpoint, so an
+    interrupted run resumes after the last committed batch. Reads and writes are
+    short and go through the shared repository, which keeps the job safe to run
+    while the GUI is serving from the same database.
+
+    :param db_path: Path to the SQLite enrollment database.
+    :param workers: Number of worker processes (0 runs in-process, None uses every CPU).
+    :param batch_size: Rows per transaction.
+    :param fmd_type: The FMD format to extract.
+    :param restart: Start over from the first row instead of the checkpoint.
+    :param name: Checkpoint name of the job.
+    :return: A dictionary with the processed, extracted and failed row counts and the throughput.
+    """
+    global _image_conn
+    # Opening the repository applies any pending schema migration
+    repository = get_repository(db_path)
+    with repository.transaction() as conn:
+        conn.execute(CHECKPOINT_TABLE)
+    reader = repository.reader()
+
+    last_id = 0 if restart else _read_checkpoint(reader, name)
+    sdk_version = get_sdk_version()
+    if last_id:
+        print(f"[DEBUG] Resuming backfill after row {last_id}.")
+        logging.info(f"Resuming backfill {name} after row {last_id}.")
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers > 0:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_path,))
+    else:
+        executor = None
+        _image_conn = reader
+    chunksize = max(1, batch_size // (4 * max(workers, 1)))
+
+    report = {"processed": 0, "extracted": 0, "failed": 0}
+    start = time.perf_counter()
+    in_flight = deque()
+    try:
+        while True:
+            while len(in_flight) < PIPELINE_DEPTH:
+                rows = _read_batch(reader, last_id, batch_size, fmd_type)
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                if executor is not None:
+                    results = executor.map(_process_task, rows, chunksize=chunksize)
+                else:
+                    results = map(_process_task, rows)
+                in_flight.append((last_id, results))
+            if not in_flight:
+                break
+
+            batch_last_id, results = in_flight.popleft()
+            updates = []
+            for row_id, fmd, quality, finger_pos, width, height, extracted in results:
+                report["processed"] += 1
+                if fmd is None:
+                    report["failed"] += 1
+                    logging.error(f"Backfill could not process fingerprint row {row_id}.")
+                    continue
+                report["extracted"] += extracted
+                updates.append((fmd, fmd_type, sdk_version if extracted else None,
+                                quality, finger_pos, width, height, row_id))
+
+            with repository.transaction() as conn:
+                conn.executemany(UPDATE_ROW, updates)
+                conn.execute(
+                    "INSERT OR REPLACE INTO backfill_state (name, last_id, updated_at) VALUES (?, ?, datetime('now'))",
+                    (name, batch_last_id)
+                )
+
+            elapsed = time.perf_counter() - start
+            print(f"[DEBUG] Backfill: {report['processed']} rows up to id {batch_last_id}, "
+                  f"{report['processed'] / elapsed:.1f} rows/s, {report['failed']} failed.")
+    except sqlite3.Error as e:
+        print(f"[ERROR] Backfill stopped after row {_read_checkpoint(reader, name)}: {e}")
+        logging.error(f"Backfill {name} stopped: {e}")
+        return None
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    report["seconds"] = elapsed
+    report["rows_per_second"] = report["processed"] / elapsed if elapsed > 0 else 0.0
+    print(f"[DEBUG] Backfill finished: {report['processed']} rows ({report['extracted']} extracted, "
+          f"{report['failed']} failed) at {report['rows_per_second']:.1f} rows/s.")
+    logging.info(f"Backfill {name} finished: {report}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the enrollment database and backfill template metadata.")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the enrollment database.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (0: run in-process).")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per transaction.")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over.")
+    args = parser.parse_args()
+
+    logging.basicConfig(filename="fingerprint_system.log", level=logging.INFO,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+    run_backfill(args.db, workers=args.workers, batch_size=args.batch, restart=args.restart)
+
+if __name__ == "__main__":
+    main()
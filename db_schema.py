@@ -0,0 +1,320 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+import tempfile
+import threading
+
+DB_PATH = "fingerprint_enrollment.db"
+
+# Connection profile applied on every open
+SYNCHRONOUS = "NORMAL"          # safe with WAL: a crash can lose the last commits, never corrupt
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHE_SIZE_KB = 64 * 1024
+BUSY_TIMEOUT_MS = 5000
+
+# The WSQ image is the last column: SQLite reads a row's columns in order and a
+# large BLOB spills to overflow pages, so any column stored after it (fmd, the
+# sample metadata) would cost a walk of the image's overflow chain on every read.
+FINGERPRINTS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        fmd BLOB,
+        fmd_type INTEGER,
+        sdk_version TEXT,
+        quality INTEGER,
+        finger_pos INTEGER,
+        width INTEGER,
+        height INTEGER,
+        created_at TEXT,
+        fingerprint BLOB NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+'''
+FINGERPRINTS_COLUMNS = ("id", "user_id", "fmd", "fmd_type", "sdk_version", "quality", "finger_pos",
+                        "width", "height", "created_at", "fingerprint")
+
+TABLES = (
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL UNIQUE,
+        name TEXT NOT NULL,
+        nik TEXT NOT NULL
+    )
+    ''',
+    FINGERPRINTS_TABLE.format(name="fingerprints"),
+)
+
+# Columns added to fingerprints after the first release
+FMD_COLUMNS = (("fmd", "BLOB"), ("fmd_type", "INTEGER"), ("sdk_version", "TEXT"))
+# Per-sample metadata filled at enrollment, or by backfill.py for older rows. quality
+# is the sample score of image_quality.sample_score at enrollment; backfilled rows
+# get the extractor's view quality from the FMD header (both 0-100).
+# ALTER TABLE cannot add a CURRENT_TIMESTAMP default, so created_at is set on insert.
+SAMPLE_COLUMNS = (("quality", "INTEGER"), ("finger_pos", "INTEGER"), ("width", "INTEGER"),
+                  ("height", "INTEGER"), ("created_at", "TEXT"))
+
+# Change feed: one row per inserted or deleted fingerprint, and per template or image
+# change, so in-memory galleries and image caches can apply the delta since their
+# last sync. seq only grows.
+CHANGE_FEED = (
+    '''
+    CREATE TABLE IF NOT EXISTS fingerprint_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        fingerprint_id INTEGER NOT NULL,
+        operation TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS fingerprints_log_insert AFTER INSERT ON fingerprints
+    BEGIN
+        INSERT INTO fingerprint_changes (fingerprint_id, operation) VALUES (NEW.id, 'insert');
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS fingerprints_log_delete AFTER DELETE ON fingerprints
+    BEGIN
+        INSERT INTO fingerprint_changes (fingerprint_id, operation) VALUES (OLD.id, 'delete');
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS fingerprints_log_update AFTER UPDATE OF fmd, fmd_type, user_id, fingerprint
+    ON fingerprints
+    WHEN OLD.fmd IS NOT NEW.fmd OR OLD.fmd_type IS NOT NEW.fmd_type OR OLD.user_id IS NOT NEW.user_id
+      OR OLD.fingerprint IS NOT NEW.fingerprint
+    BEGIN
+        INSERT INTO fingerprint_changes (fingerprint_id, operation) VALUES (NEW.id, 'update');
+    END
+    ''',
+)
+
+INDEXES = (
+    # Per-user lookups (verification, enrollment counts) instead of full scans over BLOB pages
+    "CREATE INDEX IF NOT EXISTS idx_fingerprints_user_id ON fingerprints (user_id)",
+)
+
+# Databases whose schema was already checked by this process
+_checked_paths = set()
+_checked_lock = threading.Lock()
+
+def apply_pragmas(conn, mmap_size=DEFAULT_MMAP_SIZE, cache_size_kb=DEFAULT_CACHE_SIZE_KB):
+    """
+    Apply the performance profile to an open connection.
+
+    WAL lets readers (identification, gallery loads) run while an enrollment
+    writes; mmap_size and cache_size keep gallery loads out of read() calls.
+
+    :param conn: An open SQLite connection.
+    :param mmap_size: Bytes of the database file to memory-map.
+    :param cache_size_kb: Page cache size in KiB.
+    :return: The journal mode in effect.
+    """
+    journal_mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    if journal_mode.lower() != "wal":
+        logging.warning(f"WAL journaling not available, using {journal_mode}.")
+    conn.execute(f"PRAGMA synchronous = {SYNCHRONOUS}")
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    conn.execute(f"PRAGMA cache_size = {-int(cache_size_kb)}")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return journal_mode
+
+def _add_columns(conn, columns):
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(fingerprints)")}
+    for column, column_type in columns:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE fingerprints ADD COLUMN {column} {column_type}")
+            logging.debug(f"Added column fingerprints.{column}.")
+
+def _migrate_templates(conn):
+    _add_columns(conn, FMD_COLUMNS)
+    for statement in INDEXES:
+        conn.execute(statement)
+
+def _migrate_sample_metadata(conn):
+    _add_columns(conn, SAMPLE_COLUMNS)
+
+def _migrate_change_feed(conn):
+    for statement in CHANGE_FEED:
+        conn.execute(statement)
+
+def _rebuild_fingerprints(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(fingerprints)")]
+    if tuple(columns) == FINGERPRINTS_COLUMNS:
+        return
+    # Rebuild the table in the current layout: ALTER TABLE can only append a column,
+    # which would land after the image. Dropping the old table also drops its index
+    # and change feed triggers, so both are recreated; the id sequence is carried
+    # over so deleted ids are never handed out again.
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'fingerprints'").fetchone()
+    last_seq = row[0] if row else 0
+    column_list = ", ".join(column for column in FINGERPRINTS_COLUMNS if column in columns)
+    conn.execute("DROP TABLE IF EXISTS fingerprints_rebuild")
+    conn.execute(FINGERPRINTS_TABLE.format(name="fingerprints_rebuild"))
+    conn.execute(f"INSERT INTO fingerprints_rebuild ({column_list}) SELECT {column_list} FROM fingerprints ORDER BY id")
+    conn.execute("DROP TABLE fingerprints")
+    conn.execute("ALTER TABLE fingerprints_rebuild RENAME TO fingerprints")
+    conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'fingerprints'", (last_seq,))
+    for statement in INDEXES + CHANGE_FEED[1:]:
+        conn.execute(statement)
+
+def _log_image_changes(conn):
+    # Older databases only log template changes; recreate the update trigger
+    conn.execute("DROP TRIGGER IF EXISTS fingerprints_log_update")
+    conn.execute(CHANGE_FEED[3])
+
+# (version, description, function); a database at user_version N has every step <= N applied
+MIGRATIONS = (
+    (1, "template columns and user_id index", _migrate_templates),
+    (2, "sample quality, finger position, geometry and creation time", _migrate_sample_metadata),
+    (3, "fingerprint change feed", _migrate_change_feed),
+    (4, "fingerprint image stored after the template and metadata columns", _rebuild_fingerprints),
+    (5, "fingerprint image rewrites logged in the change feed", _log_image_changes),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(conn):
+    """
+    :param conn: An open SQLite connection.
+    :return: The migration version recorded in the database (0 for an unversioned one).
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """
+    Bring the database up to SCHEMA_VERSION.
+
+    Each pending step runs in its own transaction together with the bump of
+    PRAGMA user_version, so an interrupted upgrade resumes at the failed step.
+    Steps add tables, columns, indexes and triggers, and reorder columns by
+    rebuilding a table; filling the new columns of existing rows is left to
+    backfill.py.
+
+    :param conn: An open SQLite connection.
+    :return: The schema version after the upgrade.
+    """
+    version = schema_version(conn)
+    for target, description, step in MIGRATIONS:
+        if target <= version:
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Another process may have migrated while this one waited for the lock
+            if schema_version(conn) >= target:
+                conn.rollback()
+                continue
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {int(target)}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        print(f"[DEBUG] Database migrated to version {target}: {description}.")
+        logging.info(f"Database migrated to version {target}: {description}.")
+        version = target
+    return version
+
+def ensure_schema(conn):
+    """
+    Create the tables and apply pending migrations.
+
+    :param conn: An open SQLite connection.
+    """
+    for statement in TABLES:
+        conn.execute(statement)
+    conn.commit()
+    migrate(conn)
+
+def open_database(db_path=DB_PATH, check_same_thread=True, cached_statements=128, **pragmas):
+    """
+    Open the enrollment database with the performance profile applied.
+
+    The schema is checked on the first open of each database in the process,
+    so later opens only pay for the pragmas.
+
+    :param db_path: Path to the SQLite enrollment database.
+    :param check_same_thread: Passed to sqlite3.connect.
+    :param cached_statements: Number of compiled statements kept by the connection.
+    :param pragmas: Overrides for apply_pragmas (mmap_size, cache_size_kb).
+    :return: An open sqlite3.Connection.
+    """
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread, cached_statements=cached_statements)
+    apply_pragmas(conn, **pragmas)
+    key = os.path.abspath(db_path)
+    if key not in _checked_paths:
+        with _checked_lock:
+            if key not in _checked_paths:
+                ensure_schema(conn)
+                _checked_paths.add(key)
+    return conn
+
+def _fill(conn, fingerprints, blob_size, scans_per_user):
+    blob = os.urandom(blob_size)
+    users = fingerprints // scans_per_user
+    conn.executemany("INSERT INTO users (user_id, name, nik) VALUES (?, ?, ?)",
+                     ((f"user{i}", f"Name {i}", f"{i:016d}") for i in range(users)))
+    conn.executemany("INSERT INTO fingerprints (user_id, fingerprint) VALUES (?, ?)",
+                     ((f"user{i // scans_per_user}", blob) for i in range(users * scans_per_user)))
+    conn.commit()
+    return users
+
+def _measure(conn, users, lookups, enrollments, blob_size, scans_per_user):
+    rnd = random.Random(0)
+    start = time.perf_counter()
+    for _ in range(lookups):
+        user_id = f"user{rnd.randrange(users)}"
+        conn.execute("SELECT fingerprint FROM fingerprints WHERE user_id = ?", (user_id,)).fetchall()
+        conn.execute("SELECT COUNT(*) FROM fingerprints WHERE user_id = ?", (user_id,)).fetchone()
+    lookup_ms = 1000 * (time.perf_counter() - start) / lookups
+
+    blob = os.urandom(blob_size)
+    start = time.perf_counter()
+    for i in range(enrollments):
+        user_id = f"new{i}"
+        conn.execute("INSERT INTO users (user_id, name, nik) VALUES (?, ?, ?)", (user_id, "Name", "0"))
+        conn.executemany("INSERT INTO fingerprints (user_id, fingerprint) VALUES (?, ?)",
+                         [(user_id, blob)] * scans_per_user)
+        conn.commit()
+    commit_ms = 1000 * (time.perf_counter() - start) / enrollments
+    return lookup_ms, commit_ms
+
+def benchmark(fingerprints=100000, blob_size=1024, lookups=200, enrollments=50, scans_per_user=4, directory=None):
+    """
+    Compare lookup and enrollment commit latency with and without the profile.
+
+    Two scratch databases with the same synthetic rows are measured: one with
+    the original schema and default settings, one opened by open_database.
+
+    :param fingerprints: Number of fingerprint rows.
+    :param blob_size: Size of each synthetic fingerprint BLOB.
+    :param lookups: Number of per-user lookups timed.
+    :param enrollments: Number of enrollment commits timed.
+    :param scans_per_user: Fingerprints per user.
+    :param directory: Where to create the scratch databases (default: a temp dir).
+    :return: A dictionary of latencies in milliseconds.
+    """
+    report = {"fingerprints": fingerprints}
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        baseline_path = os.path.join(temp_dir, "baseline.db")
+        conn = sqlite3.connect(baseline_path)
+        for statement in TABLES:
+            conn.execute(statement)
+        users = _fill(conn, fingerprints, blob_size, scans_per_user)
+        report["baseline_lookup_ms"], report["baseline_commit_ms"] = _measure(
+            conn, users, lookups, enrollments, blob_size, scans_per_user)
+        conn.close()
+
+        tuned_path = os.path.join(temp_dir, "tuned.db")
+        conn = open_database(tuned_path)
+        users = _fill(conn, fingerprints, blob_size, scans_per_user)
+        report["tuned_lookup_ms"], report["tuned_commit_ms"] = _measure(
+            conn, users, lookups, enrollments, blob_size, scans_per_user)
+        conn.close()
+
+    print(f"[DEBUG] Lookup: {report['baseline_lookup_ms']:.3f} ms -> {report['tuned_lookup_ms']:.3f} ms, "
+          f"commit: {report['baseline_commit_ms']:.3f} ms -> {report['tuned_commit_ms']:.3f} ms")
+    logging.debug(f"Database profile benchmark: {report}")
+    return report
@@ -0,0 +1,491 @@
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from db_schema import DB_PATH, open_database, ensure_schema
+from fmd_parser import parse_fmd
+
+# Statements kept compiled per connection (sqlite3 caches them by SQL text)
+STATEMENT_CACHE_SIZE = 256
+# Rows fetched per round trip when streaming templates
+DEFAULT_BATCH_SIZE = 1000
+# Users per query when listing enrollments
+DEFAULT_PAGE_SIZE = 500
+# Bytes read per step when hashing a stored fingerprint image
+BLOB_CHUNK_SIZE = 64 * 1024
+# An enrollment keeps its KEEP_SAMPLES best scans, and captures up to MAX_EXTRA_SCANS
+# more while fewer than KEEP_SAMPLES of them reach GOOD_SAMPLE_SCORE
+KEEP_SAMPLES = 3
+MAX_EXTRA_SCANS = 2
+GOOD_SAMPLE_SCORE = 60
+# Change feed entries kept behind a reader's watermark, so other readers that lag
+# by less than this still sync incrementally instead of reloading
+CHANGE_FEED_RETENTION = 10000
+
+User = namedtuple("User", ["user_id", "name", "nik"])
+Template = namedtuple("Template", ["id", "user_id", "fmd", "fmd_type"])
+# A stored fingerprint image: its row ID and its size in bytes
+StoredImage = namedtuple("StoredImage", ["id", "size"])
+EnrollmentSummary = namedtuple("EnrollmentSummary", ["user_id", "name", "nik", "fingerprints"])
+# Latest change of one fingerprint since a watermark; user_id and fmd are None when
+# the row no longer exists or no longer holds a template of the requested format
+Change = namedtuple("Change", ["seq", "fingerprint_id", "operation", "user_id", "fmd"])
+# One staged capture and the sample metadata stored with it
+Sample = namedtuple("Sample", ["image", "fmd", "quality", "finger_pos", "width", "height"])
+
+class StagedEnrollment:
+    """
+    In-memory record of an enrollment in progress.
+
+    Captures, validation, template extraction and compression fill it outside
+    any transaction; EnrollmentRepository.commit_enrollment then writes it in
+    one short transaction.
+    """
+
+    def __init__(self, user_id, name, nik, fmd_type, sdk_version):
+        self.user_id = user_id
+        self.name = name
+        self.nik = nik
+        self.fmd_type = fmd_type
+        self.sdk_version = sdk_version
+        self.samples = []  # Sample tuples
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add_sample(self, compressed_image, fmd, score=None, finger_pos=None, width=None, height=None):
+        """
+        Stage a capture with the metadata stored alongside it, so backfill.py never
+        has to decode a fresh enrollment.
+
+        :param compressed_image: The compressed fingerprint image (bytes).
+        :param fmd: The FMD of the sample (bytes).
+        :param score: The sample quality score (0-100), stored as the row's quality. Without
+                      one, the extractor's view quality is used, as backfill.py does.
+        :param finger_pos: The finger position of the capture.
+        :param width: The width of the image in pixels.
+        :param height: The height of the image in pixels.
+        """
+        quality = score
+        if quality is None:
+            parsed = parse_fmd(fmd, self.fmd_type)
+            quality = parsed["views"][0]["quality"] if parsed and parsed["views"] else None
+        self.samples.append(Sample(compressed_image, fmd, quality, finger_pos, width, height))
+
+    def needs_more_samples(self, keep=KEEP_SAMPLES, min_score=GOOD_SAMPLE_SCORE):
+        """
+        :param keep: The number of samples the enrollment will keep.
+        :param min_score: The score a sample needs to count as good.
+        :return: True while fewer than keep samples score at least min_score.
+        """
+        return sum(1 for sample in self.samples if sample.quality is not None and sample.quality >= min_score) < keep
+
+    def keep_best(self, keep=KEEP_SAMPLES):
+        """
+        Drop all but the keep best-scoring samples, best first.
+
+        :param keep: The number of samples to keep.
+        :return: The number of samples dropped.
+        """
+        # Stable sort: unscored samples go last, equal scores keep their capture order
+        self.samples.sort(key=lambda sample: -1 if sample.quality is None else sample.quality, reverse=True)
+        dropped = max(0, len(self.samples) - keep)
+        del self.samples[keep:]
+        return dropped
+
+class EnrollmentRepository:
+    """
+    Shared access to the enrollment database.
+
+    Each thread reads through its own connection, opened on first use and then
+    reused, so the per-request path pays neither connection setup nor schema
+    checks. All writes go through one writer connection guarded by a lock,
+    matching SQLite's single-writer model.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        """
+        :param db_path: Path to the SQLite enrollment database.
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._writer = None
+        self._write_lock = threading.RLock()
+
+    def _open(self):
+        conn = open_database(self.db_path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def reader(self):
+        """
+        :return: The calling thread's read connection (do not close it).
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        return conn
+
+    def acquire_writer(self):
+        """
+        Take the writer connection; pair every call with release_writer().
+
+        :return: The writer connection.
+        """
+        self._write_lock.acquire()
+        if self._writer is None:
+            try:
+                self._writer = self._open()
+            except Exception:
+                self._write_lock.release()
+                raise
+        return self._writer
+
+    def release_writer(self):
+        """Give the writer connection back, rolling back anything left uncommitted."""
+        try:
+            if self._writer is not None and self._writer.in_transaction:
+                logging.warning("Writer released with an open transaction; rolling back.")
+                self._writer.rollback()
+        finally:
+            self._write_lock.release()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run a block in one write transaction, committed on success and rolled back on error.
+
+        :return: A context manager yielding the writer connection.
+        """
+        conn = self.acquire_writer()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release_writer()
+
+    def ensure_schema(self):
+        """Create the tables, missing columns and indexes."""
+        conn = self.acquire_writer()
+        try:
+            ensure_schema(conn)
+        finally:
+            self.release_writer()
+
+    def get_user(self, user_id):
+        """
+        :param user_id: The ID of the user.
+        :return: A User(user_id, name, nik) tuple, or None if the user is not enrolled.
+        """
+        row = self.reader().execute("SELECT user_id, name, nik FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return User(*row) if row else None
+
+    def user_exists(self, user_id):
+        """
+        :param user_id: The ID of the user.
+        :return: True if the user is enrolled.
+        """
+        return self.reader().execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is not None
+
+    def get_user_templates(self, user_id):
+        """
+        :param user_id: The ID of the user.
+        :return: A list of Template tuples (fmd and fmd_type may be None), highest
+                 quality first so verification can stop at the first match.
+        """
+        rows = self.reader().execute(
+            "SELECT id, user_id, fmd, fmd_type FROM fingerprints WHERE user_id = ? "
+            "ORDER BY quality IS NULL, quality DESC, id", (user_id,)
+        ).fetchall()
+        return [Template(*row) for row in rows]
+
+    def get_user_images(self, user_id):
+        """
+        List a user's stored images without reading them.
+
+        length() is answered from the record header, so the image pages are not
+        read; the sizes let DecodedImageCache validate its entries for free.
+
+        :param user_id: The ID of the user.
+        :return: A list of StoredImage(id, size) tuples, in get_user_templates order.
+        """
+        rows = self.reader().execute(
+            "SELECT id, length(fingerprint) FROM fingerprints WHERE user_id = ? "
+            "ORDER BY quality IS NULL, quality DESC, id", (user_id,)
+        ).fetchall()
+        return [StoredImage(*row) for row in rows]
+
+    def open_fingerprint(self, row_id):
+        """
+        Open the compressed image of a fingerprint row lazily.
+
+        The returned sqlite3.Blob is file-like (read, seek, tell) and reads the
+        image straight from its pages, so the image is only read when a caller
+        needs it instead of being pulled into a SELECT result set. Close it (or
+        use it as a context manager) promptly: it holds a read snapshot while open.
+
+        :param row_id: The fingerprints row ID.
+        :return: A read-only sqlite3.Blob, or None if the row does not exist.
+        """
+        try:
+            return self.reader().blobopen("fingerprints", "fingerprint", row_id, readonly=True)
+        except sqlite3.OperationalError:
+            return None
+
+    def get_fingerprint(self, row_id):
+        """
+        :param row_id: The fingerprints row ID.
+        :return: The compressed fingerprint image (bytes), or None.
+        """
+        blob = self.open_fingerprint(row_id)
+        if blob is None:
+            return None
+        with blob:
+            return blob.read()
+
+    def iter_templates(self, fmd_type, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Stream every stored template of a format, in row order.
+
+        :param fmd_type: The FMD format.
+        :param batch_size: Rows fetched per round trip.
+        :return: A generator of Template tuples.
+        """
+        cursor = self.reader().execute(
+            "SELECT id, user_id, fmd, fmd_type FROM fingerprints WHERE fmd IS NOT NULL AND fmd_type = ? ORDER BY id",
+            (fmd_type,)
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield Template(*row)
+
+    def list_enrollments(self, after_user_id=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Get one page of enrolled users with their fingerprint counts.
+
+        One query joins users to the user_id index of fingerprints, so counting
+        never touches the image pages. Pages are keyed on user_id (keyset
+        pagination): each page costs the same no matter how deep it is.
+
+        :param after_user_id: The last user ID of the previous page (None for the first page).
+        :param limit: The maximum number of users returned.
+        :return: A list of EnrollmentSummary tuples ordered by user ID.
+        """
+        if after_user_id is None:
+            where, params = "", (limit,)
+        else:
+            # A separate statement so the planner seeks the users index instead of scanning it
+            where, params = "WHERE u.user_id > ?", (after_user_id, limit)
+        rows = self.reader().execute(
+            f"""
+            SELECT u.user_id, u.name, u.nik, COUNT(f.id)
+            FROM users u
+            LEFT JOIN fingerprints f ON f.user_id = u.user_id
+            {where}
+            GROUP BY u.user_id
+            ORDER BY u.user_id
+            LIMIT ?
+            """,
+            params
+        ).fetchall()
+        return [EnrollmentSummary(*row) for row in rows]
+
+    def iter_enrollments(self, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Stream every enrolled user with their fingerprint count.
+
+        Only one page is held in memory, and no read transaction stays open
+        between pages, so listing a large database neither grows memory nor
+        holds back writers.
+
+        :param page_size: Users fetched per query.
+        :return: A generator of EnrollmentSummary tuples ordered by user ID.
+        """
+        after_user_id = None
+        while True:
+            page = self.list_enrollments(after_user_id, page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            after_user_id = page[-1].user_id
+
+    def count_fingerprints(self, user_id):
+        """
+        :param user_id: The ID of the user.
+        :return: The number of stored fingerprints of the user.
+        """
+        return self.reader().execute("SELECT COUNT(*) FROM fingerprints WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def change_watermark(self):
+        """
+        :return: The sequence number of the latest committed change (0 if none).
+        """
+        return self.reader().execute("SELECT COALESCE(MAX(seq), 0) FROM fingerprint_changes").fetchone()[0]
+
+    def first_change_seq(self):
+        """
+        :return: The oldest sequence number still in the change feed, or None if it is empty.
+        """
+        return self.reader().execute("SELECT MIN(seq) FROM fingerprint_changes").fetchone()[0]
+
+    def changed_fingerprint_ids(self, seq):
+        """
+        List the fingerprints changed after a watermark, without reading their rows.
+
+        :param seq: The watermark of the last sync.
+        :return: A (watermark, ids) tuple: the latest sequence number read (seq if
+                 nothing changed) and the set of inserted, deleted or rewritten fingerprint IDs.
+        """
+        rows = self.reader().execute(
+            "SELECT fingerprint_id, MAX(seq) FROM fingerprint_changes WHERE seq > ? GROUP BY fingerprint_id", (seq,)
+        ).fetchall()
+        return max((row[1] for row in rows), default=seq), {row[0] for row in rows}
+
+    def changes_since(self, seq, fmd_type):
+        """
+        Collect the fingerprints changed after a watermark, one entry per fingerprint.
+
+        Each entry carries the current state of the row, so applying the entries in
+        any order brings a gallery to the state of the database when it was read.
+
+        :param seq: The watermark of the last sync.
+        :param fmd_type: The FMD format the gallery holds.
+        :return: A list of Change tuples ordered by seq.
+        """
+        rows = self.reader().execute(
+            """
+            SELECT MAX(c.seq), c.fingerprint_id, c.operation, f.user_id, f.fmd
+            FROM fingerprint_changes c
+            LEFT JOIN fingerprints f ON f.id = c.fingerprint_id AND f.fmd IS NOT NULL AND f.fmd_type = ?
+            WHERE c.seq > ?
+            GROUP BY c.fingerprint_id
+            ORDER BY 1
+            """,
+            (fmd_type, seq)
+        ).fetchall()
+        return [Change(*row) for row in rows]
+
+    def prune_changes(self, seq):
+        """
+        Drop change feed entries every reader has already applied.
+
+        The latest entry is always kept, so a gallery whose watermark falls
+        before the pruned range can tell that it missed changes.
+
+        :param seq: Entries up to and including this watermark are deleted.
+        :return: The number of entries deleted.
+        """
+        with self.transaction() as conn:
+            return conn.execute(
+                "DELETE FROM fingerprint_changes WHERE seq <= ? AND seq < (SELECT MAX(seq) FROM fingerprint_changes)",
+                (seq,)
+            ).rowcount
+
+    def trim_changes(self, seq, retention=CHANGE_FEED_RETENTION):
+        """
+        Prune the change feed behind a reader's watermark, keeping a retention margin.
+
+        Called by readers after a sync. The feed is only pruned once it holds twice
+        the margin behind the watermark, so most syncs do not write.
+
+        :param seq: The watermark the reader has applied.
+        :param retention: Entries kept before the watermark.
+        :return: The number of entries deleted.
+        """
+        first_seq = self.first_change_seq()
+        if first_seq is None or seq - first_seq < 2 * retention:
+            return 0
+        deleted = self.prune_changes(seq - retention)
+        logging.debug(f"Change feed pruned: {deleted} entries up to {seq - retention}.")
+        return deleted
+
+    def add_enrollment(self, user_id, name, nik, samples, fmd_type, sdk_version):
+        """
+        Store a user and their fingerprints in one transaction.
+
+        :param user_id: The ID of the user.
+        :param name: The name of the user.
+        :param nik: The NIK of the user.
+        :param samples: A list of Sample tuples.
+        :param fmd_type: The FMD format of the templates.
+        :param sdk_version: The DPFJ version that created the templates.
+        :return: The fingerprints row IDs of the samples, in order.
+        """
+        with self.transaction() as conn:
+            conn.execute("INSERT INTO users (user_id, name, nik) VALUES (?, ?, ?)", (user_id, name, nik))
+            first_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM fingerprints").fetchone()[0]
+            conn.executemany(
+                "INSERT INTO fingerprints (user_id, fingerprint, fmd, fmd_type, sdk_version, quality, finger_pos, "
+                "width, height, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))",
+                [(user_id, sample.image, sample.fmd, fmd_type, sdk_version, sample.quality,
+                  sample.finger_pos, sample.width, sample.height) for sample in samples]
+            )
+            row_ids = [row[0] for row in conn.execute(
+                "SELECT id FROM fingerprints WHERE user_id = ? AND id >= ? ORDER BY id", (user_id, first_id)
+            )]
+        return row_ids
+
+    def commit_enrollment(self, staged):
+        """
+        Store a staged enrollment in one transaction.
+
+        :param staged: A StagedEnrollment.
+        :return: A list of (row_id, fmd) pairs of the stored samples.
+        """
+        row_ids = self.add_enrollment(staged.user_id, staged.name, staged.nik, staged.samples,
+                                      staged.fmd_type, staged.sdk_version)
+        return [(row_id, sample.fmd) for row_id, sample in zip(row_ids, staged.samples)]
+
+    def update_template(self, row_id, fmd, fmd_type, sdk_version):
+        """
+        Store a template extracted later for an existing fingerprint.
+
+        :param row_id: The fingerprints row ID.
+        :param fmd: The FMD data (bytes).
+        :param fmd_type: The FMD format.
+        :param sdk_version: The DPFJ version that created the template.
+        """
+        with self.transaction() as conn:
+            conn.execute("UPDATE fingerprints SET fmd = ?, fmd_type = ?, sdk_version = ? WHERE id = ?",
+                         (fmd, fmd_type, sdk_version, row_id))
+
+    def close(self):
+        """Close every connection opened by the repository."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logging.error(f"Failed to close database connection: {e}")
+        self._writer = None
+        self._local = threading.local()
+
+# One repository per database, shared by every caller in the process
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+def get_repository(db_path=DB_PATH):
+    """
+    :param db_path: Path to the SQLite enrollment database.
+    :return: The process-wide EnrollmentRepository for that database.
+    """
+    with _repositories_lock:
+        repository = _repositories.get(db_path)
+        if repository is None:
+            repository = EnrollmentRepository(db_path)
+            _repositories[db_path] = repository
+        return repository
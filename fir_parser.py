@@ -0,0 +1,155 @@
+import struct
+import logging
+import numpy as np
+
+# Image formats of dpfpdd_capture (DPFPDD_IMG_FMT)
+DPFPDD_IMG_FMT_PIXEL_BUFFER = 0x00000000
+DPFPDD_IMG_FMT_ANSI381 = 0x001B0401
+DPFPDD_IMG_FMT_ISOIEC19794 = 0x01010007
+
+# General record header sizes in bytes: ANSI 381-2004 adds a 4-byte CBEFF product
+# ID after the 6-byte record length; the fields after it are the same
+ISO_HEADER_SIZE = 32
+ANSI_HEADER_SIZE = 36
+RECORD_LENGTH_OFFSET = 8
+RECORD_LENGTH_SIZE = 6
+# Finger image header in front of each view's pixels
+VIEW_HEADER_SIZE = 14
+
+# Image compression algorithm of the general header
+COMPRESSION_UNCOMPRESSED = 0
+COMPRESSION_BIT_PACKED = 1
+COMPRESSION_WSQ = 2
+
+# Scale units: resolutions are in pixels per inch (1) or per centimeter (2)
+SCALE_UNITS_PPI = 1
+SCALE_UNITS_PPCM = 2
+
+def _header_size(image_fmt):
+    return ANSI_HEADER_SIZE if image_fmt == DPFPDD_IMG_FMT_ANSI381 else ISO_HEADER_SIZE
+
+def _record_format(data, image_fmt):
+    # Both layouts start alike; the one whose first view block fits the record wins,
+    # trying the capture format first
+    other = DPFPDD_IMG_FMT_ISOIEC19794 if image_fmt == DPFPDD_IMG_FMT_ANSI381 else DPFPDD_IMG_FMT_ANSI381
+    for candidate in (image_fmt, other):
+        header_size = _header_size(candidate)
+        if len(data) < header_size + VIEW_HEADER_SIZE:
+            continue
+        block_length = struct.unpack_from(">I", data, header_size)[0]
+        if VIEW_HEADER_SIZE <= block_length <= len(data) - header_size:
+            return candidate
+    return image_fmt
+
+def parse_fir(image_data, image_fmt=None):
+    """
+    Parse an ISO 19794-4:2005 or ANSI 381-2004 finger image record (FIR).
+
+    The pixels of each view are returned as views over image_data, not copies:
+    pass the capture buffer itself (a ctypes array or memoryview) and the
+    pixels reach FMD extraction or WSQ encoding without being copied.
+
+    :param image_data: The record (bytes-like), e.g. the buffer filled by dpfpdd_capture.
+    :param image_fmt: The DPFPDD_IMG_FMT the record was captured in, tried first when
+                      telling the ISO and ANSI layouts apart (default: ISO).
+    :return: A dictionary with the record header and a list of views, each holding
+             its geometry, "data" (a memoryview of the pixels) and, for
+             uncompressed 8-bit images, "image" (a (height, width) uint8 array),
+             or None if the record is malformed.
+    """
+    data = memoryview(image_data).cast("B")
+    if len(data) < ISO_HEADER_SIZE + VIEW_HEADER_SIZE or bytes(data[:4]) != b"FIR\0":
+        logging.error("Invalid FIR header. Expected 'FIR'.")
+        return None
+
+    record_fmt = _record_format(data, image_fmt or DPFPDD_IMG_FMT_ISOIEC19794)
+    header_size = _header_size(record_fmt)
+    record_length = int.from_bytes(data[RECORD_LENGTH_OFFSET:RECORD_LENGTH_OFFSET + RECORD_LENGTH_SIZE], "big")
+
+    # The common tail of the general header: device ID, acquisition level, view count,
+    # scale units, scan and image resolutions, pixel depth, compression, 2 reserved bytes
+    (device_id, acquisition_level, view_count, scale_units, scan_x_res, scan_y_res,
+     x_res, y_res, pixel_depth, compression) = struct.unpack_from(">HHBBHHHHBB", data, header_size - 18)
+    if scale_units == SCALE_UNITS_PPCM:
+        dpi = int(round(x_res * 2.54))
+    else:
+        dpi = x_res
+
+    views = []
+    offset = header_size
+    for _ in range(view_count):
+        if offset + VIEW_HEADER_SIZE > len(data):
+            logging.error("FIR truncated inside a finger image header.")
+            return None
+        (block_length, finger_pos, view_count_of_finger, view_number, quality, impression_type,
+         width, height) = struct.unpack_from(">IBBBBBHH", data, offset)
+        end = offset + block_length
+        if block_length < VIEW_HEADER_SIZE or end > len(data):
+            logging.error(f"FIR view of {block_length} bytes does not fit the record.")
+            return None
+        pixels = data[offset + VIEW_HEADER_SIZE:end]
+
+        image = None
+        if compression == COMPRESSION_UNCOMPRESSED and pixel_depth == 8:
+            if len(pixels) < width * height:
+                logging.error(f"FIR view holds {len(pixels)} bytes, expected {width * height}.")
+                return None
+            pixels = pixels[:width * height]
+            image = np.frombuffer(pixels, dtype=np.uint8).reshape(height, width)
+
+        views.append({
+            "finger_pos": finger_pos,
+            "view_count": view_count_of_finger,
+            "view_number": view_number,
+            "quality": quality,
+            "impression_type": impression_type,
+            "width": width,
+            "height": height,
+            "data": pixels,
+            "image": image,
+        })
+        offset = end
+
+    return {
+        "format": record_fmt,
+        "record_length": record_length,
+        "device_id": device_id,
+        "acquisition_level": acquisition_level,
+        "scale_units": scale_units,
+        "scan_x_res": scan_x_res,
+        "scan_y_res": scan_y_res,
+        "x_res": x_res,
+        "y_res": y_res,
+        "dpi": dpi,
+        "pixel_depth": pixel_depth,
+        "compression": compression,
+        "views": views,
+    }
+
+def raw_image_from_fir(image_data, image_fmt=None):
+    """
+    Locate the first uncompressed 8-bit view of a finger image record.
+
+    :param image_data: The record (bytes-like).
+    :param image_fmt: The DPFPDD_IMG_FMT the record was captured in.
+    :return: A dictionary with "data" (a memoryview of the pixels), "image",
+             "width", "height", "dpi", "bpp" and "finger_pos", or None if the
+             record holds no such view.
+    """
+    parsed = parse_fir(image_data, image_fmt)
+    if parsed is None:
+        return None
+    for view in parsed["views"]:
+        if view["image"] is not None:
+            return {
+                "data": view["data"],
+                "image": view["image"],
+                "width": view["width"],
+                "height": view["height"],
+                "dpi": parsed["dpi"],
+                "bpp": parsed["pixel_depth"],
+                "finger_pos": view["finger_pos"],
+            }
+    logging.error(f"FIR has no uncompressed 8-bit view (compression {parsed['compression']}, "
+                  f"depth {parsed['pixel_depth']}).")
+    return None
@@ -0,0 +1,231 @@
+import struct
+import logging
+import numpy as np
+
+# Define DPFJ_FMD_FORMAT constants
+DPFJ_FMD_ANSI_378_2004 = 0x001B0001
+DPFJ_FMD_ISO_19794_2_2005 = 0x01010001
+
+# Minutia types (two high bits of the x coordinate)
+MINUTIA_TYPE_OTHER = 0
+MINUTIA_TYPE_RIDGE_ENDING = 1
+MINUTIA_TYPE_BIFURCATION = 2
+
+# Header sizes in bytes
+ANSI_HEADER_SIZE = 26          # record length stored in 2 bytes
+ANSI_LONG_HEADER_SIZE = 30     # record length 0x0000 followed by 4 bytes
+ISO_HEADER_SIZE = 24
+VIEW_HEADER_SIZE = 4
+MINUTIA_SIZE = 6
+
+# Degrees per angle unit: ANSI stores 2 degree steps, ISO 360/256 degree steps
+ANSI_ANGLE_UNIT = 2.0
+ISO_ANGLE_UNIT = 360.0 / 256.0
+
+# Decoded minutia
+MINUTIA_DTYPE = np.dtype([
+    ("x", np.uint16),
+    ("y", np.uint16),
+    ("angle", np.float32),   # degrees
+    ("type", np.uint8),
+    ("quality", np.uint8),
+])
+
+# Minutia as stored in the record (big-endian), viewed in place
+RAW_MINUTIA_DTYPE = np.dtype([
+    ("type_x", ">u2"),
+    ("y", ">u2"),
+    ("angle", "u1"),
+    ("quality", "u1"),
+])
+
+def _header_size(data, fmd_type):
+    if fmd_type == DPFJ_FMD_ISO_19794_2_2005:
+        return ISO_HEADER_SIZE
+    # ANSI: a zero 2-byte record length means the 4-byte length follows
+    if data[8] == 0 and data[9] == 0:
+        return ANSI_LONG_HEADER_SIZE
+    return ANSI_HEADER_SIZE
+
+def _decode_minutiae(raw, angle_unit):
+    minutiae = np.empty(len(raw), dtype=MINUTIA_DTYPE)
+    type_x = raw["type_x"]
+    minutiae["x"] = type_x & 0x3FFF
+    minutiae["type"] = type_x >> 14
+    minutiae["y"] = raw["y"] & 0x3FFF
+    minutiae["angle"] = raw["angle"] * np.float32(angle_unit)
+    minutiae["quality"] = raw["quality"]
+    return minutiae
+
+def parse_fmd(fmd_data, fmd_type=DPFJ_FMD_ANSI_378_2004):
+    """
+    Parse an ANSI 378-2004 or ISO 19794-2-2005 FMD.
+
+    The minutiae are read with a NumPy view over the record, not one Python
+    object per minutia.
+
+    :param fmd_data: The FMD data (bytes-like).
+    :param fmd_type: The FMD format (default: DPFJ_FMD_ANSI_378_2004).
+    :return: A dictionary with the record header and a list of views, each holding
+             a MINUTIA_DTYPE array, or None if the record is malformed.
+    """
+    data = memoryview(fmd_data).cast("B")
+    if len(data) < ISO_HEADER_SIZE or bytes(data[:4]) != b"FMR\0":
+        logging.error("Invalid FMD header. Expected 'FMR'.")
+        return None
+
+    header_size = _header_size(data, fmd_type)
+    if len(data) < header_size:
+        logging.error(f"FMD too short for its header: {len(data)} bytes.")
+        return None
+
+    if fmd_type == DPFJ_FMD_ISO_19794_2_2005:
+        record_length = struct.unpack_from(">I", data, 8)[0]
+        width, height, x_res, y_res = struct.unpack_from(">HHHH", data, 14)
+        angle_unit = ISO_ANGLE_UNIT
+    else:
+        record_length = struct.unpack_from(">H", data, 8)[0]
+        if header_size == ANSI_LONG_HEADER_SIZE:
+            record_length = struct.unpack_from(">I", data, 10)[0]
+        width, height, x_res, y_res = struct.unpack_from(">HHHH", data, header_size - 10)
+        angle_unit = ANSI_ANGLE_UNIT
+    view_count = data[header_size - 2]
+
+    views = []
+    offset = header_size
+    for _ in range(view_count):
+        if offset + VIEW_HEADER_SIZE > len(data):
+            logging.error("FMD truncated inside a finger view header.")
+            return None
+        finger_pos, view_impression, quality, minutiae_count = data[offset:offset + VIEW_HEADER_SIZE]
+        offset += VIEW_HEADER_SIZE
+        end = offset + minutiae_count * MINUTIA_SIZE
+        if end > len(data):
+            logging.error("FMD truncated inside the minutiae block.")
+            return None
+        raw = np.frombuffer(data, dtype=RAW_MINUTIA_DTYPE, count=minutiae_count, offset=offset)
+        extended_length = struct.unpack_from(">H", data, end)[0] if end + 2 <= len(data) else 0
+        views.append({
+            "finger_pos": finger_pos,
+            "view_number": view_impression >> 4,
+            "impression_type": view_impression & 0x0F,
+            "quality": quality,
+            "minutiae": _decode_minutiae(raw, angle_unit),
+        })
+        offset = end + 2 + extended_length
+
+    return {
+        "format": fmd_type,
+        "record_length": record_length,
+        "width": width,
+        "height": height,
+        "x_res": x_res,
+        "y_res": y_res,
+        "views": views,
+    }
+
+def parse_gallery(buffer, offsets, sizes, fmd_type=DPFJ_FMD_ANSI_378_2004):
+    """
+    Parse the first view of many FMDs stored in one buffer, fully vectorized.
+
+    Header fields and minutiae of all templates are gathered with NumPy index
+    arithmetic, so the cost does not include a Python loop per template.
+
+    :param buffer: A bytes-like object holding the templates (e.g. a GalleryArena payload).
+    :param offsets: Start offset of each template in the buffer.
+    :param sizes: Size of each template in bytes.
+    :param fmd_type: The FMD format of every template.
+    :return: A dictionary of per-template arrays ("valid", "width", "height",
+             "quality", "counts", "starts") and one MINUTIA_DTYPE array
+             "minutiae"; template i owns minutiae[starts[i]:starts[i] + counts[i]].
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    count = len(offsets)
+    if len(data) < ANSI_LONG_HEADER_SIZE:
+        # Nothing in here can hold a header; pad so the vectorized reads stay in bounds
+        data = np.concatenate([data, np.zeros(ANSI_LONG_HEADER_SIZE, dtype=np.uint8)])
+
+    valid = sizes >= ISO_HEADER_SIZE + VIEW_HEADER_SIZE
+    safe = np.where(valid, offsets, 0)
+    valid &= (data[safe] == ord("F")) & (data[safe + 1] == ord("M")) & (data[safe + 2] == ord("R"))
+
+    if fmd_type == DPFJ_FMD_ISO_19794_2_2005:
+        header_size = np.full(count, ISO_HEADER_SIZE, dtype=np.int64)
+        angle_unit = ISO_ANGLE_UNIT
+    else:
+        long_header = (data[safe + 8] == 0) & (data[safe + 9] == 0)
+        header_size = np.where(long_header, ANSI_LONG_HEADER_SIZE, ANSI_HEADER_SIZE)
+        angle_unit = ANSI_ANGLE_UNIT
+    valid &= sizes >= header_size + VIEW_HEADER_SIZE
+    safe_header = np.where(valid, safe + header_size, 0)
+
+    def be16(position):
+        return (data[position].astype(np.uint16) << 8) | data[position + 1]
+
+    width = np.where(valid, be16(np.where(valid, safe_header - 10, 0)), 0)
+    height = np.where(valid, be16(np.where(valid, safe_header - 8, 0)), 0)
+    valid &= data[np.where(valid, safe_header - 2, 0)] > 0
+    quality = np.where(valid, data[safe_header + 2], 0)
+    counts = np.where(valid, data[safe_header + 3], 0).astype(np.int64)
+
+    # Drop templates whose minutiae block runs past the end of the record
+    first_minutia = safe_header + VIEW_HEADER_SIZE
+    overrun = first_minutia + counts * MINUTIA_SIZE > offsets + sizes
+    valid &= ~overrun
+    counts[~valid] = 0
+
+    starts = np.zeros(count, dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    total = int(counts.sum())
+    owner = np.repeat(np.arange(count), counts)
+    within = np.arange(total) - starts[owner]
+    position = first_minutia[owner] + within * MINUTIA_SIZE
+
+    minutiae = np.empty(total, dtype=MINUTIA_DTYPE)
+    b0 = data[position]
+    minutiae["x"] = ((b0.astype(np.uint16) & 0x3F) << 8) | data[position + 1]
+    minutiae["type"] = b0 >> 6
+    minutiae["y"] = ((data[position + 2].astype(np.uint16) & 0x3F) << 8) | data[position + 3]
+    minutiae["angle"] = data[position + 4] * np.float32(angle_unit)
+    minutiae["quality"] = data[position + 5]
+
+    invalid = int(count - valid.sum())
+    if invalid:
+        logging.warning(f"{invalid} of {count} templates could not be parsed.")
+
+    return {
+        "valid": valid,
+        "width": width.astype(np.uint16),
+        "height": height.astype(np.uint16),
+        "quality": quality.astype(np.uint8),
+        "counts": counts,
+        "starts": starts,
+        "minutiae": minutiae,
+    }
+
+def parse_fmds(fmds, fmd_type=DPFJ_FMD_ANSI_378_2004):
+    """
+    Parse a list of FMDs in one batch.
+
+    :param fmds: A list of FMDs (list of bytes).
+    :param fmd_type: The FMD format of every template.
+    :return: The same dictionary as parse_gallery.
+    """
+    sizes = np.fromiter((len(fmd) for fmd in fmds), dtype=np.int64, count=len(fmds))
+    offsets = np.zeros(len(fmds), dtype=np.int64)
+    np.cumsum(sizes[:-1], out=offsets[1:])
+    return parse_gallery(b"".join(fmds), offsets, sizes, fmd_type)
+
+def parse_arena(arena, fmd_type=DPFJ_FMD_ANSI_378_2004):
+    """
+    Parse every template of a GalleryArena in place.
+
+    :param arena: The GalleryArena holding the gallery.
+    :param fmd_type: The FMD format of every template.
+    :return: The same dictionary as parse_gallery, indexed by arena slot.
+    """
+    count = len(arena)
+    sizes = np.frombuffer(arena.fmds_sizes, dtype=np.uint32, count=count)
+    return parse_gallery(arena.payload(), arena.offsets, sizes, fmd_type)
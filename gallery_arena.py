@@ -0,0 +1,358 @@
+import ctypes
+from ctypes import c_ubyte, c_uint, c_void_p, POINTER
+import logging
+import numpy as np
+
+# Initial capacity of a new arena (templates are typically 300-500 bytes)
+DEFAULT_TEMPLATE_CAPACITY = 1024
+DEFAULT_AVERAGE_FMD_SIZE = 512
+
+class GalleryTables:
+    """
+    Read interface shared by every gallery handed to dpfj_identify.
+
+    Subclasses keep the pointer table in _ptrs (c_void_p per slot), its
+    POINTER(POINTER(c_ubyte)) cast in _ptrs_view, the size table in _sizes
+    (c_uint per slot), and one template_ids and user_ids entry per live slot.
+    """
+
+    def __len__(self):
+        return len(self.template_ids)
+
+    @property
+    def fmds_ptrs(self):
+        """Pointer table to pass as the fmds argument of dpfj_identify."""
+        return self._ptrs_view
+
+    @property
+    def pointer_table(self):
+        """The raw c_void_p pointer table (one entry per slot, plus spare capacity)."""
+        return self._ptrs
+
+    @property
+    def fmds_sizes(self):
+        """Size table to pass as the fmds_size argument of dpfj_identify."""
+        return self._sizes
+
+    def shard_ranges(self, shards):
+        """
+        Split the live slots into contiguous, nearly equal ranges.
+
+        :param shards: The number of shards wanted.
+        :return: A list of (start, stop) slot ranges, without empty ranges.
+        """
+        count = len(self.template_ids)
+        shards = max(1, min(shards, count))
+        step, extra = divmod(count, shards)
+        ranges = []
+        start = 0
+        for i in range(shards):
+            stop = start + step + (1 if i < extra else 0)
+            if stop > start:
+                ranges.append((start, stop))
+            start = stop
+        return ranges
+
+    def tables_at(self, start):
+        """
+        Get the pointer and size tables starting at a slot, without copying them.
+
+        :param start: The first slot of the shard.
+        :return: A (fmds_ptrs, fmds_sizes) pair usable as dpfj_identify arguments.
+        """
+        ptrs = ctypes.cast(ctypes.addressof(self._ptrs) + start * ctypes.sizeof(c_void_p), POINTER(POINTER(c_ubyte)))
+        sizes = ctypes.cast(ctypes.addressof(self._sizes) + start * ctypes.sizeof(c_uint), POINTER(c_uint))
+        return ptrs, sizes
+
+    def gather_tables(self, slots):
+        """
+        Copy the table entries of selected slots into new, dense tables.
+
+        :param slots: The slots to include, in the order the SDK should see them.
+        :return: A (fmds_ptrs, fmds_sizes) pair usable as dpfj_identify arguments.
+        """
+        count = len(slots)
+        ptrs = (c_void_p * max(1, count))()
+        sizes = (c_uint * max(1, count))()
+        for i, slot in enumerate(slots):
+            ptrs[i] = self._ptrs[slot]
+            sizes[i] = self._sizes[slot]
+        return ctypes.cast(ptrs, POINTER(POINTER(c_ubyte))), sizes
+
+class GallerySnapshot(GalleryTables):
+    """
+    Frozen copy of a gallery's tables, matched without holding the gallery lock.
+
+    The pointer and size tables and the ID lists are copied; the template
+    bytes are not. They stay valid because GalleryArena never rewrites a live
+    template in place (growth and compaction move to a new buffer) and the
+    snapshot keeps the buffer it points into referenced.
+    """
+
+    def __init__(self, ptrs, sizes, template_ids, user_ids, keepalive=None):
+        """
+        :param ptrs: The c_void_p pointer table.
+        :param sizes: The c_uint size table.
+        :param template_ids: The fingerprints row ID of each slot.
+        :param user_ids: The user of each slot.
+        :param keepalive: Objects owning the template bytes.
+        """
+        self._ptrs = ptrs
+        self._ptrs_view = ctypes.cast(ptrs, POINTER(POINTER(c_ubyte)))
+        self._sizes = sizes
+        self.template_ids = template_ids
+        self.user_ids = user_ids
+        self._keepalive = keepalive
+        self._slot_of = None
+
+    def slot_of(self, template_id):
+        """
+        :param template_id: The fingerprints row ID of the template.
+        :return: The slot index of the template, or None if it is not in the snapshot.
+        """
+        if self._slot_of is None:
+            self._slot_of = {template_id: slot for slot, template_id in enumerate(self.template_ids)}
+        return self._slot_of.get(template_id)
+
+class GalleryArena(GalleryTables):
+    """
+    Contiguous storage for the gallery templates handed to dpfj_identify.
+
+    All FMDs live in one ctypes byte buffer. The pointer table and the size
+    table that dpfj_identify expects are kept up to date on append/remove, so
+    a probe passes existing memory to the SDK without copying anything.
+
+    Appends grow the buffer and the tables geometrically. Removing a template
+    moves the last live template into its slot so the tables stay dense; the
+    removed bytes are left behind as a tombstone and reclaimed by compact().
+    """
+
+    def __init__(self, template_capacity=DEFAULT_TEMPLATE_CAPACITY, byte_capacity=None):
+        """
+        :param template_capacity: Number of templates to reserve room for.
+        :param byte_capacity: Number of payload bytes to reserve (default: estimated
+                              from template_capacity).
+        """
+        template_capacity = max(1, template_capacity)
+        if byte_capacity is None:
+            byte_capacity = template_capacity * DEFAULT_AVERAGE_FMD_SIZE
+        self._buffer = (c_ubyte * max(1, byte_capacity))()
+        self._ptrs = (c_void_p * template_capacity)()
+        self._sizes = (c_uint * template_capacity)()
+        self._offsets = []
+        self._used_bytes = 0
+        self._wasted_bytes = 0
+        self.user_ids = []
+        self.template_ids = []
+        self._slot_of = {}
+        self._ptrs_view = ctypes.cast(self._ptrs, POINTER(POINTER(c_ubyte)))
+
+    def __contains__(self, template_id):
+        return template_id in self._slot_of
+
+    @property
+    def offsets(self):
+        """Payload offset of each live slot."""
+        return self._offsets
+
+    @property
+    def used_bytes(self):
+        return self._used_bytes
+
+    @property
+    def wasted_bytes(self):
+        return self._wasted_bytes
+
+    def _base_address(self):
+        return ctypes.addressof(self._buffer)
+
+    def _grow_bytes(self, required):
+        capacity = len(self._buffer)
+        while capacity < required:
+            capacity *= 2
+        buffer = (c_ubyte * capacity)()
+        ctypes.memmove(buffer, self._buffer, self._used_bytes)
+        self._buffer = buffer
+
+        # The buffer moved, so every pointer in the table has to follow it
+        base = self._base_address()
+        for slot, offset in enumerate(self._offsets):
+            self._ptrs[slot] = base + offset
+        logging.debug(f"Gallery arena grown to {capacity} bytes.")
+
+    def _grow_slots(self):
+        capacity = len(self._ptrs) * 2
+        ptrs = (c_void_p * capacity)()
+        sizes = (c_uint * capacity)()
+        count = len(self.template_ids)
+        ctypes.memmove(ptrs, self._ptrs, count * ctypes.sizeof(c_void_p))
+        ctypes.memmove(sizes, self._sizes, count * ctypes.sizeof(c_uint))
+        self._ptrs = ptrs
+        self._sizes = sizes
+        self._ptrs_view = ctypes.cast(self._ptrs, POINTER(POINTER(c_ubyte)))
+        logging.debug(f"Gallery arena tables grown to {capacity} slots.")
+
+    def slot_of(self, template_id):
+        """
+        :param template_id: The fingerprints row ID of the template.
+        :return: The slot index of the template, or None if it is not in the arena.
+        """
+        return self._slot_of.get(template_id)
+
+    def append(self, template_id, user_id, fmd):
+        """
+        Add a template to the arena.
+
+        :param template_id: The fingerprints row ID of the template.
+        :param user_id: The user the template belongs to.
+        :param fmd: The FMD data (bytes-like).
+        :return: The slot index of the template.
+        """
+        if template_id in self._slot_of:
+            self.remove(template_id)
+
+        size = len(fmd)
+        if self._used_bytes + size > len(self._buffer):
+            self._grow_bytes(self._used_bytes + size)
+        if len(self.template_ids) == len(self._ptrs):
+            self._grow_slots()
+
+        offset = self._used_bytes
+        memoryview(self._buffer).cast("B")[offset:offset + size] = fmd
+        self._used_bytes += size
+
+        slot = len(self.template_ids)
+        self._ptrs[slot] = self._base_address() + offset
+        self._sizes[slot] = size
+        self._offsets.append(offset)
+        self.user_ids.append(user_id)
+        self.template_ids.append(template_id)
+        self._slot_of[template_id] = slot
+        return slot
+
+    def extend_packed(self, payload, offsets, sizes, template_ids, user_ids):
+        """
+        Append many templates stored back to back in one buffer (e.g. a mapped gallery file).
+
+        The payload is copied with a single memmove and the pointer table is
+        filled with vectorized arithmetic. The template IDs must not already be
+        in the arena.
+
+        :param payload: A bytes-like object holding the templates.
+        :param offsets: Offset of each template in the payload.
+        :param sizes: Size of each template in bytes.
+        :param template_ids: The fingerprints row ID of each template.
+        :param user_ids: The user of each template.
+        :return: The number of templates appended.
+        """
+        source = np.frombuffer(payload, dtype=np.uint8)
+        count = len(template_ids)
+        if self._used_bytes + len(source) > len(self._buffer):
+            self._grow_bytes(self._used_bytes + len(source))
+        while len(self.template_ids) + count > len(self._ptrs):
+            self._grow_slots()
+
+        start_offset = self._used_bytes
+        if len(source):
+            ctypes.memmove(self._base_address() + start_offset, source.ctypes.data, len(source))
+        self._used_bytes += len(source)
+
+        first = len(self.template_ids)
+        new_offsets = start_offset + np.asarray(offsets, dtype=np.int64)
+        np.frombuffer(self._ptrs, dtype=np.uintp)[first:first + count] = self._base_address() + new_offsets
+        np.frombuffer(self._sizes, dtype=np.uint32)[first:first + count] = sizes
+        self._offsets.extend(new_offsets.tolist())
+        self.template_ids.extend(template_ids)
+        self.user_ids.extend(user_ids)
+        self._slot_of.update(zip(template_ids, range(first, first + count)))
+        return count
+
+    def remove(self, template_id):
+        """
+        Remove a template from the arena.
+
+        The last template is moved into the freed slot; its payload bytes stay
+        where they are, the removed payload becomes a tombstone.
+
+        :param template_id: The fingerprints row ID of the template.
+        :return: True if the template was present, False otherwise.
+        """
+        slot = self._slot_of.pop(template_id, None)
+        if slot is None:
+            return False
+
+        self._wasted_bytes += self._sizes[slot]
+        last = len(self.template_ids) - 1
+        if slot != last:
+            self._ptrs[slot] = self._ptrs[last]
+            self._sizes[slot] = self._sizes[last]
+            self._offsets[slot] = self._offsets[last]
+            self.user_ids[slot] = self.user_ids[last]
+            self.template_ids[slot] = self.template_ids[last]
+            self._slot_of[self.template_ids[slot]] = slot
+        self._ptrs[last] = None
+        self._sizes[last] = 0
+        self._offsets.pop()
+        self.user_ids.pop()
+        self.template_ids.pop()
+
+        if self._wasted_bytes > self._used_bytes // 2:
+            self.compact()
+        return True
+
+    def remove_user(self, user_id):
+        """
+        Remove every template of a user.
+
+        :param user_id: The ID of the user.
+        :return: The number of templates removed.
+        """
+        template_ids = [tid for tid, uid in zip(self.template_ids, self.user_ids) if uid == user_id]
+        for template_id in template_ids:
+            self.remove(template_id)
+        return len(template_ids)
+
+    def compact(self):
+        """Rewrite the live templates back to back, reclaiming tombstoned bytes."""
+        if not self._wasted_bytes:
+            return
+        buffer = (c_ubyte * len(self._buffer))()
+        base = ctypes.addressof(buffer)
+        offset = 0
+        for slot, old_offset in enumerate(self._offsets):
+            size = self._sizes[slot]
+            ctypes.memmove(base + offset, self._base_address() + old_offset, size)
+            self._offsets[slot] = offset
+            self._ptrs[slot] = base + offset
+            offset += size
+        self._buffer = buffer
+        logging.debug(f"Gallery arena compacted: {self._wasted_bytes} bytes reclaimed.")
+        self._used_bytes = offset
+        self._wasted_bytes = 0
+
+    def snapshot(self):
+        """
+        Copy the tables so the gallery can be matched while the arena keeps changing.
+
+        :return: A GallerySnapshot of the live slots.
+        """
+        count = len(self.template_ids)
+        ptrs = (c_void_p * max(1, count))()
+        sizes = (c_uint * max(1, count))()
+        ctypes.memmove(ptrs, self._ptrs, count * ctypes.sizeof(c_void_p))
+        ctypes.memmove(sizes, self._sizes, count * ctypes.sizeof(c_uint))
+        return GallerySnapshot(ptrs, sizes, list(self.template_ids), list(self.user_ids), self._buffer)
+
+    def payload(self):
+        """Get the template bytes region of the arena without copying it."""
+        return memoryview(self._buffer).cast("B")[:self._used_bytes]
+
+    def template(self, slot):
+        """
+        Get a template without copying it.
+
+        :param slot: The slot index.
+        :return: A memoryview over the template bytes inside the arena.
+        """
+        offset = self._offsets[slot]
+        return memoryview(self._buffer).cast("B")[offset:offset + self._sizes[slot]]
@@ -0,0 +1,309 @@
+import os
+import mmap
+import time
+import struct
+import ctypes
+from ctypes import c_ubyte, c_uint, c_void_p, POINTER
+import logging
+import numpy as np
+
+from db_schema import DB_PATH
+from enrollment_repository import get_repository
+from fmd_parser import DPFJ_FMD_ANSI_378_2004
+from gallery_arena import GalleryArena, GallerySnapshot, GalleryTables
+
+# Packed gallery file (little endian, every section 8-byte aligned):
+#   header
+#   payload         all FMDs back to back, in fingerprints row order
+#   offsets         uint64[count], relative to the payload
+#   sizes           uint32[count]
+#   template_ids    int64[count], fingerprints row IDs
+#   user_index      uint32[count], index into the user table
+#   user_offsets    uint64[users + 1], into the user blob
+#   user_blob       UTF-8 user IDs back to back
+GALLERY_MAGIC = b"FPGALLRY"
+GALLERY_VERSION = 2
+# magic, version, reserved, fmd_type, count, users, last_row_id, change_seq, then the section positions
+GALLERY_HEADER = struct.Struct("<8sHHIQQQQQQQQQQQQ")
+
+def gallery_path_for(db_path):
+    """
+    :param db_path: Path to the SQLite enrollment database.
+    :return: The path of the packed gallery file stored next to it.
+    """
+    return os.path.splitext(db_path)[0] + ".gallery"
+
+def _align(f):
+    padding = -f.tell() % 8
+    if padding:
+        f.write(b"\0" * padding)
+    return f.tell()
+
+def build_gallery_file(db_path=DB_PATH, path=None, fmd_type=DPFJ_FMD_ANSI_378_2004):
+    """
+    Write the stored templates of a database to a packed gallery file.
+
+    Templates are streamed from the database straight into the payload section;
+    the file is written next to the target and renamed over it when complete.
+
+    :param db_path: Path to the SQLite enrollment database.
+    :param path: Output path (default: gallery_path_for(db_path)).
+    :param fmd_type: The FMD format of the templates to include.
+    :return: The number of templates written, or None if the file could not be written.
+    """
+    path = path or gallery_path_for(db_path)
+    temp_path = path + ".tmp"
+    start = time.perf_counter()
+    offsets = []
+    sizes = []
+    template_ids = []
+    user_index = []
+    user_slots = {}
+    repository = get_repository(db_path)
+    # Read before the scan: changes racing with it are applied again by sync, harmlessly
+    change_seq = repository.change_watermark()
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(b"\0" * GALLERY_HEADER.size)
+            payload_pos = _align(f)
+            offset = 0
+            for template in repository.iter_templates(fmd_type):
+                fmd = template.fmd
+                f.write(fmd)
+                offsets.append(offset)
+                sizes.append(len(fmd))
+                offset += len(fmd)
+                template_ids.append(template.id)
+                user_index.append(user_slots.setdefault(template.user_id, len(user_slots)))
+            payload_size = offset
+
+            user_blobs = [str(user_id).encode("utf-8") for user_id in user_slots]
+            user_offsets = np.zeros(len(user_blobs) + 1, dtype="<u8")
+            np.cumsum([len(blob) for blob in user_blobs], out=user_offsets[1:])
+
+            positions = []
+            for values, dtype in ((offsets, "<u8"), (sizes, "<u4"), (template_ids, "<i8"), (user_index, "<u4")):
+                positions.append(_align(f))
+                f.write(np.asarray(values, dtype=dtype).tobytes())
+            positions.append(_align(f))
+            f.write(user_offsets.tobytes())
+            positions.append(_align(f))
+            f.write(b"".join(user_blobs))
+
+            f.seek(0)
+            f.write(GALLERY_HEADER.pack(
+                GALLERY_MAGIC, GALLERY_VERSION, 0, fmd_type, len(template_ids), len(user_blobs),
+                max(template_ids, default=0), change_seq, payload_pos, payload_size, *positions
+            ))
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"[ERROR] Failed to write gallery file {path}: {e}")
+        logging.error(f"Failed to write gallery file {path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+    elapsed = time.perf_counter() - start
+    print(f"[DEBUG] Gallery file written: {len(template_ids)} templates in {elapsed:.2f} s.")
+    logging.debug(f"Gallery file {path} written: {len(template_ids)} templates, {payload_size} payload bytes.")
+    return len(template_ids)
+
+class _UserIds:
+    """Read-only, lazily decoded view of the user ID of each slot."""
+
+    def __init__(self, user_index, user_offsets, user_blob):
+        self._user_index = user_index
+        self._user_offsets = user_offsets
+        self._user_blob = user_blob
+
+    def __len__(self):
+        return len(self._user_index)
+
+    def __getitem__(self, slot):
+        if isinstance(slot, slice):
+            return [self[i] for i in range(*slot.indices(len(self)))]
+        user = self._user_index[slot]
+        return bytes(self._user_blob[self._user_offsets[user]:self._user_offsets[user + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        return (self[slot] for slot in range(len(self)))
+
+class GalleryFile(GalleryTables):
+    """
+    Read-only gallery served straight from a memory-mapped packed gallery file.
+
+    Opening the file maps it and builds the pointer table with one vectorized
+    addition, so startup does not depend on parsing templates. dpfj_identify
+    reads the payload in place, and processes mapping the same file share its
+    pages through the OS page cache. It shares the GalleryTables read interface
+    with GalleryArena, so IdentificationEngine and PrefilterIndex use it
+    unchanged; to_arena() copies it into a writable GalleryArena.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path to a file written by build_gallery_file.
+        """
+        self.path = path
+        self.fmd_type = None
+        self.last_row_id = 0
+        self.change_seq = 0
+        self.template_ids = []
+        self.user_ids = []
+        self._file = None
+        self._map = None
+        self._bytes = None
+        self._payload = None
+        self._offsets = None
+        self._sizes = None
+        self._ptrs = None
+        self._ptrs_view = None
+        self._keepalive = None
+        self._slot_of = None
+
+    def __contains__(self, template_id):
+        return self.slot_of(template_id) is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """
+        Map the file and build the tables passed to dpfj_identify.
+
+        :return: True on success, False if the file is missing or malformed.
+        """
+        try:
+            self._file = open(self.path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] Failed to map gallery file {self.path}: {e}")
+            logging.error(f"Failed to map gallery file {self.path}: {e}")
+            self.close()
+            return False
+
+        data = np.frombuffer(self._map, dtype=np.uint8)
+        if len(data) < GALLERY_HEADER.size:
+            return self._reject("file too short")
+        (magic, version, _, fmd_type, count, users, last_row_id, change_seq, payload_pos, payload_size,
+         offsets_pos, sizes_pos, ids_pos, user_index_pos, user_offsets_pos, user_blob_pos) = \
+            GALLERY_HEADER.unpack_from(self._map, 0)
+        if magic != GALLERY_MAGIC or version != GALLERY_VERSION:
+            return self._reject("unknown format")
+        if user_blob_pos > len(data) or payload_pos + payload_size > len(data):
+            return self._reject("truncated")
+
+        self._bytes = data
+        self._payload = data[payload_pos:payload_pos + payload_size]
+        self._offsets = np.frombuffer(self._map, dtype="<u8", count=count, offset=offsets_pos)
+        sizes = np.frombuffer(self._map, dtype="<u4", count=count, offset=sizes_pos)
+        ids = np.frombuffer(self._map, dtype="<i8", count=count, offset=ids_pos)
+        user_index = np.frombuffer(self._map, dtype="<u4", count=count, offset=user_index_pos)
+        user_offsets = np.frombuffer(self._map, dtype="<u8", count=users + 1, offset=user_offsets_pos)
+
+        # Pointers are process-local: the only per-process work is base + offsets
+        ptrs = (self._payload.ctypes.data + self._offsets).astype(np.uintp)
+        self._ptrs = (c_void_p * max(1, count)).from_buffer(ptrs) if count else (c_void_p * 1)()
+        self._ptrs_view = ctypes.cast(self._ptrs, POINTER(POINTER(c_ubyte)))
+        # The SDK only reads the size table, so it can stay inside the read-only mapping
+        self._sizes = (c_uint * max(1, count)).from_address(sizes.ctypes.data) if count else (c_uint * 1)()
+        self._keepalive = (ptrs, sizes)
+
+        self.fmd_type = fmd_type
+        self.last_row_id = last_row_id
+        self.change_seq = change_seq
+        self.template_ids = ids.tolist()
+        self.user_ids = _UserIds(user_index, user_offsets, data[user_blob_pos:])
+        self._slot_of = None
+        logging.debug(f"Gallery file {self.path} mapped: {count} templates.")
+        return True
+
+    def _reject(self, reason):
+        print(f"[ERROR] Invalid gallery file {self.path}: {reason}.")
+        logging.error(f"Invalid gallery file {self.path}: {reason}.")
+        self.close()
+        return False
+
+    def close(self):
+        """Unmap the file. Tables handed out earlier must no longer be used."""
+        self._bytes = self._payload = self._offsets = None
+        self._ptrs = self._ptrs_view = self._sizes = None
+        self._keepalive = None
+        self.template_ids = []
+        self.user_ids = []
+        self._slot_of = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A NumPy view is still alive somewhere; the mapping goes with it
+                logging.debug(f"Gallery file {self.path} still referenced; unmapped on release.")
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def offsets(self):
+        """Payload offset of each slot."""
+        return self._offsets
+
+    def slot_of(self, template_id):
+        """
+        :param template_id: The fingerprints row ID of the template.
+        :return: The slot index of the template, or None if it is not in the file.
+        """
+        if self._slot_of is None:
+            # Built on first use: plain identification never needs it
+            self._slot_of = {template_id: slot for slot, template_id in enumerate(self.template_ids)}
+        return self._slot_of.get(template_id)
+
+    def snapshot(self):
+        """
+        Share the read-only tables with a snapshot.
+
+        The snapshot holds NumPy views of the mapping, so closing the file
+        afterwards defers the unmap until the snapshot is released.
+
+        :return: A GallerySnapshot of the file.
+        """
+        return GallerySnapshot(self._ptrs, self._sizes, self.template_ids, self.user_ids,
+                               (self._bytes, self._keepalive))
+
+    def payload(self):
+        """Get the template bytes region of the file without copying it."""
+        return memoryview(self._payload)
+
+    def template(self, slot):
+        """
+        Get a template without copying it.
+
+        :param slot: The slot index.
+        :return: A memoryview over the template bytes inside the mapping.
+        """
+        offset = int(self._offsets[slot])
+        return memoryview(self._payload[offset:offset + self._sizes[slot]])
+
+    def to_arena(self):
+        """
+        Copy the gallery into a writable GalleryArena, keeping the slot order.
+
+        :return: A new GalleryArena.
+        """
+        count = len(self)
+        arena = GalleryArena(template_capacity=count, byte_capacity=len(self._payload))
+        sizes = np.frombuffer(self._sizes, dtype=np.uint32, count=count)
+        arena.extend_packed(self._payload, self._offsets, sizes, self.template_ids, list(self.user_ids))
+        return arena
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build a packed gallery file from the enrollment database.")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the enrollment database.")
+    parser.add_argument("--out", default=None, help="Output path (default: next to the database).")
+    args = parser.parse_args()
+    build_gallery_file(args.db, args.out)
@@ -0,0 +1,638 @@
+import ctypes
+from ctypes import c_int, c_uint, POINTER, Structure, c_ubyte, byref
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from gallery_arena import GalleryArena
+from gallery_file import GalleryFile
+from db_schema import open_database
+from enrollment_repository import get_repository
+from match_scores import DEFAULT_THRESHOLD_SCORE, resolve_threshold, top_k
+
+# Define DPFJ_FMD_FORMAT constants
+DPFJ_FMD_ANSI_378_2004 = 0x001B0001
+DPFJ_FMD_ISO_19794_2_2005 = 0x01010001
+
+# Define DPFJ_FMD_FORMAT type
+DPFJ_FMD_FORMAT = c_int
+
+# Define DPFJ_SUCCESS and other error codes
+DPFJ_SUCCESS = 0
+DPFJ_E_MORE_DATA = 0x05BA000D
+DPFJ_E_INVALID_PARAMETER = 0x05BA0001
+DPFJ_E_FAILURE = 0x05BA0004
+
+# Changes applied per lock acquisition during sync(), so identification can interleave
+SYNC_CHUNK = 256
+
+# Finger position passed to the extractor when it is not known
+DPFJ_POSITION_UNKNOWN = 0
+
+# Define DPFJ_VER_INFO and DPFJ_VERSION structures
+class DPFJ_VER_INFO(Structure):
+    _fields_ = [
+        ("major", c_int),       # major version number
+        ("minor", c_int),       # minor version number
+        ("maintanance", c_int)  # maintenance or revision number
+    ]
+
+class DPFJ_VERSION(Structure):
+    _fields_ = [
+        ("size", c_uint),            # Size of the structure, in bytes
+        ("lib_ver", DPFJ_VER_INFO),  # File version of the library/SDK
+        ("api_ver", DPFJ_VER_INFO)   # Version of the API
+    ]
+
+# Define DPFJ_CANDIDATE structure
+class DPFJ_CANDIDATE(Structure):
+    _fields_ = [
+        ("size", c_uint),      # Size of the structure, in bytes
+        ("fmd_idx", c_uint),   # Index of the FMD in the input array
+        ("view_idx", c_uint)   # Index of the view in the FMD
+    ]
+
+# Result of an identification, ordered from best to worst score
+Candidate = namedtuple("Candidate", ["user_id", "score", "template_id", "view_idx"])
+
+dpfj_dll = None
+
+def load_dpfj_dll(path="dpfj.dll"):
+    """
+    Load the DPFJ library once and define the matching and extraction function prototypes.
+
+    :param path: Path or name of the DPFJ library.
+    :return: The loaded library handle.
+    """
+    global dpfj_dll
+    if dpfj_dll is not None:
+        return dpfj_dll
+
+    dll = ctypes.WinDLL(path)
+
+    # Define dpfj_compare function
+    dll.dpfj_compare.argtypes = [
+        DPFJ_FMD_FORMAT,          # fmd1_type
+        ctypes.POINTER(c_ubyte),  # fmd1
+        c_uint,                   # fmd1_size
+        c_uint,                   # fmd1_view_idx
+        DPFJ_FMD_FORMAT,          # fmd2_type
+        ctypes.POINTER(c_ubyte),  # fmd2
+        c_uint,                   # fmd2_size
+        c_uint,                   # fmd2_view_idx
+        ctypes.POINTER(c_uint)    # score
+    ]
+    dll.dpfj_compare.restype = c_int
+
+    # Define dpfj_identify function
+    dll.dpfj_identify.argtypes = [
+        DPFJ_FMD_FORMAT,          # fmd1_type
+        ctypes.POINTER(c_ubyte),  # fmd1
+        c_uint,                   # fmd1_size
+        c_uint,                   # fmd1_view_idx
+        DPFJ_FMD_FORMAT,          # fmds_type
+        c_uint,                   # fmds_cnt
+        ctypes.POINTER(ctypes.POINTER(c_ubyte)),  # fmds
+        ctypes.POINTER(c_uint),   # fmds_size
+        c_uint,                   # threshold_score
+        ctypes.POINTER(c_uint),   # candidate_cnt
+        ctypes.POINTER(DPFJ_CANDIDATE)  # candidates
+    ]
+    dll.dpfj_identify.restype = c_int
+
+    # Define dpfj_create_fmd_from_raw function
+    dll.dpfj_create_fmd_from_raw.argtypes = [
+        ctypes.POINTER(c_ubyte),  # image_data
+        c_uint,                   # image_size
+        c_uint,                   # image_width
+        c_uint,                   # image_height
+        c_uint,                   # image_dpi
+        c_int,                    # finger_pos
+        c_uint,                   # cbeff_id
+        DPFJ_FMD_FORMAT,          # fmd_type
+        ctypes.POINTER(c_ubyte),  # fmd
+        ctypes.POINTER(c_uint)    # fmd_size
+    ]
+    dll.dpfj_create_fmd_from_raw.restype = c_int
+
+    # Define dpfj_version function
+    dll.dpfj_version.argtypes = [POINTER(DPFJ_VERSION)]
+    dll.dpfj_version.restype = c_int
+
+    dpfj_dll = dll
+    return dpfj_dll
+
+def get_sdk_version():
+    """
+    Get the DPFJ library version as a string.
+
+    :return: The version string (e.g. "3.4.1") or None if failed.
+    """
+    version = DPFJ_VERSION()
+    version.size = ctypes.sizeof(DPFJ_VERSION)
+    result = load_dpfj_dll().dpfj_version(byref(version))
+    if result != DPFJ_SUCCESS:
+        logging.error(f"Failed to acquire version information. Error Code: {result}")
+        return None
+    return f"{version.lib_ver.major}.{version.lib_ver.minor}.{version.lib_ver.maintanance}"
+
+def ubyte_array(data):
+    """
+    Expose a buffer to the SDK as a c_ubyte array.
+
+    Writable buffers (a capture buffer, a memoryview or NumPy view over one) are
+    shared, not copied; read-only ones such as bytes are copied once.
+
+    :param data: A bytes-like object.
+    :return: A c_ubyte array over (or holding) the bytes of data.
+    """
+    view = memoryview(data).cast("B")
+    if view.readonly:
+        return (c_ubyte * len(view)).from_buffer_copy(view)
+    return (c_ubyte * len(view)).from_buffer(view)
+
+def create_fmd(image_data, width, height, dpi=500, finger_pos=DPFJ_POSITION_UNKNOWN, cbeff_id=0,
+               fmd_type=DPFJ_FMD_ANSI_378_2004):
+    """
+    Extract an FMD from a raw 8-bit grayscale image.
+
+    Same two-call pattern as create_fmd_from_raw in the scripts (size query,
+    then extraction), without the console output, for batch jobs.
+
+    :param image_data: The raw image data (bytes-like; writable buffers are not copied).
+    :param width: The width of the image in pixels.
+    :param height: The height of the image in pixels.
+    :param dpi: The resolution of the image in DPI.
+    :param finger_pos: The finger position.
+    :param cbeff_id: The CBEFF ID.
+    :param fmd_type: The target FMD format.
+    :return: The FMD data (bytes) or None if failed.
+    """
+    dll = load_dpfj_dll()
+    image_array = ubyte_array(image_data)
+    fmd_size = c_uint(0)
+    result = dll.dpfj_create_fmd_from_raw(image_array, len(image_array), width, height, dpi, finger_pos,
+                                          cbeff_id, fmd_type, None, byref(fmd_size))
+    if result != DPFJ_E_MORE_DATA:
+        logging.error(f"Failed to determine FMD buffer size. Error Code: {result}")
+        return None
+    fmd = (c_ubyte * fmd_size.value)()
+    result = dll.dpfj_create_fmd_from_raw(image_array, len(image_array), width, height, dpi, finger_pos,
+                                          cbeff_id, fmd_type, fmd, byref(fmd_size))
+    if result != DPFJ_SUCCESS:
+        logging.error(f"Failed to create FMD. Error Code: {result}")
+        return None
+    return bytes(fmd[:fmd_size.value])
+
+def identify_range(fmd_type, fmd_array, fmd_size, fmd_view_idx, fmds_ptrs, fmds_sizes, fmds_cnt,
+                   threshold_score, max_candidates):
+    """
+    Run dpfj_identify on a pointer/size table and score the returned candidates.
+
+    :param fmd_type: FMD format of the probe and of the gallery.
+    :param fmd_array: The probe FMD (c_ubyte array).
+    :param fmd_size: The probe FMD size in bytes.
+    :param fmd_view_idx: The view index in the probe FMD.
+    :param fmds_ptrs: Pointer table of the gallery templates.
+    :param fmds_sizes: Size table of the gallery templates.
+    :param fmds_cnt: Number of templates in the tables.
+    :param threshold_score: Dissimilarity threshold passed to the SDK.
+    :param max_candidates: The maximum number of candidates to return.
+    :return: A list of (score, index, view_idx) tuples, or None if the SDK failed.
+    """
+    dll = load_dpfj_dll()
+    candidates = (DPFJ_CANDIDATE * max_candidates)()
+    candidate_cnt = c_uint(max_candidates)
+
+    result = dll.dpfj_identify(
+        fmd_type,              # fmd1_type
+        fmd_array,             # fmd1
+        fmd_size,              # fmd1_size
+        fmd_view_idx,          # fmd1_view_idx
+        fmd_type,              # fmds_type
+        fmds_cnt,              # fmds_cnt
+        fmds_ptrs,             # fmds
+        fmds_sizes,            # fmds_size
+        threshold_score,       # threshold_score
+        byref(candidate_cnt),  # candidate_cnt
+        candidates             # candidates
+    )
+    if result != DPFJ_SUCCESS:
+        logging.error(f"Failed to identify fingerprint. Error Code: {result}")
+        return None
+
+    # dpfj_identify does not report scores; compare the few candidates to rank them
+    scored = []
+    score = c_uint(0)
+    for candidate in candidates[:candidate_cnt.value]:
+        idx = candidate.fmd_idx
+        result = dll.dpfj_compare(
+            fmd_type, fmd_array, fmd_size, fmd_view_idx,
+            fmd_type, fmds_ptrs[idx], fmds_sizes[idx], candidate.view_idx,
+            byref(score)
+        )
+        if result != DPFJ_SUCCESS:
+            logging.error(f"Failed to score candidate {idx}. Error Code: {result}")
+            continue
+        scored.append((score.value, idx, candidate.view_idx))
+    return scored
+
+class IdentificationEngine:
+    """
+    1:N identification over every template stored in the database.
+
+    The gallery is loaded once into a GalleryArena; each probe is then matched
+    with one dpfj_identify call per shard instead of a Python loop of
+    dpfj_compare. With shards > 1 the shards are matched concurrently on a
+    thread pool (ctypes releases the GIL during the SDK call) and the
+    candidates are merged by score, giving the same result as one shard.
+    Probes are matched against a snapshot of the gallery tables, so the lock
+    is only held by load, sync and enrollment changes, never across a match.
+    """
+
+    def __init__(self, db_path="fingerprint_enrollment.db", fmd_type=DPFJ_FMD_ANSI_378_2004, shards=1,
+                 prefilter=None):
+        """
+        :param db_path: Path to the SQLite enrollment database.
+        :param fmd_type: FMD format of the stored templates and of the probes.
+        :param shards: Number of gallery shards matched in parallel (default: 1).
+        :param prefilter: Optional PrefilterIndex used to prune the gallery before matching.
+        """
+        self.db_path = db_path
+        self.fmd_type = fmd_type
+        self.shards = max(1, shards)
+        self.prefilter = prefilter
+        self.arena = GalleryArena()
+        # Change feed watermark of the gallery contents
+        self.change_seq = 0
+        # Guards changes to the gallery; probes are matched against a snapshot outside it
+        self._lock = threading.RLock()
+        # Snapshot of the current gallery, dropped by every change
+        self._snapshot = None
+        self._executor = None
+
+    def __len__(self):
+        return len(self.arena)
+
+    @property
+    def user_ids(self):
+        return self.arena.user_ids
+
+    @property
+    def template_ids(self):
+        return self.arena.template_ids
+
+    def load(self):
+        """
+        Load all stored templates from the database into memory.
+
+        :return: The number of templates loaded.
+        """
+        conn = open_database(self.db_path)
+        try:
+            # Read before the scan: changes racing with it are applied again by sync, harmlessly
+            change_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM fingerprint_changes").fetchone()[0]
+            count, total_size = conn.execute(
+                "SELECT COUNT(*), TOTAL(LENGTH(fmd)) FROM fingerprints WHERE fmd IS NOT NULL AND fmd_type = ?",
+                (self.fmd_type,)
+            ).fetchone()
+            arena = GalleryArena(template_capacity=count, byte_capacity=int(total_size))
+            cursor = conn.execute(
+                "SELECT id, user_id, fmd FROM fingerprints WHERE fmd IS NOT NULL AND fmd_type = ? ORDER BY id",
+                (self.fmd_type,)
+            )
+            for template_id, user_id, fmd in cursor:
+                arena.append(template_id, user_id, fmd)
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.arena = arena
+            self._snapshot = None
+            self.change_seq = change_seq
+            if self.prefilter is not None:
+                self.prefilter.build(arena, self.fmd_type)
+        print(f"[DEBUG] Gallery loaded: {len(arena)} templates.")
+        logging.debug(f"Gallery loaded: {len(arena)} templates.")
+        return len(arena)
+
+    def load_file(self, path):
+        """
+        Serve the gallery from a packed gallery file instead of the database.
+
+        The file is memory-mapped and matched in place; the first enrollment or
+        removal afterwards copies it into an in-memory GalleryArena.
+
+        :param path: Path to a file written by gallery_file.build_gallery_file.
+        :return: The number of templates mapped, or None if the file could not be used.
+        """
+        gallery = GalleryFile(path)
+        if not gallery.open():
+            return None
+        if gallery.fmd_type != self.fmd_type:
+            print(f"[ERROR] Gallery file {path} holds format {gallery.fmd_type:#x}, expected {self.fmd_type:#x}.")
+            logging.error(f"Gallery file {path} holds format {gallery.fmd_type:#x}, expected {self.fmd_type:#x}.")
+            gallery.close()
+            return None
+
+        with self._lock:
+            previous = self.arena
+            self.arena = gallery
+            self._snapshot = None
+            self.change_seq = gallery.change_seq
+            if self.prefilter is not None:
+                self.prefilter.build(gallery, self.fmd_type)
+        if isinstance(previous, GalleryFile):
+            previous.close()
+        print(f"[DEBUG] Gallery mapped from {path}: {len(gallery)} templates.")
+        logging.debug(f"Gallery mapped from {path}: {len(gallery)} templates.")
+        return len(gallery)
+
+    def _writable_arena(self):
+        # Called with the lock held, before any change to the gallery
+        self._snapshot = None
+        if isinstance(self.arena, GalleryFile):
+            mapped = self.arena
+            self.arena = mapped.to_arena()
+            mapped.close()
+            logging.debug(f"Mapped gallery copied to memory for modification: {len(self.arena)} templates.")
+        return self.arena
+
+    def _current_snapshot(self):
+        # Called with the lock held; probes share one snapshot until the next change
+        if self._snapshot is None:
+            self._snapshot = self.arena.snapshot()
+        return self._snapshot
+
+    def add_template(self, template_id, user_id, fmd):
+        """
+        Add a newly enrolled template without reloading the gallery.
+
+        :param template_id: The fingerprints row ID of the template.
+        :param user_id: The ID of the user.
+        :param fmd: The FMD data (bytes).
+        """
+        with self._lock:
+            arena = self._writable_arena()
+            if self.prefilter is not None and template_id in arena:
+                self._remove_template(template_id)
+            arena.append(template_id, user_id, fmd)
+            if self.prefilter is not None:
+                self.prefilter.append(fmd)
+
+    def _remove_template(self, template_id):
+        # Free the prefilter row first: both follow the arena's swap-with-last removal
+        self._writable_arena()
+        slot = self.arena.slot_of(template_id)
+        self.arena.remove(template_id)
+        if self.prefilter is not None and slot is not None:
+            self.prefilter.remove_slot(slot)
+
+    def remove_user(self, user_id):
+        """
+        Drop every template of a user from the gallery.
+
+        :param user_id: The ID of the user.
+        :return: The number of templates removed.
+        """
+        with self._lock:
+            self._writable_arena()
+            if self.prefilter is None:
+                return self.arena.remove_user(user_id)
+            template_ids = [tid for tid, uid in zip(self.arena.template_ids, self.arena.user_ids) if uid == user_id]
+            for template_id in template_ids:
+                self._remove_template(template_id)
+            return len(template_ids)
+
+    def sync(self):
+        """
+        Apply the enrollments and deletions committed since the last load or sync.
+
+        Only the fingerprints listed in the change feed after the gallery's
+        watermark are read, so the cost follows the number of new enrollments,
+        not the gallery size. The delta is read without the gallery lock and
+        applied in chunks of SYNC_CHUNK, so identification keeps being served
+        while a sync runs.
+
+        :return: The number of changed fingerprints applied, or None if the gallery
+                 had to be reloaded because the feed no longer covers its watermark.
+        """
+        repository = get_repository(self.db_path)
+        first_seq = repository.first_change_seq()
+        if first_seq is not None and first_seq > self.change_seq + 1:
+            print("[ERROR] Change feed was pruned past the gallery watermark. Reloading.")
+            logging.error(f"Change feed starts at {first_seq}, gallery is at {self.change_seq}; reloading.")
+            self.load()
+            return None
+
+        changes = repository.changes_since(self.change_seq, self.fmd_type)
+        for start in range(0, len(changes), SYNC_CHUNK):
+            chunk = changes[start:start + SYNC_CHUNK]
+            with self._lock:
+                for change in chunk:
+                    present = change.fingerprint_id in self.arena
+                    if change.fmd is None:
+                        if present:
+                            self._remove_template(change.fingerprint_id)
+                    elif not (present and change.operation == "insert"):
+                        # An insert already in the gallery was added by the enrolling thread
+                        self.add_template(change.fingerprint_id, change.user_id, bytes(change.fmd))
+                self.change_seq = chunk[-1].seq
+
+        if changes:
+            logging.debug(f"Gallery synced: {len(changes)} change(s) applied, watermark {self.change_seq}.")
+        repository.trim_changes(self.change_seq)
+        return len(changes)
+
+    def close(self):
+        """Shut down the shard thread pool and unmap a file-backed gallery."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            self._snapshot = None
+            if isinstance(self.arena, GalleryFile):
+                self.arena.close()
+                self.arena = GalleryArena()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.shards, thread_name_prefix="identify-shard")
+        return self._executor
+
+    def _identify_shard(self, arena, start, stop, fmd_array, fmd_size, fmd_view_idx, threshold_score, max_candidates):
+        fmds_ptrs, fmds_sizes = arena.tables_at(start)
+        scored = identify_range(self.fmd_type, fmd_array, fmd_size, fmd_view_idx,
+                                fmds_ptrs, fmds_sizes, stop - start, threshold_score, max_candidates)
+        if scored is None:
+            logging.error(f"Identification failed on shard {start}-{stop}.")
+            return None
+        return [(score, start + idx, view_idx) for score, idx, view_idx in scored]
+
+    def identify(self, fmd_data, max_candidates=10, target_fmr=None,
+                 threshold_score=DEFAULT_THRESHOLD_SCORE, fmd_view_idx=0, use_prefilter=True):
+        """
+        Return the top-k matches of a probe FMD over the whole gallery.
+
+        With a prefilter attached, only the templates it keeps are matched, in one
+        dpfj_identify call over gathered pointer and size tables.
+
+        :param fmd_data: The probe FMD (bytes).
+        :param max_candidates: The number of candidates (k) to return.
+        :param target_fmr: Target false match rate; overrides threshold_score if given.
+        :param threshold_score: Dissimilarity threshold passed to the SDK.
+        :param fmd_view_idx: The view index in the probe FMD.
+        :param use_prefilter: Set to False to match the full gallery even with a prefilter.
+        :return: A list of Candidate(user_id, score, template_id, view_idx) tuples
+                 sorted by score (best first), or None if identification failed.
+        """
+        threshold_score = resolve_threshold(target_fmr, threshold_score)
+        fmd_array = (c_ubyte * len(fmd_data)).from_buffer_copy(fmd_data)
+        prefiltered = use_prefilter and self.prefilter is not None
+        with self._lock:
+            arena = self._current_snapshot()
+            # The prefilter rows follow the live slots, so select while they still match the snapshot
+            slots = self.prefilter.select(fmd_data) if prefiltered and len(arena) else None
+        if not len(arena):
+            print("[ERROR] Gallery is empty. Call load() first.")
+            logging.error("Identification requested on an empty gallery.")
+            return []
+
+        if prefiltered:
+            return self._identify_prefiltered(arena, slots, fmd_array, len(fmd_data), fmd_view_idx,
+                                              threshold_score, max_candidates)
+
+        args = (fmd_array, len(fmd_data), fmd_view_idx, threshold_score, max_candidates)
+        ranges = arena.shard_ranges(self.shards)
+        if len(ranges) == 1:
+            shard_results = [self._identify_shard(arena, ranges[0][0], ranges[0][1], *args)]
+        else:
+            executor = self._get_executor()
+            futures = [executor.submit(self._identify_shard, arena, start, stop, *args) for start, stop in ranges]
+            shard_results = [future.result() for future in futures]
+
+        if any(scored is None for scored in shard_results):
+            return None
+
+        # Slot order breaks ties, so the merge does not depend on the shard count
+        merged = top_k((entry for scored in shard_results for entry in scored), max_candidates, threshold_score)
+        matches = [
+            Candidate(arena.user_ids[slot], score, arena.template_ids[slot], view_idx)
+            for score, slot, view_idx in merged
+        ]
+        logging.debug(f"Identification returned {len(matches)} candidate(s) from {len(ranges)} shard(s).")
+        return matches
+
+    def _identify_gathered(self, arena, slots, fmds_ptrs, fmds_sizes, fmd_array, fmd_size, fmd_view_idx,
+                           threshold_score, max_candidates):
+        scored = identify_range(self.fmd_type, fmd_array, fmd_size, fmd_view_idx,
+                                fmds_ptrs, fmds_sizes, len(slots), threshold_score, max_candidates)
+        if scored is None:
+            return None
+        best = top_k(((score, int(slots[idx]), view_idx) for score, idx, view_idx in scored),
+                     max_candidates, threshold_score)
+        return [
+            Candidate(arena.user_ids[slot], score, arena.template_ids[slot], view_idx)
+            for score, slot, view_idx in best
+        ]
+
+    def _identify_prefiltered(self, arena, slots, fmd_array, fmd_size, fmd_view_idx, threshold_score, max_candidates):
+        fmds_ptrs, fmds_sizes, keepalive = self.prefilter.gather_tables(arena, slots)
+        matches = self._identify_gathered(arena, slots, fmds_ptrs, fmds_sizes, fmd_array, fmd_size,
+                                          fmd_view_idx, threshold_score, max_candidates)
+        del keepalive
+        logging.debug(f"Prefiltered identification matched {len(slots)} of {len(arena)} templates.")
+        return matches
+
+    def identify_templates(self, fmd_data, template_ids, max_candidates=10, target_fmr=None,
+                           threshold_score=DEFAULT_THRESHOLD_SCORE, fmd_view_idx=0):
+        """
+        Match a probe against a candidate list only, e.g. the output of an index search.
+
+        :param fmd_data: The probe FMD (bytes).
+        :param template_ids: The fingerprints row IDs to match; IDs not in the gallery are skipped.
+        :param max_candidates: The number of candidates (k) to return.
+        :param target_fmr: Target false match rate; overrides threshold_score if given.
+        :param threshold_score: Dissimilarity threshold passed to the SDK.
+        :param fmd_view_idx: The view index in the probe FMD.
+        :return: A list of Candidate tuples sorted by score (best first), or None
+                 if identification failed.
+        """
+        threshold_score = resolve_threshold(target_fmr, threshold_score)
+        fmd_array = (c_ubyte * len(fmd_data)).from_buffer_copy(fmd_data)
+        with self._lock:
+            arena = self._current_snapshot()
+        slots = [slot for slot in map(arena.slot_of, template_ids) if slot is not None]
+        if not slots:
+            return []
+        fmds_ptrs, fmds_sizes = arena.gather_tables(slots)
+        return self._identify_gathered(arena, slots, fmds_ptrs, fmds_sizes, fmd_array, len(fmd_data),
+                                       fmd_view_idx, threshold_score, max_candidates)
+
+    def find_duplicate(self, fmd_data, user_id=None, target_fmr=None,
+                       threshold_score=DEFAULT_THRESHOLD_SCORE, max_candidates=5):
+        """
+        Check whether a freshly captured template is already enrolled under another user.
+
+        :param fmd_data: The new FMD (bytes).
+        :param user_id: The ID being enrolled; its own templates are not duplicates.
+        :param target_fmr: Target false match rate; overrides threshold_score if given.
+        :param threshold_score: Dissimilarity threshold for a duplicate.
+        :param max_candidates: Number of candidates searched for another user's template.
+        :return: The best matching Candidate of another user, or None.
+        """
+        if not len(self.arena):
+            return None
+        matches = self.identify(fmd_data, max_candidates=max_candidates,
+                                target_fmr=target_fmr, threshold_score=threshold_score)
+        for candidate in matches or []:
+            if candidate.user_id != user_id:
+                logging.debug(f"Template matches user {candidate.user_id} (score {candidate.score}).")
+                return candidate
+        return None
+
+    def rank(self, fmd_data, slots=None, max_candidates=10, target_fmr=None,
+             threshold_score=DEFAULT_THRESHOLD_SCORE, fmd_view_idx=0):
+        """
+        Score a probe against selected templates with dpfj_compare and keep the top-k.
+
+        Used when a prefilter has already pruned the gallery down to a few slots.
+
+        :param fmd_data: The probe FMD (bytes).
+        :param slots: The arena slots to score (default: the whole gallery).
+        :param max_candidates: The number of candidates (k) to return.
+        :param target_fmr: Target false match rate; overrides threshold_score if given.
+        :param threshold_score: Dissimilarity threshold.
+        :param fmd_view_idx: The view index in the probe FMD.
+        :return: A list of Candidate tuples sorted by score (best first).
+        """
+        threshold_score = resolve_threshold(target_fmr, threshold_score)
+        dll = load_dpfj_dll()
+        fmd_array = (c_ubyte * len(fmd_data)).from_buffer_copy(fmd_data)
+        fmd_size = len(fmd_data)
+        score = c_uint(0)
+
+        with self._lock:
+            arena = self._current_snapshot()
+        fmds_ptrs = arena.fmds_ptrs
+        fmds_sizes = arena.fmds_sizes
+        if slots is None:
+            slots = range(len(arena))
+
+        def scores():
+            for slot in slots:
+                result = dll.dpfj_compare(
+                    self.fmd_type, fmd_array, fmd_size, fmd_view_idx,
+                    self.fmd_type, fmds_ptrs[slot], fmds_sizes[slot], 0,
+                    byref(score)
+                )
+                if result != DPFJ_SUCCESS:
+                    logging.error(f"Failed to compare against slot {slot}. Error Code: {result}")
+                    continue
+                yield score.value, slot
+
+        best = top_k(scores(), max_candidates, threshold_score)
+        return [
+            Candidate(arena.user_ids[slot], value, arena.template_ids[slot], 0)
+            for value, slot in best
+        ]
@@ -0,0 +1,361 @@
+import ctypes
+from ctypes import c_ubyte, c_uint, c_uint64, c_void_p, POINTER
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from db_schema import open_database
+from enrollment_repository import get_repository
+from gallery_arena import GalleryArena
+from gallery_file import GalleryFile
+from identification_engine import Candidate, DPFJ_FMD_ANSI_378_2004, identify_range
+from match_scores import DEFAULT_THRESHOLD_SCORE, resolve_threshold, top_k
+
+# Shared gallery layout:
+#   uint64 count
+#   uint64 offsets[count]   (relative to the payload)
+#   uint32 sizes[count]
+#   payload (all FMDs back to back)
+HEADER_SIZE = ctypes.sizeof(c_uint64)
+
+# sync() patches the loaded gallery until this many templates changed (or
+# SYNC_RELOAD_FRACTION of it, if more), then loads it again
+SYNC_RELOAD_MIN = 1024
+SYNC_RELOAD_FRACTION = 0.1
+
+# Per-process state of a worker, set by _init_worker
+_worker_shm = None
+_worker_ptrs = None
+_worker_sizes = None
+_worker_fmd_type = None
+_worker_gallery = None
+
+def _payload_offset(count):
+    return HEADER_SIZE + count * ctypes.sizeof(c_uint64) + count * ctypes.sizeof(c_uint)
+
+def _init_worker(shm_name, fmd_type):
+    """
+    Map the shared gallery into a worker and build its pointer table.
+
+    Pointers are process-local, so each worker builds its own table; the size
+    table and the payload are used in place.
+    """
+    global _worker_shm, _worker_ptrs, _worker_sizes, _worker_fmd_type
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    # Work from the raw address so no buffer export keeps the mapping from closing
+    view = c_ubyte.from_buffer(shm.buf)
+    base = ctypes.addressof(view)
+    del view
+    count = c_uint64.from_address(base).value
+    offsets = (c_uint64 * count).from_address(base + HEADER_SIZE)
+    sizes = (c_uint * count).from_address(base + HEADER_SIZE + count * ctypes.sizeof(c_uint64))
+    payload = base + _payload_offset(count)
+
+    ptrs = (c_void_p * count)()
+    for i in range(count):
+        ptrs[i] = payload + offsets[i]
+
+    _worker_shm = shm
+    _worker_ptrs = ptrs
+    _worker_sizes = sizes
+    _worker_fmd_type = fmd_type
+    logging.debug(f"Identification worker {os.getpid()} mapped {count} templates.")
+
+def _init_file_worker(path, fmd_type):
+    """
+    Map a packed gallery file into a worker.
+
+    Every worker maps the same file read-only, so the payload pages are shared
+    through the OS page cache instead of being copied per process.
+    """
+    global _worker_gallery, _worker_ptrs, _worker_sizes, _worker_fmd_type
+    gallery = GalleryFile(path)
+    if not gallery.open():
+        raise RuntimeError(f"Failed to map gallery file {path}")
+    _worker_gallery = gallery
+    _worker_ptrs = gallery.pointer_table
+    _worker_sizes = gallery.fmds_sizes
+    _worker_fmd_type = fmd_type
+    logging.debug(f"Identification worker {os.getpid()} mapped {len(gallery)} templates from {path}.")
+
+def _identify_slice(fmd_data, start, stop, fmd_view_idx, threshold_score, max_candidates):
+    """Match a probe against one slice of the shared gallery (runs in a worker)."""
+    fmd_array = (c_ubyte * len(fmd_data)).from_buffer_copy(fmd_data)
+    fmds_ptrs = ctypes.cast(ctypes.addressof(_worker_ptrs) + start * ctypes.sizeof(c_void_p), POINTER(POINTER(c_ubyte)))
+    fmds_sizes = ctypes.cast(ctypes.addressof(_worker_sizes) + start * ctypes.sizeof(c_uint), POINTER(c_uint))
+    scored = identify_range(_worker_fmd_type, fmd_array, len(fmd_data), fmd_view_idx,
+                            fmds_ptrs, fmds_sizes, stop - start, threshold_score, max_candidates)
+    if scored is None:
+        return None
+    return [(score, start + idx, view_idx) for score, idx, view_idx in scored]
+
+class IdentificationWorkerPool:
+    """
+    1:N identification on a pool of worker processes sharing one gallery.
+
+    The parent loads the templates once into a shared memory block. Each worker
+    maps the block and matches its slice of the gallery; a probe is fanned out
+    to every slice and the scored candidates are merged the same way as in
+    IdentificationEngine.
+
+    The shared block is never modified. sync() masks the loaded slots of
+    changed or deleted fingerprints and keeps their current templates in a
+    small GalleryArena matched by the parent, until enough has changed to
+    make a reload worthwhile.
+    """
+
+    def __init__(self, db_path="fingerprint_enrollment.db", fmd_type=DPFJ_FMD_ANSI_378_2004, workers=None):
+        """
+        :param db_path: Path to the SQLite enrollment database.
+        :param fmd_type: FMD format of the stored templates and of the probes.
+        :param workers: Number of worker processes (default: CPU count).
+        """
+        self.db_path = db_path
+        self.fmd_type = fmd_type
+        self.workers = workers or os.cpu_count() or 1
+        # Templates of the loaded gallery, by slot
+        self.user_ids = []
+        self.template_ids = []
+        self.change_seq = 0
+        # Loaded slots superseded by sync(), and the templates that replaced them
+        self._removed = set()
+        self._delta = GalleryArena()
+        self._slot_of = None
+        self._shm = None
+        self._gallery = None
+        self._executor = None
+
+    def __len__(self):
+        return len(self.template_ids) - len(self._removed) + len(self._delta)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def load(self):
+        """
+        Load all stored templates into shared memory and start the workers.
+
+        :return: The number of templates loaded.
+        """
+        conn = open_database(self.db_path)
+        try:
+            # Read before the scan: changes racing with it trigger one more reload on sync
+            change_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM fingerprint_changes").fetchone()[0]
+            count, total_size = conn.execute(
+                "SELECT COUNT(*), TOTAL(LENGTH(fmd)) FROM fingerprints WHERE fmd IS NOT NULL AND fmd_type = ?",
+                (self.fmd_type,)
+            ).fetchone()
+            payload_offset = _payload_offset(count)
+            shm = shared_memory.SharedMemory(create=True, size=max(1, payload_offset + int(total_size)))
+            offsets = sizes = None
+            try:
+                c_uint64.from_buffer(shm.buf).value = count
+                offsets = (c_uint64 * count).from_buffer(shm.buf, HEADER_SIZE)
+                sizes = (c_uint * count).from_buffer(shm.buf, HEADER_SIZE + count * ctypes.sizeof(c_uint64))
+                user_ids = []
+                template_ids = []
+                offset = 0
+                cursor = conn.execute(
+                    "SELECT id, user_id, fmd FROM fingerprints WHERE fmd IS NOT NULL AND fmd_type = ? ORDER BY id",
+                    (self.fmd_type,)
+                )
+                for i, (template_id, user_id, fmd) in enumerate(cursor):
+                    if i == count:
+                        break  # rows enrolled after the COUNT are picked up by the next load
+                    start = payload_offset + offset
+                    shm.buf[start:start + len(fmd)] = fmd
+                    offsets[i] = offset
+                    sizes[i] = len(fmd)
+                    offset += len(fmd)
+                    user_ids.append(user_id)
+                    template_ids.append(template_id)
+                if len(template_ids) < count:
+                    c_uint64.from_buffer(shm.buf).value = len(template_ids)
+            except BaseException:
+                # Free the segment so a failed load does not leak it in /dev/shm
+                offsets = sizes = None
+                shm.close()
+                shm.unlink()
+                raise
+            # Release the ctypes views before anyone tries to close the block
+            del offsets, sizes
+        finally:
+            conn.close()
+
+        try:
+            self.close()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(shm.name, self.fmd_type)
+            )
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        self._shm = shm
+        self.user_ids = user_ids
+        self.template_ids = template_ids
+        self.change_seq = change_seq
+        print(f"[DEBUG] Shared gallery loaded: {len(template_ids)} templates, {self.workers} workers.")
+        logging.debug(f"Shared gallery loaded: {len(template_ids)} templates, {self.workers} workers.")
+        return len(template_ids)
+
+    def load_file(self, path):
+        """
+        Start the workers on a packed gallery file instead of a database copy.
+
+        :param path: Path to a file written by gallery_file.build_gallery_file.
+        :return: The number of templates mapped, or None if the file could not be used.
+        """
+        gallery = GalleryFile(path)
+        if not gallery.open():
+            return None
+        if gallery.fmd_type != self.fmd_type:
+            print(f"[ERROR] Gallery file {path} holds format {gallery.fmd_type:#x}, expected {self.fmd_type:#x}.")
+            logging.error(f"Gallery file {path} holds format {gallery.fmd_type:#x}, expected {self.fmd_type:#x}.")
+            gallery.close()
+            return None
+
+        self.close()
+        self._gallery = gallery
+        self.user_ids = gallery.user_ids
+        self.template_ids = gallery.template_ids
+        self.change_seq = gallery.change_seq
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_file_worker,
+            initargs=(path, self.fmd_type)
+        )
+        print(f"[DEBUG] Gallery file mapped: {len(gallery)} templates, {self.workers} workers.")
+        logging.debug(f"Gallery file {path} mapped: {len(gallery)} templates, {self.workers} workers.")
+        return len(gallery)
+
+    def _reset_delta(self):
+        self._removed = set()
+        self._delta = GalleryArena()
+        self._slot_of = None
+
+    def _loaded_slot(self, template_id):
+        if self._slot_of is None:
+            # Built on the first sync: identification alone never needs it
+            self._slot_of = {tid: slot for slot, tid in enumerate(self.template_ids)}
+        return self._slot_of.get(template_id)
+
+    def sync(self):
+        """
+        Apply the enrollments and deletions committed since the last load or sync.
+
+        The workers map a fixed copy of the gallery, so changes are applied in
+        the parent: the loaded slot of a changed fingerprint is masked and its
+        current template, if any, goes to the delta arena. Once more than
+        SYNC_RELOAD_MIN templates (or SYNC_RELOAD_FRACTION of the gallery) have
+        changed, or the feed was pruned past the watermark, the gallery is loaded
+        again from the database (a gallery file is replaced by a shared memory
+        copy) and the workers are restarted.
+
+        :return: The number of changed fingerprints applied, or None if the feed
+                 no longer covers the watermark.
+        """
+        repository = get_repository(self.db_path)
+        first_seq = repository.first_change_seq()
+        if first_seq is not None and first_seq > self.change_seq + 1:
+            logging.error(f"Change feed starts at {first_seq}, gallery is at {self.change_seq}; reloading.")
+            self.load()
+            return None
+
+        changes = repository.changes_since(self.change_seq, self.fmd_type)
+        for change in changes:
+            slot = self._loaded_slot(change.fingerprint_id)
+            if slot is not None:
+                self._removed.add(slot)
+            self._delta.remove(change.fingerprint_id)
+            if change.fmd is not None:
+                self._delta.append(change.fingerprint_id, change.user_id, bytes(change.fmd))
+        if changes:
+            self.change_seq = changes[-1].seq
+            changed = len(self._removed) + len(self._delta)
+            if changed > max(SYNC_RELOAD_MIN, len(self.template_ids) * SYNC_RELOAD_FRACTION):
+                logging.debug(f"{changed} template(s) changed since the gallery was loaded; reloading.")
+                self.load()
+            else:
+                logging.debug(f"Gallery synced: {len(changes)} change(s) applied, watermark {self.change_seq}.")
+        repository.trim_changes(self.change_seq)
+        return len(changes)
+
+    def identify(self, fmd_data, max_candidates=10, target_fmr=None,
+                 threshold_score=DEFAULT_THRESHOLD_SCORE, fmd_view_idx=0):
+        """
+        Return the top-k matches of a probe FMD over the whole shared gallery.
+
+        :param fmd_data: The probe FMD (bytes).
+        :param max_candidates: The number of candidates (k) to return.
+        :param target_fmr: Target false match rate; overrides threshold_score if given.
+        :param threshold_score: Dissimilarity threshold passed to the SDK.
+        :param fmd_view_idx: The view index in the probe FMD.
+        :return: A list of Candidate tuples sorted by score (best first), or None
+                 if identification failed.
+        """
+        threshold_score = resolve_threshold(target_fmr, threshold_score)
+        if not len(self):
+            print("[ERROR] Gallery is empty. Call load() first.")
+            logging.error("Identification requested on an empty gallery.")
+            return []
+
+        count = len(self.template_ids)
+        # Masked slots may take some of each slice's places; ask for that many more
+        slice_candidates = max_candidates + len(self._removed)
+        slices = max(1, min(self.workers, count)) if len(self._removed) < count else 0
+        step, extra = divmod(count, max(1, slices))
+        futures = []
+        start = 0
+        for i in range(slices):
+            stop = start + step + (1 if i < extra else 0)
+            futures.append(self._executor.submit(
+                _identify_slice, bytes(fmd_data), start, stop, fmd_view_idx, threshold_score, slice_candidates
+            ))
+            start = stop
+
+        results = []
+        if len(self._delta):
+            fmd_array = (c_ubyte * len(fmd_data)).from_buffer_copy(fmd_data)
+            fmds_ptrs, fmds_sizes = self._delta.tables_at(0)
+            scored = identify_range(self.fmd_type, fmd_array, len(fmd_data), fmd_view_idx,
+                                    fmds_ptrs, fmds_sizes, len(self._delta), threshold_score, max_candidates)
+            # Delta slots are numbered after the loaded ones
+            results.append(None if scored is None else
+                           [(score, count + idx, view_idx) for score, idx, view_idx in scored])
+        results.extend(future.result() for future in futures)
+        if any(scored is None for scored in results):
+            return None
+
+        merged = top_k((entry for scored in results for entry in scored if entry[1] not in self._removed),
+                       max_candidates, threshold_score)
+        return [self._candidate(score, slot, view_idx) for score, slot, view_idx in merged]
+
+    def _candidate(self, score, slot, view_idx):
+        count = len(self.template_ids)
+        if slot < count:
+            return Candidate(self.user_ids[slot], score, self.template_ids[slot], view_idx)
+        return Candidate(self._delta.user_ids[slot - count], score, self._delta.template_ids[slot - count], view_idx)
+
+    def close(self):
+        """Stop the workers and free the shared gallery."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.user_ids = []
+        self.template_ids = []
+        if self._gallery is not None:
+            self._gallery.close()
+            self._gallery = None
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        self._reset_delta()
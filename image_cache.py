@@ -0,0 +1,225 @@
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+# Default memory budget for decoded images (about 170 frames of 400x500 pixels)
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Rough per-entry overhead of the Python objects around the pixel array
+ENTRY_OVERHEAD = 256
+
+# Decoded image of one fingerprint row: a read-only (height, width) uint8 array,
+# its resolution, and the size of the stored (compressed) image it was decoded from
+CachedImage = namedtuple("CachedImage", ["image", "dpi", "image_size"])
+
+class DecodedImageCache:
+    """
+    Bounded LRU cache of decoded fingerprint images, keyed by fingerprint row ID.
+
+    Each entry remembers the size of the stored image it was decoded from
+    (length(fingerprint), read from the row header without touching the image
+    pages) and is only returned for that same size. Row IDs are never reused,
+    so a lookup never has to read the BLOB; the image is only loaded on a miss.
+    An image rewritten with the same size is caught by sync, which drops the
+    rows listed in the change feed since the previous sync.
+    Entries are evicted least recently used first once the memory budget is
+    exceeded, which keeps the repeatedly used images in RAM without holding
+    the whole gallery uncompressed.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param max_bytes: Memory budget for the cached pixels.
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Change feed watermark of the last sync (None: never synced)
+        self.change_seq = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, row_id):
+        return row_id in self._entries
+
+    @property
+    def used_bytes(self):
+        return self._bytes
+
+    def get(self, row_id, image_size):
+        """
+        Look up the decoded image of a fingerprint row.
+
+        :param row_id: The ID of the fingerprint row.
+        :param image_size: The size of the row's stored image in bytes.
+        :return: A CachedImage(image, dpi, image_size) tuple, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(row_id)
+            if entry is None or entry.image_size != image_size:
+                if entry is not None:
+                    # The stored image changed since it was decoded
+                    self._discard(row_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(row_id)
+            self.hits += 1
+            return entry
+
+    def put(self, row_id, image_size, image_data, width, height, dpi):
+        """
+        Cache the decoded image of a fingerprint row, evicting older entries if needed.
+
+        :param row_id: The ID of the fingerprint row.
+        :param image_size: The size of the row's stored image in bytes.
+        :param image_data: The decoded 8-bit pixels (bytes-like, width * height bytes).
+        :param width: The width of the image in pixels.
+        :param height: The height of the image in pixels.
+        :param dpi: The resolution of the image.
+        :return: The CachedImage tuple (also returned when it is too large to cache),
+                 or None if image_data does not hold width * height pixels.
+        """
+        pixels = np.frombuffer(image_data, dtype=np.uint8)
+        if len(pixels) != width * height:
+            logging.error(f"Decoded image holds {len(pixels)} bytes, expected {width * height}.")
+            return None
+        image = pixels.reshape(height, width)
+        if image.flags.writeable:
+            # The cached array is shared with every caller, so it must not change
+            image = image.copy()
+            image.flags.writeable = False
+        entry = CachedImage(image, dpi, image_size)
+        size = ENTRY_OVERHEAD + image.nbytes
+        with self._lock:
+            self._discard(row_id)
+            if size > self.max_bytes:
+                logging.debug(f"Image of fingerprint {row_id} exceeds the cache budget; not cached.")
+                return entry
+            self._entries[row_id] = entry
+            self._sizes[row_id] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted, _ = self._entries.popitem(last=False)
+                self._bytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+        return entry
+
+    def decode(self, row_id, image_size, load, decoder):
+        """
+        Return the decoded image of a fingerprint row, loading and decoding it only on a miss.
+
+        :param row_id: The ID of the fingerprint row.
+        :param image_size: The size of the row's stored image in bytes (e.g. from
+                           EnrollmentRepository.get_user_images).
+        :param load: Called with row_id on a miss; returns the stored image (bytes),
+                     e.g. EnrollmentRepository.get_fingerprint, or None.
+        :param decoder: Called with the stored image on a miss; returns a dictionary
+                        with "data", "width", "height" and "dpi" (e.g. decode_wsq), or None.
+        :return: A dictionary with "data" (the pixels, a flat read-only uint8 array),
+                 "image" (the same pixels as a (height, width) array), "width",
+                 "height", "dpi" and "bpp", or None if loading or decoding failed.
+        """
+        entry = self.get(row_id, image_size)
+        if entry is None:
+            compressed_data = load(row_id)
+            if compressed_data is None:
+                return None
+            decoded = decoder(compressed_data)
+            if not decoded:
+                return None
+            # Keyed on the size actually loaded, in case the row changed since image_size was read
+            entry = self.put(row_id, len(compressed_data), decoded["data"], decoded["width"],
+                             decoded["height"], decoded["dpi"])
+            if entry is None:
+                return None
+        height, width = entry.image.shape
+        return {
+            "data": entry.image.reshape(-1),
+            "image": entry.image,
+            "width": width,
+            "height": height,
+            "dpi": entry.dpi,
+            "bpp": 8
+        }
+
+    def _discard(self, row_id):
+        if self._entries.pop(row_id, None) is not None:
+            self._bytes -= self._sizes.pop(row_id)
+            return True
+        return False
+
+    def invalidate(self, row_id):
+        """
+        Drop the entry of a fingerprint row (e.g. after the row was deleted).
+
+        :param row_id: The ID of the fingerprint row.
+        :return: True if the row was cached, False otherwise.
+        """
+        with self._lock:
+            return self._discard(row_id)
+
+    def sync(self, repository):
+        """
+        Drop the entries of fingerprint rows changed since the last sync.
+
+        Only the IDs in the change feed after the cache's watermark are read.
+        On the first sync, or if the feed was pruned past the watermark, every
+        entry is dropped.
+
+        :param repository: The EnrollmentRepository the images are loaded from.
+        :return: The number of entries dropped.
+        """
+        change_seq = self.change_seq
+        first_seq = repository.first_change_seq()
+        if change_seq is None or (first_seq is not None and first_seq > change_seq + 1):
+            # Read before clearing, so a change committed in between is seen by the next sync
+            watermark = repository.change_watermark()
+            with self._lock:
+                dropped = len(self._entries)
+                self._clear()
+                self.change_seq = watermark
+            return dropped
+
+        watermark, row_ids = repository.changed_fingerprint_ids(change_seq)
+        with self._lock:
+            dropped = sum(self._discard(row_id) for row_id in row_ids)
+            self.change_seq = max(self.change_seq or 0, watermark)
+        if dropped:
+            logging.debug(f"Decoded image cache synced: {dropped} changed image(s) dropped, watermark {watermark}.")
+        return dropped
+
+    def _clear(self):
+        self._entries.clear()
+        self._sizes.clear()
+        self._bytes = 0
+
+    def clear(self):
+        """Drop every entry (e.g. after the enrollment tables were deleted)."""
+        with self._lock:
+            self._clear()
+
+    def hit_rate(self):
+        """Fraction of lookups served from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """
+        :return: A dictionary with the entry count, memory use and hit/miss counters.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hit_rate(),
+            }
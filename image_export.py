@@ -0,0 +1,134 @@
+import os
+import re
+import time
+import logging
+import argparse
+import sqlite3
+from itertools import tee
+
+from PIL import Image
+
+from db_schema import DB_PATH
+from enrollment_repository import get_repository
+from wsq_codec import DEFAULT_BATCH_SIZE, WSQCodecPool, decode_wsq
+
+# Stored images read per round trip
+FETCH_SIZE = 256
+# Output formats: an 8-bit grayscale PNG carrying the DPI, or the bare pixels as test9 saved them
+FORMAT_PNG = "png"
+FORMAT_RAW = "raw"
+
+# Every stored image, optionally for one user, in row order
+IMAGE_ROWS = '''
+    SELECT id, user_id, fingerprint
+    FROM fingerprints
+    WHERE fingerprint IS NOT NULL AND length(fingerprint) > 0 AND (? IS NULL OR user_id = ?)
+    ORDER BY id
+'''
+
+def _iter_rows(conn, user_id):
+    cursor = conn.execute(IMAGE_ROWS, (user_id, user_id))
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+def image_path(output_dir, user_id, row_id, image_format=FORMAT_PNG):
+    """
+    :param output_dir: The export directory.
+    :param user_id: The ID of the user.
+    :param row_id: The fingerprints row ID.
+    :param image_format: FORMAT_PNG or FORMAT_RAW.
+    :return: The path of the exported image, <output_dir>/<user_id>/<row_id>.<format>.
+    """
+    # User IDs are free text in the GUI; keep them inside the export directory
+    directory = re.sub(r"[^\w.-]", "_", user_id).lstrip(".") or "_"
+    return os.path.join(output_dir, directory, f"{row_id}.{image_format}")
+
+def save_image(path, image, image_format=FORMAT_PNG):
+    """
+    Write a decoded image.
+
+    :param path: The output path.
+    :param image: A decode_wsq dictionary.
+    :param image_format: FORMAT_PNG or FORMAT_RAW.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if image_format == FORMAT_RAW:
+        with open(path, "wb") as f:
+            f.write(image["data"])
+        return
+    img = Image.frombuffer("L", (image["width"], image["height"]), image["data"], "raw", "L", 0, 1)
+    img.save(path, format="PNG", dpi=(image["dpi"], image["dpi"]))
+
+def export_images(output_dir, db_path=DB_PATH, user_id=None, workers=None, batch_size=DEFAULT_BATCH_SIZE,
+                  image_format=FORMAT_PNG):
+    """
+    Decode the stored WSQ images of the enrollment database and write them to files.
+
+    Rows are streamed from the database and decoded on a WSQCodecPool, so the
+    export uses every core while the results are written in row order as they
+    come back.
+
+    :param output_dir: The export directory.
+    :param db_path: Path to the SQLite enrollment database.
+    :param user_id: Only export this user's images (None exports every user).
+    :param workers: Number of worker processes (0 runs in-process, None uses every CPU).
+    :param batch_size: Images per codec task.
+    :param image_format: FORMAT_PNG or FORMAT_RAW.
+    :return: A dictionary with the exported and failed image counts and the throughput.
+    """
+    repository = get_repository(db_path)
+    rows, blobs = tee(_iter_rows(repository.reader(), user_id))
+    blobs = (fingerprint for _, _, fingerprint in blobs)
+
+    workers = os.cpu_count() if workers is None else workers
+    pool = WSQCodecPool(workers=workers, batch_size=batch_size) if workers > 0 else None
+    images = pool.decode_many(blobs) if pool is not None else map(decode_wsq, blobs)
+
+    report = {"exported": 0, "failed": 0}
+    start = time.perf_counter()
+    try:
+        for (row_id, row_user_id, _), image in zip(rows, images):
+            if image is None:
+                report["failed"] += 1
+                print(f"[ERROR] Could not decode the image of fingerprint row {row_id}.")
+                logging.error(f"Image export could not decode fingerprint row {row_id}.")
+                continue
+            save_image(image_path(output_dir, row_user_id, row_id, image_format), image, image_format)
+            report["exported"] += 1
+    except (sqlite3.Error, OSError) as e:
+        print(f"[ERROR] Image export stopped after {report['exported']} images: {e}")
+        logging.error(f"Image export stopped after {report['exported']} images: {e}")
+        return None
+    finally:
+        if pool is not None:
+            images.close()
+            pool.close()
+
+    elapsed = time.perf_counter() - start
+    report["seconds"] = elapsed
+    report["images_per_second"] = report["exported"] / elapsed if elapsed > 0 else 0.0
+    print(f"[DEBUG] Image export finished: {report['exported']} images ({report['failed']} failed) "
+          f"at {report['images_per_second']:.1f} images/s.")
+    logging.info(f"Image export finished: {report}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the stored fingerprint images as PNG or raw files.")
+    parser.add_argument("output", help="Directory to write the images to.")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the enrollment database.")
+    parser.add_argument("--user", default=None, help="Only export this user's images.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (0: run in-process).")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH_SIZE, help="Images per codec task.")
+    parser.add_argument("--format", choices=(FORMAT_PNG, FORMAT_RAW), default=FORMAT_PNG, help="Output format.")
+    args = parser.parse_args()
+
+    logging.basicConfig(filename="fingerprint_system.log", level=logging.INFO,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+    export_images(args.output, args.db, user_id=args.user, workers=args.workers, batch_size=args.batch,
+                  image_format=args.format)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import logging
+import numpy as np
+from fir_parser import raw_image_from_fir
+from fmd_parser import DPFJ_FMD_ANSI_378_2004, parse_fmd
+
+# Side of the square blocks the frame is scored in, in pixels (about two ridge periods at 500 dpi)
+BLOCK_SIZE = 16
+# A block is foreground (finger) when its gray levels vary at least this much
+FOREGROUND_MIN_STD = 12.0
+# Blocks brighter than this on average are the empty platen
+BACKGROUND_MIN_MEAN = 235.0
+# Block standard deviation at which contrast counts as full
+FULL_CONTRAST_STD = 48.0
+
+# Gate thresholds, set below the range of real 400x500 captures (captured_image.raw
+# and the enrolled samples: coverage 0.27-0.78, coherence 0.43-0.86, ridge ratio
+# 0.35-0.53, score 43-86)
+MIN_COVERAGE = 0.20        # fraction of the frame covered by the finger
+MIN_COHERENCE = 0.35       # mean ridge orientation coherence over the finger
+MIN_CONTRAST = 0.35        # mean contrast over the finger, 0..1
+DRY_MAX_RIDGE_RATIO = 0.30 # below: broken, faint ridges
+WET_MIN_RIDGE_RATIO = 0.68 # above: ridges merged into dark smears
+MIN_SCORE = 30             # mean block quality over the finger, 0..100
+
+# Sample score: weights of the frame score, the minutiae count and the minutiae reliability
+SAMPLE_SCORE_WEIGHTS = (0.4, 0.3, 0.3)
+# Frame score and minutiae count at which their part of the sample score is full
+GOOD_FRAME_SCORE = 80
+GOOD_MINUTIAE_COUNT = 40
+
+def _as_image(image_data, width=None, height=None):
+    # A 2-D array is used as is; a FIR record is parsed; anything else is a pixel buffer
+    if isinstance(image_data, np.ndarray) and image_data.ndim == 2:
+        return image_data
+    if width is None or height is None:
+        raw_image = raw_image_from_fir(image_data)
+        return raw_image["image"] if raw_image else None
+    pixels = np.frombuffer(image_data, dtype=np.uint8)
+    if len(pixels) < width * height:
+        logging.error(f"Image holds {len(pixels)} bytes, expected {width * height}.")
+        return None
+    return pixels[:width * height].reshape(height, width)
+
+def _blocks(values, block_size):
+    rows, cols = values.shape[0] // block_size, values.shape[1] // block_size
+    return values[:rows * block_size, :cols * block_size].reshape(rows, block_size, cols, block_size)
+
+def block_scores(image, block_size=BLOCK_SIZE):
+    """
+    Score every block of a grayscale fingerprint image.
+
+    All measures are computed for the whole frame at once with NumPy reductions
+    over a (rows, block, cols, block) view; partial blocks at the right and
+    bottom edges are ignored.
+
+    :param image: A 2-D uint8 array (height, width).
+    :param block_size: Side of a block in pixels.
+    :return: A dictionary of (rows, cols) arrays: "mean" and "std" (gray levels),
+             "coherence" (ridge orientation coherence, 0..1), "ridge_ratio"
+             (fraction of pixels darker than the block mean), "foreground" (bool)
+             and "quality" (0..1, zero for background blocks).
+    """
+    pixels = image.astype(np.float32)
+    blocks = _blocks(pixels, block_size)
+    mean = blocks.mean(axis=(1, 3))
+    std = blocks.std(axis=(1, 3))
+
+    # Central-difference gradients; the border rows and columns stay zero
+    gx = np.zeros_like(pixels)
+    gy = np.zeros_like(pixels)
+    gx[:, 1:-1] = pixels[:, 2:] - pixels[:, :-2]
+    gy[1:-1, :] = pixels[2:, :] - pixels[:-2, :]
+    gxx = _blocks(gx * gx, block_size).sum(axis=(1, 3))
+    gyy = _blocks(gy * gy, block_size).sum(axis=(1, 3))
+    gxy = _blocks(gx * gy, block_size).sum(axis=(1, 3))
+    energy = gxx + gyy
+    coherence = np.divide(np.sqrt((gxx - gyy) ** 2 + 4.0 * gxy ** 2), energy,
+                          out=np.zeros_like(energy), where=energy > 0)
+
+    ridge_ratio = (blocks < mean[:, None, :, None]).mean(axis=(1, 3))
+    foreground = (std >= FOREGROUND_MIN_STD) & (mean < BACKGROUND_MIN_MEAN)
+    contrast = np.minimum(std / FULL_CONTRAST_STD, 1.0)
+    quality = np.where(foreground, coherence * contrast, 0.0)
+
+    return {
+        "mean": mean,
+        "std": std,
+        "coherence": coherence,
+        "ridge_ratio": ridge_ratio,
+        "foreground": foreground,
+        "quality": quality,
+    }
+
+def assess_image(image_data, width=None, height=None, block_size=BLOCK_SIZE):
+    """
+    Decide whether a capture is worth extracting, compressing and storing.
+
+    :param image_data: A 2-D uint8 array, a FIR record (bytes-like) or, with
+                       width and height, a raw 8-bit pixel buffer.
+    :param width: Width of a raw pixel buffer.
+    :param height: Height of a raw pixel buffer.
+    :param block_size: Side of a block in pixels.
+    :return: A dictionary with "usable", "score" (0..100, mean block quality over the
+             finger), "coverage", "coherence", "contrast", "ridge_ratio",
+             "condition" ("normal", "dry" or "wet"), "reasons" (why the capture
+             is unusable) and "blocks" (the block_scores arrays), or None if the
+             image could not be read.
+    """
+    image = _as_image(image_data, width, height)
+    if image is None or min(image.shape) < block_size:
+        logging.error("Image quality: no usable image to score.")
+        return None
+
+    blocks = block_scores(image, block_size)
+    foreground = blocks["foreground"]
+    coverage = float(foreground.mean())
+    if foreground.any():
+        coherence = float(blocks["coherence"][foreground].mean())
+        contrast = float(np.minimum(blocks["std"][foreground] / FULL_CONTRAST_STD, 1.0).mean())
+        ridge_ratio = float(blocks["ridge_ratio"][foreground].mean())
+        # Averaged over the finger only: the empty platen around it is not a defect,
+        # a small or partial finger is caught by MIN_COVERAGE instead
+        score = int(round(100 * float(blocks["quality"][foreground].mean())))
+    else:
+        coherence = contrast = ridge_ratio = 0.0
+        score = 0
+
+    if ridge_ratio and ridge_ratio < DRY_MAX_RIDGE_RATIO:
+        condition = "dry"
+    elif ridge_ratio > WET_MIN_RIDGE_RATIO:
+        condition = "wet"
+    else:
+        condition = "normal"
+
+    reasons = []
+    if coverage < MIN_COVERAGE:
+        reasons.append(f"finger covers {coverage:.0%} of the frame")
+    if coherence < MIN_COHERENCE:
+        reasons.append(f"ridge coherence {coherence:.2f}")
+    if contrast < MIN_CONTRAST:
+        reasons.append(f"contrast {contrast:.2f}")
+    if condition != "normal":
+        reasons.append(f"finger too {condition}")
+    if score < MIN_SCORE:
+        reasons.append(f"score {score}")
+
+    return {
+        "usable": not reasons,
+        "score": score,
+        "coverage": coverage,
+        "coherence": coherence,
+        "contrast": contrast,
+        "ridge_ratio": ridge_ratio,
+        "condition": condition,
+        "reasons": reasons,
+        "blocks": blocks,
+    }
+
+def has_enough_detail(image_data, width=None, height=None):
+    """
+    :param image_data: Same as assess_image.
+    :param width: Width of a raw pixel buffer.
+    :param height: Height of a raw pixel buffer.
+    :return: True if the capture passes the quality gate, False otherwise.
+    """
+    assessment = assess_image(image_data, width, height)
+    return assessment is not None and assessment["usable"]
+
+def sample_score(image_data, fmd_data, fmd_type=DPFJ_FMD_ANSI_378_2004, assessment=None):
+    """
+    NFIQ-like utility score of an enrollment sample: how well it can be expected to match.
+
+    Combines the frame statistics of assess_image with the minutiae of the
+    extracted template: how many were found and how reliable the extractor
+    rated them.
+
+    :param image_data: The sample image, in any form assess_image accepts.
+    :param fmd_data: The FMD extracted from the image.
+    :param fmd_type: The FMD format.
+    :param assessment: The result of assess_image for this image, if already computed.
+    :return: The score, 0 (unusable) to 100 (best).
+    """
+    if assessment is None:
+        assessment = assess_image(image_data)
+    frame = min(1.0, assessment["score"] / GOOD_FRAME_SCORE) if assessment else 0.0
+
+    count = reliability = 0.0
+    parsed = parse_fmd(fmd_data, fmd_type) if fmd_data else None
+    if parsed is not None and parsed["views"]:
+        minutiae = parsed["views"][0]["minutiae"]
+        count = min(1.0, len(minutiae) / GOOD_MINUTIAE_COUNT)
+        if len(minutiae):
+            reliability = min(1.0, float(minutiae["quality"].mean()) / 100.0)
+
+    frame_weight, count_weight, reliability_weight = SAMPLE_SCORE_WEIGHTS
+    return int(round(100 * (frame_weight * frame + count_weight * count + reliability_weight * reliability)))
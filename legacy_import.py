@@ -0,0 +1,306 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import argparse
+import sqlite3
+from collections import namedtuple
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from db_schema import DB_PATH
+from enrollment_repository import BLOB_CHUNK_SIZE, get_repository
+from fmd_parser import parse_fmd
+from identification_engine import DPFJ_FMD_ANSI_378_2004, create_fmd, get_sdk_version, load_dpfj_dll
+from wsq_codec import decode_wsq
+
+# Directories the older scripts wrote to: enroll_user in test14 used "database",
+# test9/test10 wrote fmd_<id>.dat and user_<id>.json to the working directory
+DEFAULT_ROOTS = ("database", ".")
+# Fingerprint rows written per transaction
+DEFAULT_BATCH_SIZE = 2000
+
+WSQ_PATTERN = re.compile(r"^user_(?P<user_id>.+)_scan_(?P<scan>\d+)\.wsq$")
+FMD_PATTERN = re.compile(r"^fmd_(?P<user_id>.+)\.dat$")
+METADATA_PATTERN = re.compile(r"^user_(?P<user_id>.+)\.json$")
+
+# WSQ streams start with the SOI marker
+WSQ_SOI = b"\xff\xa0"
+
+KIND_WSQ = "wsq"
+KIND_FMD = "fmd"
+KIND_METADATA = "metadata"
+
+# A file found by the directory walk
+LegacyFile = namedtuple("LegacyFile", ["kind", "user_id", "scan", "path"])
+# A validated record ready to be written; fingerprint is b"" for template-only (.dat) records
+LegacyRecord = namedtuple("LegacyRecord", [
+    "kind", "user_id", "path", "digest", "fingerprint", "fmd", "quality", "finger_pos",
+    "width", "height", "created_at", "metadata", "error"
+])
+
+def _classify(name, path):
+    match = WSQ_PATTERN.match(name)
+    if match:
+        return LegacyFile(KIND_WSQ, match["user_id"], int(match["scan"]), path)
+    match = FMD_PATTERN.match(name)
+    if match:
+        return LegacyFile(KIND_FMD, match["user_id"], 0, path)
+    match = METADATA_PATTERN.match(name)
+    if match:
+        return LegacyFile(KIND_METADATA, match["user_id"], 0, path)
+    return None
+
+def scan_directory(root):
+    """
+    List the legacy files in one directory (not recursive, like the old scripts).
+
+    :param root: The directory to scan.
+    :return: A list of LegacyFile tuples.
+    """
+    found = []
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    legacy_file = _classify(entry.name, entry.path)
+                    if legacy_file:
+                        found.append(legacy_file)
+    except OSError as e:
+        logging.error(f"Failed to scan {root}: {e}")
+    return found
+
+def find_legacy_files(roots=DEFAULT_ROOTS):
+    """
+    Walk the legacy directories in parallel.
+
+    :param roots: The directories to scan.
+    :return: A list of LegacyFile tuples, metadata first, then per user and scan number.
+    """
+    roots = list(dict.fromkeys(os.path.abspath(root) for root in roots))
+    with ThreadPoolExecutor(max_workers=max(1, len(roots))) as pool:
+        found = [legacy_file for files in pool.map(scan_directory, roots) for legacy_file in files]
+    order = {KIND_METADATA: 0, KIND_WSQ: 1, KIND_FMD: 2}
+    found.sort(key=lambda f: (order[f.kind], f.user_id, f.scan, f.path))
+    return found
+
+def _timestamp(path):
+    mtime = os.stat(path).st_mtime
+    return datetime.fromtimestamp(mtime, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def _failed(legacy_file, error):
+    return LegacyRecord(legacy_file.kind, legacy_file.user_id, legacy_file.path, None, None, None, None, None,
+                        None, None, None, None, error)
+
+def _template_record(legacy_file, fingerprint, fmd, fmd_type, width=None, height=None):
+    parsed = parse_fmd(fmd, fmd_type)
+    if parsed is None or not parsed["views"]:
+        return _failed(legacy_file, "invalid FMD")
+    view = parsed["views"][0]
+    payload = fingerprint if fingerprint else fmd
+    return LegacyRecord(
+        legacy_file.kind, legacy_file.user_id, legacy_file.path, hashlib.sha1(payload).hexdigest(),
+        fingerprint, fmd, view["quality"], view["finger_pos"],
+        width if width is not None else parsed["width"], height if height is not None else parsed["height"],
+        _timestamp(legacy_file.path), None, None
+    )
+
+def load_legacy_file(legacy_file, fmd_type=DPFJ_FMD_ANSI_378_2004):
+    """
+    Read and validate one legacy file.
+
+    WSQ scans are decoded and a template is extracted from them; .dat files
+    must hold a parseable FMD; JSON files must hold an object.
+
+    :param legacy_file: A LegacyFile tuple.
+    :param fmd_type: The FMD format of the templates.
+    :return: A LegacyRecord; its error field is set if the file was rejected.
+    """
+    try:
+        with open(legacy_file.path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        return _failed(legacy_file, str(e))
+
+    if legacy_file.kind == KIND_METADATA:
+        try:
+            metadata = json.loads(data)
+        except ValueError as e:
+            return _failed(legacy_file, f"invalid JSON: {e}")
+        if not isinstance(metadata, dict):
+            return _failed(legacy_file, "metadata is not a JSON object")
+        return LegacyRecord(KIND_METADATA, legacy_file.user_id, legacy_file.path, None, None, None, None, None,
+                            None, None, None, metadata, None)
+
+    if legacy_file.kind == KIND_FMD:
+        return _template_record(legacy_file, b"", data, fmd_type)
+
+    if not data.startswith(WSQ_SOI):
+        return _failed(legacy_file, "not a WSQ stream")
+    image = decode_wsq(data)
+    if image is None:
+        return _failed(legacy_file, "WSQ decoding failed")
+    fmd = create_fmd(image["data"], image["width"], image["height"], image["dpi"], fmd_type=fmd_type)
+    if fmd is None:
+        return _failed(legacy_file, "template extraction failed")
+    return _template_record(legacy_file, data, fmd, fmd_type, image["width"], image["height"])
+
+def _load_task(task):
+    return load_legacy_file(*task)
+
+def _init_worker():
+    # Every worker process loads its own copy of the SDK
+    load_dpfj_dll()
+
+def _existing_digests(conn, user_ids):
+    # Digests of what is already stored for these users, to skip files imported before
+    digests = set()
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), 500):
+        chunk = user_ids[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        # length() comes from the record header; images are then hashed through a
+        # BLOB handle in chunks rather than loaded whole into the result set
+        rows = conn.execute(
+            f"SELECT id, user_id, length(fingerprint), fmd FROM fingerprints WHERE user_id IN ({placeholders})",
+            chunk).fetchall()
+        for row_id, user_id, image_size, fmd in rows:
+            if image_size:
+                digest = hashlib.sha1()
+                with conn.blobopen("fingerprints", "fingerprint", row_id, readonly=True) as blob:
+                    for block in iter(lambda: blob.read(BLOB_CHUNK_SIZE), b""):
+                        digest.update(block)
+                digests.add((user_id, digest.hexdigest()))
+            elif fmd:
+                digests.add((user_id, hashlib.sha1(fmd).hexdigest()))
+    return digests
+
+def _write_batch(repository, users, records, fmd_type, sdk_version):
+    with repository.transaction() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, name, nik) VALUES (?, ?, ?)",
+            [(user_id, str(metadata.get("name", "")), str(metadata.get("nik", "")))
+             for user_id, metadata in users.items()]
+        )
+        conn.executemany(
+            "INSERT INTO fingerprints (user_id, fingerprint, fmd, fmd_type, sdk_version, quality, finger_pos, "
+            "width, height, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(r.user_id, r.fingerprint, r.fmd, fmd_type, sdk_version if r.kind == KIND_WSQ else None,
+              r.quality, r.finger_pos, r.width, r.height, r.created_at) for r in records]
+        )
+
+def import_legacy(roots=DEFAULT_ROOTS, db_path=DB_PATH, workers=None, batch_size=DEFAULT_BATCH_SIZE,
+                  fmd_type=DPFJ_FMD_ANSI_378_2004):
+    """
+    Import the file-based galleries of the older scripts into the enrollment database.
+
+    The directories are scanned in parallel, files are read, validated, decoded
+    and extracted on a process pool, and the records are written in large
+    batched transactions. Files whose content is already stored for the same
+    user (earlier imports, or copies in several directories) are skipped.
+    Users without a metadata file are created with an empty name and NIK;
+    existing users keep their stored name and NIK.
+
+    :param roots: The directories to scan.
+    :param db_path: Path to the SQLite enrollment database.
+    :param workers: Number of worker processes (0 runs in-process, None uses every CPU).
+    :param batch_size: Fingerprint rows per transaction.
+    :param fmd_type: The FMD format of the templates.
+    :return: A dictionary with the file, imported, duplicate and rejected counts and the throughput.
+    """
+    start = time.perf_counter()
+    legacy_files = find_legacy_files(roots)
+    print(f"[DEBUG] Found {len(legacy_files)} legacy files.")
+    report = {"files": len(legacy_files), "users": 0, "imported": 0, "duplicates": 0, "rejected": 0}
+    if not legacy_files:
+        return report
+
+    repository = get_repository(db_path)
+    reader = repository.reader()
+    sdk_version = get_sdk_version()
+    seen = _existing_digests(reader, {f.user_id for f in legacy_files if f.kind != KIND_METADATA})
+
+    workers = os.cpu_count() if workers is None else workers
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) if workers > 0 else None
+    tasks = [(legacy_file, fmd_type) for legacy_file in legacy_files]
+    if executor is not None:
+        results = executor.map(_load_task, tasks, chunksize=max(1, len(tasks) // (8 * workers)))
+    else:
+        results = map(_load_task, tasks)
+
+    metadata = {}
+    imported_users = set()
+    pending_users = {}
+    pending = []
+    try:
+        for record in results:
+            if record.error:
+                report["rejected"] += 1
+                print(f"[ERROR] Skipping {record.path}: {record.error}")
+                logging.error(f"Legacy import skipped {record.path}: {record.error}")
+                continue
+            if record.kind == KIND_METADATA:
+                metadata[record.user_id] = record.metadata
+                continue
+
+            key = (record.user_id, record.digest)
+            if key in seen:
+                report["duplicates"] += 1
+                continue
+            seen.add(key)
+            enrollment_date = metadata.get(record.user_id, {}).get("enrollment_date")
+            if enrollment_date:
+                # Prefer the enrollment date saved with the metadata over the file time
+                record = record._replace(created_at=str(enrollment_date))
+            pending_users.setdefault(record.user_id, metadata.get(record.user_id, {}))
+            pending.append(record)
+
+            if len(pending) >= batch_size:
+                _write_batch(repository, pending_users, pending, fmd_type, sdk_version)
+                report["imported"] += len(pending)
+                imported_users.update(pending_users)
+                pending, pending_users = [], {}
+                elapsed = time.perf_counter() - start
+                print(f"[DEBUG] Imported {report['imported']} rows, {report['imported'] / elapsed:.1f} rows/s.")
+
+        # Users that only have a metadata file are imported too
+        for user_id, user_metadata in metadata.items():
+            if user_id not in imported_users and not repository.user_exists(user_id):
+                pending_users.setdefault(user_id, user_metadata)
+        _write_batch(repository, pending_users, pending, fmd_type, sdk_version)
+        report["imported"] += len(pending)
+        imported_users.update(pending_users)
+        report["users"] = len(imported_users)
+    except sqlite3.Error as e:
+        print(f"[ERROR] Legacy import stopped after {report['imported']} rows: {e}")
+        logging.error(f"Legacy import stopped after {report['imported']} rows: {e}")
+        return None
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    report["seconds"] = elapsed
+    report["rows_per_second"] = report["imported"] / elapsed if elapsed > 0 else 0.0
+    print(f"[DEBUG] Legacy import finished: {report['imported']} rows for {report['users']} users, "
+          f"{report['duplicates']} duplicates, {report['rejected']} rejected, "
+          f"{report['rows_per_second']:.1f} rows/s.")
+    logging.info(f"Legacy import finished: {report}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Import legacy WSQ/FMD/JSON galleries into the enrollment database.")
+    parser.add_argument("roots", nargs="*", default=list(DEFAULT_ROOTS), help="Directories to scan.")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the enrollment database.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (0: run in-process).")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per transaction.")
+    args = parser.parse_args()
+
+    logging.basicConfig(filename="fingerprint_system.log", level=logging.INFO,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+    import_legacy(args.roots, args.db, workers=args.workers, batch_size=args.batch)
+
+if __name__ == "__main__":
+    main()
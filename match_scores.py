@@ -0,0 +1,69 @@
+import heapq
+
+# Scores are dissimilarities; a score of DPFJ_PROBABILITY_ONE * FMR corresponds
+# to that false match rate (e.g. 21474 for FMR = 1/100000)
+DPFJ_PROBABILITY_ONE = 0x7FFFFFFF
+
+# Dissimilarity threshold for a match, shared by the engines and the scripts;
+# use fmr_to_threshold(target_fmr) to set one by false match rate instead
+DEFAULT_THRESHOLD_SCORE = 100
+
+def fmr_to_threshold(target_fmr):
+    """
+    Convert a target false match rate into a dissimilarity threshold.
+
+    :param target_fmr: The target FMR (e.g. 0.00001 for 1 in 100000).
+    :return: The threshold score to pass to the matcher.
+    """
+    if not 0 < target_fmr <= 1:
+        raise ValueError(f"Target FMR must be in (0, 1], got {target_fmr}")
+    return max(1, int(DPFJ_PROBABILITY_ONE * target_fmr))
+
+def resolve_threshold(target_fmr=None, threshold_score=DEFAULT_THRESHOLD_SCORE):
+    """Return the threshold for target_fmr if it is given, otherwise threshold_score."""
+    if target_fmr is not None:
+        return fmr_to_threshold(target_fmr)
+    return threshold_score
+
+def top_k(scored, k, threshold_score=DEFAULT_THRESHOLD_SCORE):
+    """
+    Keep the k best entries below the threshold using a bounded heap.
+
+    The heap never holds more than k entries, so a scan over N scores costs
+    O(N log k). Ties are broken by the second element (the template index), so
+    the result does not depend on the order the entries arrive in.
+
+    :param scored: An iterable of (score, index, ...) tuples; None scores are skipped.
+    :param k: The number of entries to keep.
+    :param threshold_score: Entries with a score at or above this are dropped.
+    :return: The kept entries, best (lowest score) first.
+    """
+    if k <= 0:
+        return []
+    heap = []  # worst kept entry on top: keys are negated so the smallest key is the worst
+    for entry in scored:
+        score = entry[0]
+        if score is None or score >= threshold_score:
+            continue
+        key = (-score, -entry[1])
+        if len(heap) < k:
+            heapq.heappush(heap, (key, entry))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, entry))
+    return [entry for key, entry in sorted(heap, reverse=True)]
+
+def first_match(scored, threshold_score=DEFAULT_THRESHOLD_SCORE):
+    """
+    Return the first entry below the threshold, without consuming the rest.
+
+    For 1:1 verification against templates ordered best sample first: with a
+    lazy iterable of scores, a genuine probe usually costs one comparison.
+
+    :param scored: An iterable of (score, index, ...) tuples; None scores are skipped.
+    :param threshold_score: Entries with a score at or above this do not match.
+    :return: The first matching entry, or None.
+    """
+    for entry in scored:
+        if entry[0] is not None and entry[0] < threshold_score:
+            return entry
+    return None
@@ -0,0 +1,416 @@
+import os
+import struct
+import logging
+import time
+import numpy as np
+
+from db_schema import open_database
+from fmd_parser import DPFJ_FMD_ANSI_378_2004, parse_fmd, parse_fmds
+
+# Cylinder geometry (pixels at 500 dpi) and Gaussian widths, after Cappelli et al.
+MCC_RADIUS = 70
+MCC_SPATIAL_CELLS = 8          # cells per side of the cylinder base
+MCC_DIRECTION_CELLS = 6        # angular sections
+MCC_SIGMA_S = 28 / 3
+MCC_SIGMA_D = 2 * np.pi / 9
+MCC_BIT_THRESHOLD = 0.1        # cell contribution needed to set a bit
+MCC_MIN_NEIGHBORS = 2          # cylinders with fewer neighbors carry no information
+
+# Bit-sampling LSH: each table hashes HASH_BITS randomly chosen descriptor bits
+DEFAULT_TABLES = 32
+DEFAULT_HASH_BITS = 16
+DEFAULT_SEED = 378
+
+# On-disk index: header, then one record per added or removed template
+INDEX_MAGIC = b"MCCI"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<4sHHHHHHI")
+RECORD_HEADER = struct.Struct("<qHH")
+TOMBSTONE = 0xFFFF
+
+def index_path_for(db_path):
+    """
+    :param db_path: Path to the SQLite enrollment database.
+    :return: The path of the MCC index stored next to it.
+    """
+    return os.path.splitext(db_path)[0] + ".mcc"
+
+def _cell_centers(radius, spatial_cells):
+    width = 2 * radius / spatial_cells
+    coords = (np.arange(spatial_cells) + 0.5) * width - radius
+    cx, cy = np.meshgrid(coords, coords)
+    centers = np.stack([cx.ravel(), cy.ravel()], axis=1)
+    # Only cells whose center lies inside the cylinder base are part of the descriptor
+    return centers[np.hypot(centers[:, 0], centers[:, 1]) <= radius].astype(np.float32)
+
+def compute_descriptors(minutiae, radius=MCC_RADIUS, spatial_cells=MCC_SPATIAL_CELLS,
+                        direction_cells=MCC_DIRECTION_CELLS):
+    """
+    Compute the binary Minutia Cylinder-Code descriptors of one template.
+
+    Every minutia gets a cylinder aligned with its direction; each cell sums the
+    spatial and directional Gaussian contributions of the neighbouring minutiae
+    and is set when the sum exceeds MCC_BIT_THRESHOLD.
+
+    :param minutiae: A fmd_parser.MINUTIA_DTYPE array.
+    :return: A bool array of shape (cylinders, bits); cylinders with fewer than
+             MCC_MIN_NEIGHBORS neighbours are left out.
+    """
+    centers = _cell_centers(radius, spatial_cells)
+    bits = len(centers) * direction_cells
+    count = len(minutiae)
+    if count <= MCC_MIN_NEIGHBORS:
+        return np.zeros((0, bits), dtype=bool)
+
+    x = minutiae["x"].astype(np.float32)
+    y = minutiae["y"].astype(np.float32)
+    theta = np.deg2rad(minutiae["angle"].astype(np.float32))
+    dx = x[None, :] - x[:, None]
+    dy = y[None, :] - y[:, None]
+    neighbor = dx * dx + dy * dy <= (radius + 3 * MCC_SIGMA_S) ** 2
+    np.fill_diagonal(neighbor, False)
+    valid = neighbor.sum(axis=1) >= MCC_MIN_NEIGHBORS
+    neighbor &= valid[:, None]
+
+    # Only pairs within reach of the cylinder contribute; i is sorted ascending
+    i, j = np.nonzero(neighbor)
+    cos = np.cos(theta[i])
+    sin = np.sin(theta[i])
+    # Neighbour positions in the frame of the cylinder's own minutia
+    rx = dx[i, j] * cos + dy[i, j] * sin
+    ry = -dx[i, j] * sin + dy[i, j] * cos
+    spatial = np.exp(
+        -((rx[:, None] - centers[:, 0]) ** 2 + (ry[:, None] - centers[:, 1]) ** 2) / (2 * MCC_SIGMA_S ** 2)
+    )
+    section = (np.arange(direction_cells) + 0.5) * (2 * np.pi / direction_cells) - np.pi
+    delta = np.mod(theta[j] - theta[i] + np.pi - section[:, None], 2 * np.pi) - np.pi
+    directional = np.exp(-delta.T ** 2 / (2 * MCC_SIGMA_D ** 2)).astype(np.float32)
+
+    contributions = (spatial[:, :, None] * directional[:, None, :]).reshape(len(i), bits)
+    starts = np.flatnonzero(np.r_[True, i[1:] != i[:-1]]) if len(i) else np.zeros(0, dtype=np.int64)
+    cylinders = np.add.reduceat(contributions, starts, axis=0) if len(i) else contributions
+    return cylinders > MCC_BIT_THRESHOLD
+
+class MCCIndex:
+    """
+    Locality-sensitive hashing index over binary MCC descriptors.
+
+    Each cylinder of a template is hashed into every LSH table; a probe votes
+    for the templates whose cylinders land in the same buckets, and only the
+    most voted templates are handed to the exact SDK matcher.
+
+    Templates are added and removed one at a time. With a path the index is
+    persisted as an append-only file, so enrollment only writes the new
+    template's record instead of rewriting the index.
+    """
+
+    def __init__(self, path=None, tables=DEFAULT_TABLES, hash_bits=DEFAULT_HASH_BITS, seed=DEFAULT_SEED,
+                 fmd_type=DPFJ_FMD_ANSI_378_2004):
+        """
+        :param path: File the index is persisted to (None keeps it in memory only).
+        :param tables: Number of LSH tables.
+        :param hash_bits: Descriptor bits sampled per table.
+        :param seed: Seed of the bit sampling; must not change once the index is persisted.
+        :param fmd_type: FMD format of the indexed templates.
+        """
+        self.path = path
+        self.tables = tables
+        self.hash_bits = hash_bits
+        self.seed = seed
+        self.fmd_type = fmd_type
+        self.bits = len(_cell_centers(MCC_RADIUS, MCC_SPATIAL_CELLS)) * MCC_DIRECTION_CELLS
+        rng = np.random.default_rng(seed)
+        self._sampled = np.stack([rng.choice(self.bits, hash_bits, replace=False) for _ in range(tables)])
+        self._weights = (1 << np.arange(hash_bits, dtype=np.uint64)).astype(np.uint64)
+        self._clear()
+
+    def _clear(self):
+        self._buckets = [{} for _ in range(self.tables)]
+        self.template_ids = []   # ordinal -> template ID
+        self.user_ids = []       # ordinal -> user ID
+        self._ordinal_of = {}
+        self._live = bytearray()  # ordinal -> 1 while the template is indexed
+        self._descriptors = {}   # template ID -> packed descriptors, kept for persistence
+
+    def __len__(self):
+        return len(self._ordinal_of)
+
+    def __contains__(self, template_id):
+        return template_id in self._ordinal_of
+
+    def _keys(self, descriptors):
+        sampled = descriptors[:, self._sampled].astype(np.uint64)  # (cylinders, tables, hash_bits)
+        return sampled @ self._weights
+
+    def _insert(self, template_id, user_id, packed):
+        ordinal = len(self.template_ids)
+        self.template_ids.append(template_id)
+        self.user_ids.append(user_id)
+        self._ordinal_of[template_id] = ordinal
+        self._live.append(1)
+        self._descriptors[template_id] = packed
+        descriptors = np.unpackbits(packed, axis=1, count=self.bits).astype(bool)
+        for table, keys in zip(self._buckets, self._keys(descriptors).T.tolist()):
+            for key in set(keys):
+                if key:  # an all-zero sample says nothing about the template
+                    table.setdefault(key, []).append(ordinal)
+
+    def add_template(self, template_id, user_id, fmd):
+        """
+        Index a newly enrolled template.
+
+        :param template_id: The fingerprints row ID of the template.
+        :param user_id: The ID of the user.
+        :param fmd: The FMD data (bytes).
+        :return: True if the template was indexed, False if it could not be parsed.
+        """
+        parsed = parse_fmd(fmd, self.fmd_type)
+        if not parsed or not parsed["views"]:
+            logging.error(f"Cannot index template {template_id}: FMD could not be parsed.")
+            return False
+        descriptors = compute_descriptors(parsed["views"][0]["minutiae"])
+        self._add_descriptors(template_id, user_id, descriptors)
+        return True
+
+    def _add_descriptors(self, template_id, user_id, descriptors):
+        if template_id in self._ordinal_of:
+            self.remove_template(template_id)
+        packed = np.packbits(descriptors, axis=1)
+        self._insert(template_id, user_id, packed)
+        self._append_record(template_id, user_id, packed)
+
+    def remove_template(self, template_id):
+        """
+        Drop a template from the index.
+
+        Bucket entries of a removed template are skipped at search time and
+        disappear the next time the index is loaded.
+
+        :param template_id: The fingerprints row ID of the template.
+        :return: True if the template was indexed, False otherwise.
+        """
+        ordinal = self._ordinal_of.pop(template_id, None)
+        if ordinal is None:
+            return False
+        self._live[ordinal] = 0
+        del self._descriptors[template_id]
+        self._append_record(template_id, None, None)
+        return True
+
+    def remove_user(self, user_id):
+        """
+        Drop every template of a user.
+
+        :param user_id: The ID of the user.
+        :return: The number of templates removed.
+        """
+        template_ids = [
+            tid for ordinal, (tid, uid) in enumerate(zip(self.template_ids, self.user_ids))
+            if uid == user_id and self._live[ordinal]
+        ]
+        for template_id in template_ids:
+            self.remove_template(template_id)
+        return len(template_ids)
+
+    def search(self, fmd_data, max_candidates=100, min_votes=1):
+        """
+        Find the templates most likely to match a probe.
+
+        :param fmd_data: The probe FMD (bytes).
+        :param max_candidates: The number of template IDs to return.
+        :param min_votes: Minimum number of bucket collisions for a candidate.
+        :return: A list of template IDs, most voted first.
+        """
+        parsed = parse_fmd(fmd_data, self.fmd_type)
+        if not parsed or not parsed["views"] or not self.template_ids:
+            return []
+        descriptors = compute_descriptors(parsed["views"][0]["minutiae"])
+        if not len(descriptors):
+            return []
+
+        hits = []
+        for table, keys in zip(self._buckets, self._keys(descriptors).T.tolist()):
+            for key in set(keys):
+                bucket = table.get(key) if key else None
+                if bucket:
+                    hits.append(bucket)
+        if not hits:
+            return []
+        votes = np.bincount(np.concatenate(hits), minlength=len(self.template_ids))
+
+        # Buckets still hold the ordinals of removed (or replaced) templates
+        votes *= np.frombuffer(self._live, dtype=np.uint8)
+
+        candidates = np.flatnonzero(votes >= min_votes)
+        if len(candidates) > max_candidates:
+            candidates = candidates[np.argpartition(votes[candidates], -max_candidates)[-max_candidates:]]
+        candidates = candidates[np.lexsort((candidates, -votes[candidates]))]
+        return [self.template_ids[ordinal] for ordinal in candidates]
+
+    def sync(self, db_path="fingerprint_enrollment.db"):
+        """
+        Bring the index up to date with the database.
+
+        Templates enrolled since the index was saved are indexed, templates
+        deleted from the database are dropped.
+
+        :param db_path: Path to the SQLite enrollment database.
+        :return: A (added, removed) pair of counts.
+        """
+        conn = open_database(db_path)
+        try:
+            stored = set()
+            missing = []
+            cursor = conn.execute(
+                "SELECT id, user_id, fmd FROM fingerprints WHERE fmd IS NOT NULL AND fmd_type = ? ORDER BY id",
+                (self.fmd_type,)
+            )
+            for template_id, user_id, fmd in cursor:
+                stored.add(template_id)
+                if template_id not in self._ordinal_of:
+                    missing.append((template_id, user_id, fmd))
+        finally:
+            conn.close()
+
+        removed = [template_id for template_id in self._ordinal_of if template_id not in stored]
+        for template_id in removed:
+            self.remove_template(template_id)
+
+        # Parse the missing templates in one batch, then describe them one by one
+        parsed = parse_fmds([fmd for _, _, fmd in missing], self.fmd_type) if missing else None
+        for i, (template_id, user_id, _) in enumerate(missing):
+            start = parsed["starts"][i]
+            minutiae = parsed["minutiae"][start:start + parsed["counts"][i]]
+            self._add_descriptors(template_id, user_id, compute_descriptors(minutiae))
+
+        print(f"[DEBUG] MCC index synced: {len(missing)} added, {len(removed)} removed, {len(self)} indexed.")
+        logging.debug(f"MCC index synced: {len(missing)} added, {len(removed)} removed, {len(self)} indexed.")
+        return len(missing), len(removed)
+
+    def _header(self):
+        return INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, MCC_RADIUS, MCC_SPATIAL_CELLS,
+                                 MCC_DIRECTION_CELLS, self.tables, self.hash_bits, self.seed)
+
+    def _append_record(self, template_id, user_id, packed):
+        if self.path is None:
+            return
+        try:
+            new_file = not os.path.exists(self.path)
+            with open(self.path, "ab") as f:
+                if new_file:
+                    f.write(self._header())
+                if packed is None:
+                    f.write(RECORD_HEADER.pack(template_id, 0, TOMBSTONE))
+                    return
+                user_bytes = str(user_id).encode("utf-8")
+                f.write(RECORD_HEADER.pack(template_id, len(user_bytes), len(packed)))
+                f.write(user_bytes)
+                f.write(packed.tobytes())
+        except OSError as e:
+            print(f"[ERROR] Failed to write MCC index: {e}")
+            logging.error(f"Failed to write MCC index: {e}")
+
+    def load(self):
+        """
+        Load the persisted index, replaying added and removed templates.
+
+        An index written with other parameters is discarded so it can be rebuilt by sync().
+
+        :return: The number of templates loaded.
+        """
+        self._clear()
+        if self.path is None or not os.path.exists(self.path):
+            return 0
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if len(data) < INDEX_HEADER.size or data[:INDEX_HEADER.size] != self._header():
+            print("[ERROR] MCC index was built with different parameters. Rebuilding.")
+            logging.error(f"MCC index {self.path} has a different header; discarding it.")
+            os.remove(self.path)
+            return 0
+
+        entries = {}
+        packed_size = (self.bits + 7) // 8
+        offset = INDEX_HEADER.size
+        while offset + RECORD_HEADER.size <= len(data):
+            template_id, user_length, count = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+            if count == TOMBSTONE:
+                entries.pop(template_id, None)
+                continue
+            end = offset + user_length + count * packed_size
+            if end > len(data):
+                logging.error("MCC index ends with a truncated record; ignoring it.")
+                break
+            user_id = data[offset:offset + user_length].decode("utf-8")
+            packed = np.frombuffer(data, dtype=np.uint8, count=count * packed_size, offset=offset + user_length)
+            entries.pop(template_id, None)
+            entries[template_id] = (user_id, packed.reshape(count, packed_size))
+            offset = end
+
+        for template_id, (user_id, packed) in entries.items():
+            self._insert(template_id, user_id, packed)
+        logging.debug(f"MCC index loaded: {len(self)} templates from {self.path}.")
+        return len(self)
+
+    def save(self):
+        """Rewrite the index file without its removed templates."""
+        if self.path is None:
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(self._header())
+            for template_id, ordinal in self._ordinal_of.items():
+                packed = self._descriptors[template_id]
+                user_bytes = str(self.user_ids[ordinal]).encode("utf-8")
+                f.write(RECORD_HEADER.pack(template_id, len(user_bytes), len(packed)))
+                f.write(user_bytes)
+                f.write(packed.tobytes())
+        os.replace(temp_path, self.path)
+
+def benchmark(engine, index, probes, max_candidates=100, **identify_args):
+    """
+    Compare index-assisted identification with the brute-force path.
+
+    A probe counts as recalled when both paths return the same best template.
+
+    :param engine: A loaded IdentificationEngine.
+    :param index: The MCCIndex over the same gallery.
+    :param probes: A list of probe FMDs (bytes).
+    :param max_candidates: Number of index candidates passed to the matcher.
+    :param identify_args: Extra arguments for the identify calls (e.g. threshold_score).
+    :return: A dictionary with recall and mean latencies in milliseconds.
+    """
+    brute_time = 0.0
+    index_time = 0.0
+    matched = 0
+    recalled = 0
+    for fmd_data in probes:
+        start = time.perf_counter()
+        full = engine.identify(fmd_data, use_prefilter=False, **identify_args)
+        brute_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        candidates = index.search(fmd_data, max_candidates)
+        indexed = engine.identify_templates(fmd_data, candidates, **identify_args)
+        index_time += time.perf_counter() - start
+
+        if full:
+            matched += 1
+            if indexed and indexed[0].template_id == full[0].template_id:
+                recalled += 1
+
+    count = max(1, len(probes))
+    report = {
+        "probes": len(probes),
+        "matched": matched,
+        "recall": recalled / matched if matched else 1.0,
+        "brute_force_ms": 1000 * brute_time / count,
+        "index_ms": 1000 * index_time / count,
+        "candidates": max_candidates,
+        "gallery": len(engine),
+    }
+    print(f"[DEBUG] MCC index recall {report['recall']:.3f}: "
+          f"{report['index_ms']:.2f} ms vs {report['brute_force_ms']:.2f} ms brute force.")
+    logging.debug(f"MCC index benchmark: {report}")
+    return report
@@ -0,0 +1,240 @@
+import ctypes
+from ctypes import c_ubyte, c_uint, POINTER
+import logging
+import numpy as np
+
+from fmd_parser import (
+    DPFJ_FMD_ANSI_378_2004, MINUTIA_TYPE_RIDGE_ENDING, MINUTIA_TYPE_BIFURCATION,
+    parse_arena, parse_fmds
+)
+
+# Spatial density histogram is GRID x GRID cells over the image
+DEFAULT_GRID = 4
+# Fraction of the gallery sent to the matcher after prefiltering
+DEFAULT_KEEP_FRACTION = 0.2
+# Image size assumed when a template header does not carry one
+DEFAULT_WIDTH = 400
+DEFAULT_HEIGHT = 500
+
+def compute_features(parsed, grid=DEFAULT_GRID):
+    """
+    Build the prefilter feature matrix from a parsed gallery.
+
+    One row per template: minutiae count, GRID x GRID spatial density
+    histogram, ridge-ending ratio and the minutiae centroid (an estimate of the
+    core region), all computed with vectorized NumPy operations.
+
+    :param parsed: The dictionary returned by fmd_parser.parse_gallery.
+    :param grid: The histogram grid size.
+    :return: A float32 matrix of shape (templates, grid * grid + 4).
+    """
+    counts = parsed["counts"]
+    minutiae = parsed["minutiae"]
+    count = len(counts)
+    cells = grid * grid
+
+    owner = np.repeat(np.arange(count), counts)
+    width = np.where(parsed["width"] > 0, parsed["width"], DEFAULT_WIDTH).astype(np.float32)
+    height = np.where(parsed["height"] > 0, parsed["height"], DEFAULT_HEIGHT).astype(np.float32)
+    x = minutiae["x"] / width[owner]
+    y = minutiae["y"] / height[owner]
+
+    cell_x = np.clip((x * grid).astype(np.int64), 0, grid - 1)
+    cell_y = np.clip((y * grid).astype(np.int64), 0, grid - 1)
+    histogram = np.bincount(owner * cells + cell_y * grid + cell_x, minlength=count * cells)
+    histogram = histogram.reshape(count, cells).astype(np.float32)
+
+    safe_counts = np.maximum(counts, 1).astype(np.float32)
+    minutia_type = minutiae["type"]
+    endings = np.bincount(owner, weights=(minutia_type == MINUTIA_TYPE_RIDGE_ENDING), minlength=count)
+    bifurcations = np.bincount(owner, weights=(minutia_type == MINUTIA_TYPE_BIFURCATION), minlength=count)
+    typed = np.maximum(endings + bifurcations, 1)
+
+    features = np.empty((count, cells + 4), dtype=np.float32)
+    features[:, 0] = counts
+    features[:, 1:cells + 1] = histogram / safe_counts[:, None]
+    features[:, cells + 1] = endings / typed
+    features[:, cells + 2] = np.bincount(owner, weights=x, minlength=count) / safe_counts
+    features[:, cells + 3] = np.bincount(owner, weights=y, minlength=count) / safe_counts
+    return features
+
+class PrefilterIndex:
+    """
+    Coarse minutiae-statistics index used to prune the gallery before matching.
+
+    Rows are kept in the same order as the slots of the GalleryArena they were
+    built from, and follow the arena's swap-with-last removal.
+    """
+
+    def __init__(self, keep_fraction=DEFAULT_KEEP_FRACTION, grid=DEFAULT_GRID, min_keep=100):
+        """
+        :param keep_fraction: Fraction of the gallery passed on to the matcher.
+        :param grid: The spatial histogram grid size.
+        :param min_keep: Never keep fewer templates than this (small galleries are not pruned).
+        """
+        self.keep_fraction = keep_fraction
+        self.grid = grid
+        self.min_keep = min_keep
+        self.fmd_type = DPFJ_FMD_ANSI_378_2004
+        self._features = np.empty((0, grid * grid + 4), dtype=np.float32)
+        self._count = 0
+        self._scale = np.ones(grid * grid + 4, dtype=np.float32)
+        # Column sums and sums of squares, kept current by append/remove_slot for the scale
+        self._sum = np.zeros(grid * grid + 4, dtype=np.float64)
+        self._sum_squares = np.zeros(grid * grid + 4, dtype=np.float64)
+        self.probes = 0
+        self.kept = 0
+        self.scanned = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def features(self):
+        return self._features[:self._count]
+
+    def build(self, arena, fmd_type=DPFJ_FMD_ANSI_378_2004):
+        """
+        Compute the feature matrix for every template of an arena.
+
+        :param arena: The GalleryArena holding the gallery.
+        :param fmd_type: The FMD format of the templates.
+        """
+        self.fmd_type = fmd_type
+        features = compute_features(parse_arena(arena, fmd_type), self.grid)
+        self._features = features
+        self._count = len(features)
+        self._sum = features.sum(axis=0, dtype=np.float64)
+        self._sum_squares = np.square(features, dtype=np.float64).sum(axis=0)
+        self._update_scale()
+        logging.debug(f"Prefilter index built for {self._count} templates.")
+
+    def _update_scale(self):
+        # Standardize columns so no single feature dominates the distance
+        if self._count > 1:
+            mean = self._sum / self._count
+            std = np.sqrt(np.maximum(self._sum_squares / self._count - np.square(mean), 0.0))
+            # Constant columns keep a scale of 1 (and are not divided by zero)
+            scale = np.ones_like(std, dtype=np.float32)
+            np.divide(1.0, std, out=scale, where=std > 1e-6, casting="unsafe")
+            self._scale = scale
+
+    def append(self, fmd):
+        """
+        Add the features of a template appended to the arena.
+
+        :param fmd: The FMD data (bytes).
+        """
+        row = compute_features(parse_fmds([fmd], self.fmd_type), self.grid)
+        if self._count == len(self._features):
+            grown = np.empty((max(16, 2 * len(self._features)), self._features.shape[1]), dtype=np.float32)
+            grown[:self._count] = self._features[:self._count]
+            self._features = grown
+        self._features[self._count] = row[0]
+        self._count += 1
+        self._sum += row[0]
+        self._sum_squares += np.square(row[0], dtype=np.float64)
+        self._update_scale()
+
+    def remove_slot(self, slot):
+        """
+        Remove a row the same way GalleryArena.remove frees a slot.
+
+        :param slot: The arena slot that was removed.
+        """
+        last = self._count - 1
+        removed = self._features[slot].astype(np.float64)
+        self._sum -= removed
+        self._sum_squares -= np.square(removed)
+        if slot != last:
+            self._features[slot] = self._features[last]
+        self._count = last
+        self._update_scale()
+
+    def select(self, fmd_data, keep_fraction=None):
+        """
+        Choose the gallery slots closest to a probe.
+
+        :param fmd_data: The probe FMD (bytes).
+        :param keep_fraction: Override of the fraction of the gallery to keep.
+        :return: A sorted int64 array of arena slots.
+        """
+        slots = self._select(fmd_data, keep_fraction)
+        self.probes += 1
+        self.scanned += self._count
+        self.kept += len(slots)
+        return slots
+
+    def _select(self, fmd_data, keep_fraction=None):
+        # select() without updating the pruning statistics
+        keep_fraction = self.keep_fraction if keep_fraction is None else keep_fraction
+        count = self._count
+        keep = min(count, max(self.min_keep, int(np.ceil(count * keep_fraction))))
+        if keep >= count:
+            return np.arange(count, dtype=np.int64)
+
+        probe = compute_features(parse_fmds([fmd_data], self.fmd_type), self.grid)[0]
+        distance = np.square((self.features - probe) * self._scale).sum(axis=1)
+        slots = np.argpartition(distance, keep - 1)[:keep]
+        slots.sort()
+        return slots
+
+    def gather_tables(self, arena, slots):
+        """
+        Build dpfj_identify pointer and size tables for the selected slots.
+
+        :param arena: The GalleryArena holding the gallery.
+        :param slots: The slots returned by select().
+        :return: (fmds_ptrs, fmds_sizes, keepalive); keep the last item referenced
+                 while the tables are in use.
+        """
+        count = len(arena)
+        ptrs = np.frombuffer(arena.pointer_table, dtype=np.uintp, count=count)[slots]
+        sizes = np.frombuffer(arena.fmds_sizes, dtype=np.uint32, count=count)[slots]
+        fmds_ptrs = ctypes.cast(ptrs.ctypes.data, POINTER(POINTER(c_ubyte)))
+        fmds_sizes = ctypes.cast(sizes.ctypes.data, POINTER(c_uint))
+        return fmds_ptrs, fmds_sizes, (ptrs, sizes)
+
+    def pruning_rate(self):
+        """Fraction of matcher work saved so far."""
+        if not self.scanned:
+            return 0.0
+        return 1.0 - self.kept / self.scanned
+
+    def measure_recall(self, engine, probes, keep_fraction=None, **identify_args):
+        """
+        Measure what the prefilter costs in accuracy on a set of probes.
+
+        Each probe is identified on the full gallery and on the pruned one; a probe
+        counts as recalled when the full search's best match survives pruning.
+
+        :param engine: The IdentificationEngine the index belongs to.
+        :param probes: A list of probe FMDs (bytes).
+        :param keep_fraction: Override of the fraction of the gallery to keep.
+        :param identify_args: Extra arguments for IdentificationEngine.identify.
+        :return: A dictionary with "probes", "matched", "recall" and "pruning_rate".
+        """
+        matched = 0
+        recalled = 0
+        kept = 0
+        for fmd_data in probes:
+            full = engine.identify(fmd_data, use_prefilter=False, **identify_args)
+            if not full:
+                continue
+            matched += 1
+            slots = self._select(fmd_data, keep_fraction)
+            kept += len(slots)
+            best_template = full[0].template_id
+            kept_templates = {engine.arena.template_ids[slot] for slot in slots}
+            if best_template in kept_templates:
+                recalled += 1
+
+        report = {
+            "probes": len(probes),
+            "matched": matched,
+            "recall": recalled / matched if matched else 1.0,
+            "pruning_rate": 1.0 - kept / (matched * self._count) if matched and self._count else 0.0,
+        }
+        print(f"[DEBUG] Prefilter recall {report['recall']:.3f} at pruning rate {report['pruning_rate']:.3f}.")
+        logging.debug(f"Prefilter evaluation: {report}")
+        return report
@@ -0,0 +1,140 @@
+import sys
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+# Default memory budget for cached templates
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Rough per-entry overhead of the Python objects around the FMD bytes
+ENTRY_OVERHEAD = 512
+
+# Ready-to-match data of one enrolled user
+CachedUser = namedtuple("CachedUser", ["name", "nik", "fmds"])
+
+class TemplateCache:
+    """
+    Bounded LRU cache of per-user verification data, keyed by user ID.
+
+    Holds each user's FMDs together with the name and NIK, so a repeated 1:1
+    verification skips the database and template extraction. Entries are
+    evicted least recently used first once the memory budget is exceeded, and
+    must be invalidated whenever the user's enrollment changes.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param max_bytes: Memory budget for the cached entries.
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    @property
+    def used_bytes(self):
+        return self._bytes
+
+    @staticmethod
+    def _entry_size(user_id, name, nik, fmds):
+        size = ENTRY_OVERHEAD + sum(len(fmd) for fmd in fmds)
+        for value in (user_id, name, nik):
+            size += sys.getsizeof(value)
+        return size
+
+    def get(self, user_id):
+        """
+        Look up a user.
+
+        :param user_id: The ID of the user.
+        :return: A CachedUser(name, nik, fmds) tuple, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry
+
+    def put(self, user_id, name, nik, fmds):
+        """
+        Cache a user's verification data, evicting older entries if needed.
+
+        :param user_id: The ID of the user.
+        :param name: The name of the user.
+        :param nik: The NIK of the user.
+        :param fmds: The user's enrolled FMDs (list of bytes).
+        :return: The CachedUser tuple (also returned when it is too large to cache).
+        """
+        entry = CachedUser(name, nik, tuple(bytes(fmd) for fmd in fmds))
+        size = self._entry_size(user_id, name, nik, entry.fmds)
+        with self._lock:
+            self._discard(user_id)
+            if size > self.max_bytes:
+                logging.debug(f"Templates of user {user_id} exceed the cache budget; not cached.")
+                return entry
+            self._entries[user_id] = entry
+            self._sizes[user_id] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted, _ = self._entries.popitem(last=False)
+                self._bytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+        return entry
+
+    def _discard(self, user_id):
+        if self._entries.pop(user_id, None) is not None:
+            self._bytes -= self._sizes.pop(user_id)
+            return True
+        return False
+
+    def invalidate(self, user_id):
+        """
+        Drop a user's entry after their enrollment changed.
+
+        :param user_id: The ID of the user.
+        :return: True if the user was cached, False otherwise.
+        """
+        with self._lock:
+            removed = self._discard(user_id)
+        if removed:
+            logging.debug(f"Template cache entry of user {user_id} invalidated.")
+        return removed
+
+    def clear(self):
+        """Drop every entry (e.g. after the enrollment tables were deleted)."""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def hit_rate(self):
+        """Fraction of lookups served from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """
+        :return: A dictionary with the entry count, memory use and hit/miss counters.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hit_rate(),
+            }
@@ -4,6 +4,10 @@ import os
 from PIL import Image
 import wsq
 import io
+from match_scores import DEFAULT_THRESHOLD_SCORE
+from db_schema import DB_PATH
+from identification_workers import IdentificationWorkerPool
+from legacy_import import import_legacy
 
 # Load the DPFPDD and DPFJ DLLs
 dpfpdd_dll = ctypes.WinDLL("dpfpdd.dll")
@@ -478,12 +482,45 @@ def save_wsq_file(compressed_data, filename):
         print(f"[ERROR] Failed to save WSQ file: {e}")
         logging.error(f"Failed to save WSQ file: {e}")
 
-def identify_user(dev, database_dir="database"):
+# Worker pool serving identify_user, started by its first call
+_identification_pool = None
+
+def get_identification_pool(database_dir="database", db_path=DB_PATH):
+    """
+    Get the worker pool that matches probes against the enrolled gallery.
+
+    The first call imports the scans saved by enroll_user into the enrollment
+    database, so templates are extracted once instead of on every request, and
+    loads them into the pool. Later calls only apply the changes made since.
+
+    :param database_dir: Directory containing enrolled fingerprint data.
+    :param db_path: Path to the enrollment database.
+    :return: A loaded IdentificationWorkerPool.
+    """
+    global _identification_pool
+    if _identification_pool is None:
+        import_legacy([database_dir], db_path)
+        pool = IdentificationWorkerPool(db_path)
+        pool.load()
+        _identification_pool = pool
+    else:
+        _identification_pool.sync()
+    return _identification_pool
+
+def close_identification_pool():
+    """Stop the identification workers."""
+    global _identification_pool
+    if _identification_pool is not None:
+        _identification_pool.close()
+        _identification_pool = None
+
+def identify_user(dev, database_dir="database", db_path=DB_PATH):
     """
     Identify a user by comparing their fingerprint with enrolled templates.
 
     :param dev: The fingerprint device handle.
     :param database_dir: Directory containing enrolled fingerprint data.
+    :param db_path: Path to the enrollment database the scans are imported into.
     :return: The user ID if a match is found, otherwise None.
     """
     print("Identifying user...")
@@ -519,40 +556,13 @@ def identify_user(dev, database_dir="database"):
         print("[ERROR] Invalid FMD. Cannot proceed with identification.")
         return None
 
-    # Load all enrolled FMD templates
-    enrolled_fmds = []
-    user_ids = []
-    for filename in os.listdir(database_dir):
-        if filename.startswith("user_") and filename.endswith(".wsq"):
-            # Decompress WSQ data
-            with open(os.path.join(database_dir, filename), "rb") as f:
-                compressed_data = f.read()
-                decompressed_data = expand_raw(compressed_data)
-                if not decompressed_data:
-                    print(f"[ERROR] Failed to decompress WSQ file: {filename}")
-                    continue
-
-                # Create FMD from decompressed raw image data
-                enrolled_fmd = create_fmd_from_raw(
-                    decompressed_data["data"],  # Raw image data
-                    width=400,                 # Image width
-                    height=500,                # Image height
-                    dpi=500,                   # Image DPI
-                    finger_pos=DPFJ_POSITION_UNKNOWN,  # Finger position
-                    cbeff_id=0,                # CBEFF ID
-                    fmd_type=DPFJ_FMD_ANSI_378_2004  # FMD type
-                )
-                if enrolled_fmd:
-                    enrolled_fmds.append(enrolled_fmd)
-                    user_ids.append(filename.split("_")[1])  # Extract user ID from filename
-
-    # Compare the extracted FMD with enrolled templates
-    for i, enrolled_fmd in enumerate(enrolled_fmds):
-        score = compare_fmds(fmd_data, enrolled_fmd)
-        if score is not None and score < 100:  # Adjust threshold as needed
-            user_id = user_ids[i]
-            print(f"Match found! User ID: {user_id}, Score: {score}")
-            return user_id
+    # Match against the whole gallery on the worker pool, in one SDK call per worker
+    pool = get_identification_pool(database_dir, db_path)
+    candidates = pool.identify(fmd_data, max_candidates=1, threshold_score=DEFAULT_THRESHOLD_SCORE)
+    if candidates:
+        user_id, score = candidates[0].user_id, candidates[0].score
+        print(f"Match found! User ID: {user_id}, Score: {score}")
+        return user_id
 
     print("No match found.")
     return None
@@ -842,7 +852,7 @@ def get_processed_data():
         logging.error(f"Failed to retrieve processed data. Error Code: {result}")
         return None
     
-def enroll_user(dev, user_id, num_scans=4, database_dir="database"):
+def enroll_user(dev, user_id, num_scans=4, database_dir="database", db_path=DB_PATH):
     """
     Enroll a user by capturing and saving their fingerprint data.
 
@@ -850,6 +860,7 @@ def enroll_user(dev, user_id, num_scans=4, database_dir="database"):
     :param user_id: The ID of the user.
     :param num_scans: Number of fingerprint scans to capture (default: 4).
     :param database_dir: Directory to save enrolled fingerprint data.
+    :param db_path: Path to the enrollment database the saved scans are imported into.
     :return: True if enrollment is successful, False otherwise.
     """
     print(f"Enrolling user {user_id}...")
@@ -921,6 +932,8 @@ def enroll_user(dev, user_id, num_scans=4, database_dir="database"):
     else:
         print("Enrollment finished successfully.")
         logging.debug("Enrollment finished successfully.")
+        # Store the new scans and their templates so identify_user finds them on its next sync
+        import_legacy([database_dir], db_path, workers=0)
         return True
               
 def extract_raw_image(image_data, width=400, height=500):
@@ -1035,6 +1048,7 @@ if __name__ == "__main__":
         print("User not identified.")
 
     # Cleanup
+    close_identification_pool()
     dpfpdd_dll.dpfpdd_close(dev)
     dpfpdd_dll.dpfpdd_exit()
     
\ No newline at end of file
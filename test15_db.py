@@ -1,6 +1,5 @@
 import ctypes
 from ctypes import c_int, c_uint, POINTER, Structure, c_void_p, c_char_p, c_ubyte, byref
-import os
 from PIL import Image
 import wsq
 import io
@@ -8,6 +7,24 @@ import sqlite3
 import cv2
 import numpy as np
 import logging
+from identification_engine import get_sdk_version, load_dpfj_dll, ubyte_array
+from match_scores import DEFAULT_THRESHOLD_SCORE, first_match
+from fmd_parser import parse_fmd
+from fir_parser import DPFPDD_IMG_FMT_ISOIEC19794, raw_image_from_fir
+from image_quality import assess_image, sample_score
+from template_cache import TemplateCache
+from image_cache import DecodedImageCache
+from identification_workers import IdentificationWorkerPool
+from enrollment_repository import get_repository, StagedEnrollment, KEEP_SAMPLES, MAX_EXTRA_SCANS
+
+# Templates, name and NIK of recently verified users
+verification_cache = TemplateCache()
+
+# Decoded images of recently used fingerprint rows (diagnostics and template re-extraction)
+image_cache = DecodedImageCache()
+
+# Shared database access (per-thread readers, one writer)
+repository = get_repository('fingerprint_enrollment.db')
 
 # Setup logging
 logging.basicConfig(
@@ -16,9 +33,9 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-# Load the DPFPDD and DPFJ DLLs
+# Load the DPFPDD and DPFJ DLLs (the DPFJ handle is shared with identification_engine)
 dpfpdd_dll = ctypes.WinDLL("dpfpdd.dll")
-dpfj_dll = ctypes.WinDLL("dpfj.dll")
+dpfj_dll = load_dpfj_dll()
 # Load the DPFJ Compression DLL
 dpfj_compression_dll = ctypes.WinDLL("./dpfj_compression.dll")
 
@@ -330,11 +347,11 @@ def capture_fingerprint(dev):
     """
     Capture a fingerprint image from the device.
     :param dev: The fingerprint device handle.
-    :return: The captured image data (bytes) or None if failed.
+    :return: The captured image data (memoryview over the capture buffer) or None if failed.
     """
     capture_param = DPFPDD_CAPTURE_PARAM()
     capture_param.size = ctypes.sizeof(DPFPDD_CAPTURE_PARAM)
-    capture_param.image_fmt = 0x01010007  # ISO format
+    capture_param.image_fmt = DPFPDD_IMG_FMT_ISOIEC19794  # ISO format
     capture_param.image_proc = 2  # Enhanced processing
     capture_param.image_res = 500  # 500 DPI
 
@@ -359,10 +376,11 @@ def capture_fingerprint(dev):
         
         # Debug: Simpan data gambar mentah ke file untuk inspeksi
         with open("captured_image.raw", "wb") as f:
-            f.write(bytes(image_buffer))
+            f.write(image_buffer)
         print("[DEBUG] Raw image data saved to 'captured_image.raw'.")
         
-        return bytes(image_buffer)
+        # A view over the capture buffer: the pixels are parsed and extracted in place
+        return memoryview(image_buffer).cast("B")[:image_size.value]
     else:
         print(f"[ERROR] Failed to capture fingerprint. Error Code: {result}")
         return None
@@ -371,7 +389,7 @@ def create_fmd_from_raw(image_data, width, height, dpi=500, finger_pos=DPFJ_POSI
     """
     Create FMD (Fingerprint Minutiae Data) from raw image data.
 
-    :param image_data: The raw image data (bytes).
+    :param image_data: The raw image data (bytes-like).
     :param width: The width of the image in pixels.
     :param height: The height of the image in pixels.
     :param dpi: The resolution of the image in DPI (default: 500).
@@ -380,8 +398,8 @@ def create_fmd_from_raw(image_data, width, height, dpi=500, finger_pos=DPFJ_POSI
     :param fmd_type: The target FMD format (default: DPFJ_FMD_ANSI_378_2004).
     :return: The FMD data (bytes) or None if failed.
     """
-    # Convert image_data to c_ubyte array
-    image_data_array = (ctypes.c_ubyte * len(image_data)).from_buffer_copy(image_data)
+    # Share image_data with the SDK as a c_ubyte array (copied only if read-only)
+    image_data_array = ubyte_array(image_data)
 
     # Initialize FMD buffer and size
     fmd_size = ctypes.c_uint(0)  # Initialize size to 0 to determine required size
@@ -390,7 +408,7 @@ def create_fmd_from_raw(image_data, width, height, dpi=500, finger_pos=DPFJ_POSI
     # First call to determine required buffer size
     result = dpfj_dll.dpfj_create_fmd_from_raw(
         image_data_array,  # image_data
-        len(image_data),   # image_size
+        len(image_data_array),  # image_size
         width,             # image_width
         height,            # image_height
         dpi,               # image_dpi
@@ -416,7 +434,7 @@ def create_fmd_from_raw(image_data, width, height, dpi=500, finger_pos=DPFJ_POSI
     # Second call to create FMD
     result = dpfj_dll.dpfj_create_fmd_from_raw(
         image_data_array,  # image_data
-        len(image_data),   # image_size
+        len(image_data_array),  # image_size
         width,             # image_width
         height,            # image_height
         dpi,               # image_dpi
@@ -498,54 +516,94 @@ def identify_user(dev):
     # Step 1: Input user ID
     user_id = input("Enter your user ID: ")
 
-    # Step 2: Check if user ID exists in the database
-    conn = sqlite3.connect('fingerprint_enrollment.db')
-    cursor = conn.execute("SELECT name, nik FROM users WHERE user_id = ?", (user_id,))
-    user_info = cursor.fetchone()
+    # Step 2: Load the user's name, NIK and templates, from the cache when possible
+    cached_user = verification_cache.get(user_id)
+    if cached_user is None:
+        user_info = repository.get_user(user_id)
+        if not user_info:
+            print("[ERROR] User ID not found in the database.")
+            return None
 
-    if not user_info:
-        print("[ERROR] User ID not found in the database.")
-        conn.close()
-        return None
+        enrolled_fmds = load_user_templates(user_id)
+        cached_user = verification_cache.put(user_id, user_info.name, user_info.nik, enrolled_fmds)
 
-    name, nik = user_info  # Retrieve user name and NIK
+    name, nik, enrolled_fmds = cached_user
 
     # Step 3: Capture fingerprint image
     print("Capturing fingerprint...")
     image_data = capture_fingerprint(dev)
     if not image_data:
         print("[ERROR] Failed to capture fingerprint.")
-        conn.close()
+        return None
+
+    # Reject unusable captures before any SDK call
+    if not validate_image_quality(image_data):
+        print("[ERROR] Image quality is poor. Please scan again.")
         return None
 
     # Step 4: Extract raw image data
-    raw_image_data = extract_raw_image(image_data, width=400, height=500)
-    if not raw_image_data:
+    raw_image = extract_raw_image(image_data)
+    if not raw_image:
         print("[ERROR] Failed to extract raw image data.")
-        conn.close()
         return None
 
     # Step 5: Create FMD from raw image data
     fmd_data = create_fmd_from_raw(
-        raw_image_data,
-        width=400,
-        height=500,
-        dpi=500,
+        raw_image["data"],
+        width=raw_image["width"],
+        height=raw_image["height"],
+        dpi=raw_image["dpi"],
         finger_pos=DPFJ_POSITION_UNKNOWN,
         cbeff_id=0,
         fmd_type=DPFJ_FMD_ANSI_378_2004
     )
     if not fmd_data:
         print("[ERROR] Failed to create FMD from raw image data.")
-        conn.close()
         return None
 
-    # Step 6: Load enrolled FMDs for the user
+    # Step 6: Compare the extracted FMD with the enrolled templates, best sample first,
+    # and stop at the first match
+    scores = ((compare_fmds(fmd_data, enrolled_fmd), i) for i, enrolled_fmd in enumerate(enrolled_fmds))
+    match = first_match(scores, threshold_score=DEFAULT_THRESHOLD_SCORE)
+    logging.debug(f"Verification cache: {verification_cache.stats()}")
+    if match:
+        print(f"Match found! User: {name}, NIK: {nik}, Score: {match[0]}")
+        return name, nik  # Return user's name and NIK
+
+    print("No match found.")
+    return None
+
+def load_user_templates(user_id, fmd_type=DPFJ_FMD_ANSI_378_2004):
+    """
+    Load the enrolled FMDs of a user.
+
+    Stored templates are used as-is. Rows without a template (or with a template
+    of another format) are decompressed and extracted once, and the result is
+    written back so the next identification can skip the extraction.
+
+    :param user_id: The ID of the user.
+    :param fmd_type: The FMD format expected by the matcher.
+    :return: A list of FMDs (list of bytes).
+    """
     enrolled_fmds = []
-    cursor = conn.execute("SELECT fingerprint FROM fingerprints WHERE user_id = ?", (user_id,))
-    for row in cursor:
-        compressed_data = row[0]
-        decompressed_data = expand_raw(compressed_data)
+    missing_rows = []
+    for template in repository.get_user_templates(user_id):
+        if template.fmd and template.fmd_type == fmd_type:
+            enrolled_fmds.append(bytes(template.fmd))
+        else:
+            missing_rows.append(template.id)
+
+    if not missing_rows:
+        return enrolled_fmds
+
+    print(f"[DEBUG] {len(missing_rows)} fingerprint(s) without stored template, extracting.")
+    logging.debug(f"{len(missing_rows)} fingerprint(s) of user {user_id} without stored template.")
+    sdk_version = get_sdk_version()
+    image_cache.sync(repository)
+    image_sizes = dict(repository.get_user_images(user_id))
+    for row_id in missing_rows:
+        # Only rows that need an extraction load their image, and only on a cache miss
+        decompressed_data = image_cache.decode(row_id, image_sizes.get(row_id), repository.get_fingerprint, expand_raw)
         if not decompressed_data:
             print("[ERROR] Failed to decompress fingerprint data.")
             continue
@@ -553,27 +611,19 @@ def identify_user(dev):
         # Create FMD from decompressed raw image data
         enrolled_fmd = create_fmd_from_raw(
             decompressed_data["data"],
-            width=400,
-            height=500,
+            width=decompressed_data["width"],
+            height=decompressed_data["height"],
             dpi=500,
             finger_pos=DPFJ_POSITION_UNKNOWN,
             cbeff_id=0,
-            fmd_type=DPFJ_FMD_ANSI_378_2004
+            fmd_type=fmd_type
         )
         if enrolled_fmd:
             enrolled_fmds.append(enrolled_fmd)
+            repository.update_template(row_id, enrolled_fmd, fmd_type, sdk_version)
 
-    # Step 7: Compare the extracted FMD with enrolled templates
-    for enrolled_fmd in enrolled_fmds:
-        score = compare_fmds(fmd_data, enrolled_fmd)
-        if score is not None and score < 100:  # Adjust threshold as needed
-            print(f"Match found! User: {name}, NIK: {nik}")
-            conn.close()
-            return name, nik  # Return user's name and NIK
-
-    print("No match found.")
-    conn.close()
-    return None
+    logging.debug(f"Decoded image cache: {image_cache.stats()}")
+    return enrolled_fmds
 
 def compare_fmds(fmd1, fmd2):
     """
@@ -621,13 +671,10 @@ def identify_user2(dev):
     user_id = input("Enter your user ID: ")
 
     # Step 2: Check if user ID exists in the database
-    conn = sqlite3.connect('fingerprint_enrollment.db')
-    cursor = conn.execute("SELECT name, nik FROM users WHERE user_id = ?", (user_id,))
-    user_info = cursor.fetchone()
+    user_info = repository.get_user(user_id)
 
     if not user_info:
         print("[ERROR] User ID not found in the database.")
-        conn.close()
         return None
 
     # Step 3: Capture fingerprint image
@@ -635,69 +682,109 @@ def identify_user2(dev):
     image_data = capture_fingerprint(dev)
     if not image_data:
         print("[ERROR] Failed to capture fingerprint.")
-        conn.close()
+        return None
+
+    # Reject unusable captures before any SDK call
+    if not validate_image_quality(image_data):
+        print("[ERROR] Image quality is poor. Please scan again.")
         return None
 
     # Step 4: Extract raw image data
-    raw_image_data = extract_raw_image(image_data, width=400, height=500)
-    if not raw_image_data:
+    raw_image = extract_raw_image(image_data)
+    if not raw_image:
         print("[ERROR] Failed to extract raw image data.")
-        conn.close()
         return None
 
     # Step 5: Create FMD from raw image data
     fmd_data = create_fmd_from_raw(
-        raw_image_data,
-        width=400,
-        height=500,
-        dpi=500,
+        raw_image["data"],
+        width=raw_image["width"],
+        height=raw_image["height"],
+        dpi=raw_image["dpi"],
         finger_pos=DPFJ_POSITION_UNKNOWN,
         cbeff_id=0,
         fmd_type=DPFJ_FMD_ANSI_378_2004
     )
     if not fmd_data:
         print("[ERROR] Failed to create FMD from raw image data.")
-        conn.close()
         return None
 
-    # Step 6: Load enrolled FMDs for the user
-    enrolled_fmds = []
-    for filename in os.listdir("database"):
-        if filename.startswith(f"user_{user_id}") and filename.endswith(".wsq"):
-            # Decompress WSQ data
-            with open(os.path.join("database", filename), "rb") as f:
-                compressed_data = f.read()
-                decompressed_data = expand_raw(compressed_data)
-                if not decompressed_data:
-                    print(f"[ERROR] Failed to decompress WSQ file: {filename}")
-                    continue
-
-                # Create FMD from decompressed raw image data
-                enrolled_fmd = create_fmd_from_raw(
-                    decompressed_data["data"],
-                    width=400,
-                    height=500,
-                    dpi=500,
-                    finger_pos=DPFJ_POSITION_UNKNOWN,
-                    cbeff_id=0,
-                    fmd_type=DPFJ_FMD_ANSI_378_2004
-                )
-                if enrolled_fmd:
-                    enrolled_fmds.append(enrolled_fmd)
-
-    # Step 7: Compare the extracted FMD with enrolled templates
-    for enrolled_fmd in enrolled_fmds:
-        score = compare_fmds(fmd_data, enrolled_fmd)
-        if score is not None and score < 100:  # Adjust threshold as needed
-            name, nik = user_info  # Retrieve user name and NIK
-            print(f"Match found! User found: {name}, NIK: {nik}")
-            conn.close()
-            return name, nik  # Return user's name and NIK
+    # Step 6: Load enrolled FMDs for the user from the database
+    # (legacy database/*.wsq files are brought in once with legacy_import.py)
+    enrolled_fmds = load_user_templates(user_id)
+
+    # Step 7: Compare the extracted FMD with the enrolled templates, best sample first,
+    # and stop at the first match
+    scores = ((compare_fmds(fmd_data, enrolled_fmd), i) for i, enrolled_fmd in enumerate(enrolled_fmds))
+    match = first_match(scores, threshold_score=DEFAULT_THRESHOLD_SCORE)
+    if match:
+        _, name, nik = user_info  # Retrieve user name and NIK
+        print(f"Match found! User found: {name}, NIK: {nik}, Score: {match[0]}")
+        return name, nik  # Return user's name and NIK
 
     print("No match found.")
-    conn.close()
     return None
       
+def identify_user_1n(dev, engine):
+    """
+    Identify a user without a user ID by searching the whole gallery.
+
+    :param dev: The fingerprint device handle.
+    :param engine: A loaded IdentificationEngine or IdentificationWorkerPool.
+    :return: The matched user's ID, name and NIK, otherwise None.
+    """
+    # Step 1: Capture fingerprint image
+    print("Capturing fingerprint...")
+    image_data = capture_fingerprint(dev)
+    if not image_data:
+        print("[ERROR] Failed to capture fingerprint.")
+        return None
+
+    # Reject unusable captures before any SDK call
+    if not validate_image_quality(image_data):
+        print("[ERROR] Image quality is poor. Please scan again.")
+        return None
+
+    # Step 2: Extract raw image data
+    raw_image = extract_raw_image(image_data)
+    if not raw_image:
+        print("[ERROR] Failed to extract raw image data.")
+        return None
+
+    # Step 3: Create FMD from raw image data
+    fmd_data = create_fmd_from_raw(
+        raw_image["data"],
+        width=raw_image["width"],
+        height=raw_image["height"],
+        dpi=raw_image["dpi"],
+        finger_pos=DPFJ_POSITION_UNKNOWN,
+        cbeff_id=0,
+        fmd_type=DPFJ_FMD_ANSI_378_2004
+    )
+    if not fmd_data:
+        print("[ERROR] Failed to create FMD from raw image data.")
+        return None
+
+    # Step 4: Apply enrollments committed since the last search, then match
+    # against the whole gallery in one SDK call
+    engine.sync()
+    candidates = engine.identify(fmd_data, max_candidates=1, threshold_score=DEFAULT_THRESHOLD_SCORE)
+    if not candidates:
+        print("No match found.")
+        return None
+
+    user_id = candidates[0][0]
+    user_info = repository.get_user(user_id)
+    if not user_info:
+        print(f"[ERROR] Matched user ID {user_id} has no user record.")
+        logging.error(f"Matched user ID {user_id} has no user record.")
+        return None
+
+    _, name, nik = user_info
+    print(f"Match found! User ID: {user_id}, Name: {name}, NIK: {nik}")
+    logging.debug(f"1:N match found for user {user_id}.")
+    return user_id, name, nik
+
 # Contoh penggunaan compare_fmds untuk diagnostik
 def diagnostic_compare(fmd1, fmd2):
     """
@@ -726,6 +813,36 @@ def diagnostic_compare(fmd1, fmd2):
             else:
                 print("Fingerprints are very dissimilar.")
 
+def diagnose_stored_fingerprints(user_id):
+    """
+    Score the stored fingerprint images of a user with the capture quality gate.
+
+    Images are decoded through the decoded image cache, so looking at the same
+    user again does not decode anything.
+
+    :param user_id: The ID of the user.
+    :return: A list of (row_id, assessment) pairs, best stored sample first.
+    """
+    results = []
+    # Drop cached images whose rows were rewritten since the last lookup
+    image_cache.sync(repository)
+    for stored in repository.get_user_images(user_id):
+        decompressed_data = image_cache.decode(stored.id, stored.size, repository.get_fingerprint, expand_raw)
+        if not decompressed_data:
+            print(f"[ERROR] Failed to decompress fingerprint {stored.id}.")
+            continue
+        assessment = assess_image(decompressed_data["image"])
+        if assessment is None:
+            continue
+        print(f"Fingerprint {stored.id}: {decompressed_data['width']}x{decompressed_data['height']}, "
+              f"score {assessment['score']}, coverage {assessment['coverage']:.0%}, "
+              f"condition {assessment['condition']}")
+        if assessment["reasons"]:
+            print(f"  Would be rejected now: {', '.join(assessment['reasons'])}")
+        results.append((stored.id, assessment))
+    logging.debug(f"Decoded image cache: {image_cache.stats()}")
+    return results
+
 def validate_fmd(fmd_data):
     """
     Validate FMD data.
@@ -737,12 +854,17 @@ def validate_fmd(fmd_data):
         print("[ERROR] FMD data is empty.")
         return False
 
-    # Check if FMD starts with "FMR" (ANSI/ISO FMD header)
-    if fmd_data[:3] != b"FMR":
-        print("[ERROR] Invalid FMD header. Expected 'FMR'.")
+    # Parse the ANSI/ISO record: header, finger views and minutiae
+    parsed = parse_fmd(fmd_data, DPFJ_FMD_ANSI_378_2004)
+    if parsed is None:
+        print("[ERROR] Invalid FMD record.")
+        return False
+
+    if not parsed["views"]:
+        print("[ERROR] FMD contains no finger views.")
         return False
 
-    print("FMD is valid.")
+    print(f"FMD is valid. Minutiae: {len(parsed['views'][0]['minutiae'])}")
     return True
 
 def validate_fmd_quality(fmd_data):
@@ -771,31 +893,45 @@ def validate_image_quality(image_data):
     Validate the quality of the captured fingerprint image.
 
     :param image_data: The raw image data (bytes).
-    :return: True if image quality is good, False otherwise.
+    :return: The assess_image result if image quality is good (reused for the sample
+             score at enrollment), None otherwise.
     """
     # Example: Check if image size is within expected range
     if len(image_data) < 10000 or len(image_data) > 200046:
         print("[ERROR] Invalid image size. Expected size between 10000 and 50000 bytes.")
-        return False
+        return None
 
     # Example: Check if image contains enough detail (placeholder logic)
     # You can use image processing libraries like OpenCV for more advanced checks.
-    if not has_enough_detail(image_data):
+    assessment = has_enough_detail(image_data)
+    if not assessment:
         print("[ERROR] Image does not contain enough detail.")
-        return False
+        return None
 
     print("Image quality is good.")
-    return True
+    return assessment
   
 def has_enough_detail(image_data):
     """
-    Placeholder function to check if the image contains enough detail.
+    Check that the image contains enough ridge detail to be worth extracting.
 
-    :param image_data: The raw image data (bytes).
-    :return: True if the image contains enough detail, False otherwise.
+    The frame is scored block-wise by image_quality.assess_image: finger
+    coverage, local contrast, ridge orientation coherence and dry/wet balance.
+
+    :param image_data: The captured image record (bytes-like).
+    :return: The assess_image result if the image contains enough detail, None otherwise.
     """
-    # Implement your logic here (e.g., using OpenCV to analyze image quality).
-    return True  # Placeholder
+    assessment = assess_image(image_data)
+    if assessment is None:
+        return None
+
+    print(f"[DEBUG] Image quality score: {assessment['score']}, coverage: {assessment['coverage']:.0%}, "
+          f"condition: {assessment['condition']}")
+    if not assessment["usable"]:
+        print(f"[ERROR] Unusable capture: {', '.join(assessment['reasons'])}.")
+        logging.error(f"Unusable capture: {', '.join(assessment['reasons'])}.")
+        return None
+    return assessment
 
 import logging
 import json
@@ -939,112 +1075,162 @@ def get_processed_data():
         logging.error(f"Failed to retrieve processed data. Error Code: {result}")
         return None
     
-def enroll_user(dev, user_id, name, nik, num_scans=4):
+def enroll_user(dev, user_id, name, nik, num_scans=4, index=None, engine=None, reject_duplicates=True,
+                keep_samples=KEEP_SAMPLES):
     """
     Enroll a user by capturing and saving their fingerprint data.
+
+    Every sample gets a quality score. Up to MAX_EXTRA_SCANS more scans are
+    taken while fewer than keep_samples samples score well, and only the
+    keep_samples best are stored.
     :param dev: The fingerprint device handle.
     :param user_id: The ID of the user.
     :param name: The name of the user.
     :param nik: The NIK of the user.
     :param num_scans: Number of fingerprint scans to capture (default: 4).
+    :param index: Optional MCCIndex updated with the new templates after the commit.
+    :param engine: Optional loaded IdentificationEngine; each new template is searched in
+                   it for a finger already enrolled under another user ID. An
+                   IdentificationWorkerPool cannot take single templates and is not accepted.
+    :param reject_duplicates: Abort the enrollment on a duplicate (True) or only flag it (False).
+    :param keep_samples: Number of best samples stored for the user.
     :return: True if enrollment is successful, False otherwise.
     """
     print(f"Enrolling user {user_id}...")
 
-    # Connect to the database
-    conn = sqlite3.connect('fingerprint_enrollment.db')
-    cursor = conn.cursor()
+    # Check if user already exists
+    if repository.user_exists(user_id):
+        print(f"[ERROR] User ID {user_id} already exists.")
+        logging.error(f"User ID {user_id} already exists.")
+        return False
 
-    try:
-        # Start a transaction
-        conn.execute("BEGIN TRANSACTION")
-
-        # Check if user already exists
-        cursor.execute("SELECT id FROM users WHERE user_id = ?", (user_id,))
-        if cursor.fetchone():
-            print(f"[ERROR] User ID {user_id} already exists.")
-            logging.error(f"User ID {user_id} already exists.")
-            return False
-
-        # Insert user data
-        conn.execute("INSERT INTO users (user_id, name, nik) VALUES (?, ?, ?)", (user_id, name, nik))
-
-        # Capture and process fingerprints
-        for i in range(num_scans):
-            print(f"Capture fingerprint {i + 1}...")
-            image_data = capture_fingerprint(dev)
-            if not image_data:
-                print("[ERROR] Failed to capture fingerprint.")
-                logging.error("Failed to capture fingerprint.")
-                continue
-
-            # Validate image quality
-            if not validate_image_quality(image_data):
-                print("[ERROR] Image quality is poor. Skipping this scan.")
-                logging.error("Image quality is poor. Skipping this scan.")
-                continue
-
-            # Extract raw image data
-            raw_image_data = extract_raw_image(image_data)
-            if not raw_image_data:
-                print("[ERROR] Failed to extract raw image data.")
-                logging.error("Failed to extract raw image data.")
-                continue
-
-            # Compress the raw image
-            compressed_data = compress_raw(raw_image_data)
-            if compressed_data:
-                # Save compressed fingerprint to the database
-                conn.execute("INSERT INTO fingerprints (user_id, fingerprint) VALUES (?, ?)", (user_id, compressed_data))
-                print(f"Compressed image saved for user {user_id}, scan {i + 1}.")
-                logging.debug(f"Compressed image saved for user {user_id}, scan {i + 1}.")
-            else:
-                print(f"[ERROR] Failed to compress image for scan {i + 1}.")
-                logging.error(f"Failed to compress image for scan {i + 1}.")
+    # Captures can block for seconds each, so they are staged in memory
+    # and no database lock is held until the final commit
+    staged = StagedEnrollment(user_id, name, nik, DPFJ_FMD_ANSI_378_2004, get_sdk_version())
+
+    # Bring the warm gallery up to date with enrollments made by other processes
+    if engine is not None:
+        engine.sync()
+
+    # Capture and process fingerprints
+    for i in range(num_scans + MAX_EXTRA_SCANS):
+        # Past the planned scans, only capture while too few samples are good
+        if i >= num_scans:
+            if not staged.needs_more_samples(keep_samples):
+                break
+            print("[DEBUG] Too few good samples, capturing an extra scan.")
+        print(f"Capture fingerprint {i + 1}...")
+        image_data = capture_fingerprint(dev)
+        if not image_data:
+            print("[ERROR] Failed to capture fingerprint.")
+            logging.error("Failed to capture fingerprint.")
+            continue
 
-        # Commit the transaction
-        conn.commit()
-        print("Enrollment finished successfully.")
-        logging.debug("Enrollment finished successfully.")
-        return True
+        # Validate image quality; the assessment is reused for the sample score
+        assessment = validate_image_quality(image_data)
+        if not assessment:
+            print("[ERROR] Image quality is poor. Skipping this scan.")
+            logging.error("Image quality is poor. Skipping this scan.")
+            continue
+
+        # Extract raw image data
+        raw_image = extract_raw_image(image_data)
+        if not raw_image:
+            print("[ERROR] Failed to extract raw image data.")
+            logging.error("Failed to extract raw image data.")
+            continue
+
+        # Create FMD so identification does not have to re-extract it
+        fmd_data = create_fmd_from_raw(
+            raw_image["data"],
+            width=raw_image["width"],
+            height=raw_image["height"],
+            dpi=raw_image["dpi"],
+            finger_pos=DPFJ_POSITION_UNKNOWN,
+            cbeff_id=0,
+            fmd_type=DPFJ_FMD_ANSI_378_2004
+        )
+        if not fmd_data:
+            print("[ERROR] Failed to create FMD from raw image data.")
+            logging.error("Failed to create FMD from raw image data.")
+            continue
+
+        # Check the warm gallery for the same finger under another user ID
+        if engine is not None:
+            duplicate = engine.find_duplicate(fmd_data, user_id, threshold_score=DEFAULT_THRESHOLD_SCORE)
+            if duplicate:
+                print(f"[ERROR] Fingerprint already enrolled as user {duplicate.user_id} (score {duplicate.score}).")
+                logging.error(f"Duplicate enrollment: {user_id} matches {duplicate.user_id} (score {duplicate.score}).")
+                if reject_duplicates:
+                    return False
+
+        # Compress the raw image
+        compressed_data = compress_raw(raw_image["data"], raw_image["width"], raw_image["height"], raw_image["dpi"])
+        if compressed_data:
+            score = sample_score(raw_image["image"], fmd_data, assessment=assessment)
+            staged.add_sample(compressed_data, fmd_data, score, raw_image["finger_pos"],
+                              raw_image["width"], raw_image["height"])
+            print(f"Compressed image staged for user {user_id}, scan {i + 1} (score {score}).")
+            logging.debug(f"Compressed image staged for user {user_id}, scan {i + 1} (score {score}).")
+        else:
+            print(f"[ERROR] Failed to compress image for scan {i + 1}.")
+            logging.error(f"Failed to compress image for scan {i + 1}.")
+
+    if not len(staged):
+        print("[ERROR] No fingerprint could be enrolled.")
+        logging.error(f"No fingerprint could be enrolled for user {user_id}.")
+        return False
 
+    # Store only the best samples: a smaller gallery, and verification tries them first
+    dropped = staged.keep_best(keep_samples)
+    if dropped:
+        print(f"[DEBUG] Keeping the {len(staged)} best samples, {dropped} dropped.")
+
+    # Store the user and all samples in one short transaction
+    try:
+        enrolled_templates = repository.commit_enrollment(staged)
+    except sqlite3.IntegrityError:
+        print(f"[ERROR] User ID {user_id} already exists.")
+        logging.error(f"User ID {user_id} was enrolled concurrently.")
+        return False
     except sqlite3.Error as e:
-        # Rollback the transaction in case of error
-        conn.rollback()
         print(f"[ERROR] Database error: {e}")
         logging.error(f"Database error: {e}")
         return False
-
-    finally:
-        # Close the database connection
-        conn.close()
+    verification_cache.invalidate(user_id)
+
+    # Index the committed templates only, so the index never refers to rolled back rows
+    for template_id, fmd_data in enrolled_templates:
+        if index is not None:
+            index.add_template(template_id, user_id, fmd_data)
+        if engine is not None:
+            engine.add_template(template_id, user_id, fmd_data)
+    print("Enrollment finished successfully.")
+    logging.debug("Enrollment finished successfully.")
+    return True
 
 # Close the database connection when done
 # def close_database():
 #     conn.close()
                 
-def extract_raw_image(image_data, width=400, height=500):
+def extract_raw_image(image_data, image_fmt=DPFPDD_IMG_FMT_ISOIEC19794):
     """
     Extract raw image data from ISO/ANSI formatted data.
-    :param image_data: The image data with ISO/ANSI header (bytes).
-    :param width: Expected width of the image in pixels.
-    :param height: Expected height of the image in pixels.
-    :return: Raw image data (bytes) or None if failed.
-    """
-    expected_size = width * height
-    header_size = len(image_data) - expected_size
 
-    if header_size < 0:
-        print(f"[ERROR] Image data is too small. Expected at least {expected_size} bytes, got {len(image_data)} bytes.")
-        return None
-
-    raw_image_data = image_data[header_size:]
-    if len(raw_image_data) != expected_size:
-        print(f"[ERROR] Invalid raw image data size. Expected {expected_size} bytes, got {len(raw_image_data)} bytes.")
+    The geometry, resolution and pixel offset are read from the record headers,
+    and the pixels are returned as a view over image_data, not a copy.
+    :param image_data: The image data with ISO/ANSI header (bytes-like, e.g. the capture buffer).
+    :param image_fmt: The format the image was captured in (default: ISO 19794-4).
+    :return: A dictionary with "data" (memoryview of the pixels), "image" (NumPy view),
+             "width", "height", "dpi", "bpp" and "finger_pos", or None if failed.
+    """
+    raw_image = raw_image_from_fir(image_data, image_fmt)
+    if raw_image is None:
+        print(f"[ERROR] Invalid finger image record ({len(image_data)} bytes).")
         return None
 
-    print(f"[DEBUG] Raw image data size: {len(raw_image_data)} bytes")
-    return raw_image_data
+    print(f"[DEBUG] Raw image data: {raw_image['width']}x{raw_image['height']} at {raw_image['dpi']} dpi")
+    return raw_image
 
 def expand_raw(compressed_data):
     """
@@ -1077,32 +1263,17 @@ def expand_raw(compressed_data):
         return None
       
 def display_enrollment_data():
-    # Connect to the SQLite database
-    conn = sqlite3.connect('fingerprint_enrollment.db')
-    
-    # Query to select all data from the users table
-    cursor = conn.execute("SELECT user_id, name, nik FROM users")
-    
-    # Fetch all results
-    users = cursor.fetchall()
-    
     print("\nEnrolled Users:")
     print("User   ID | Name | NIK")
     print("-----------------------")
-    for user in users:
-        print(f"{user[0]} | {user[1]} | {user[2]}")
-        
-        # Query to get fingerprints for the current user
-        fingerprint_cursor = conn.execute("SELECT COUNT(*) FROM fingerprints WHERE user_id = ?", (user[0],))
-        fingerprint_count = fingerprint_cursor.fetchone()[0]
-        print(f"  Fingerprints enrolled: {fingerprint_count}")
-
-    # Close the database connection
-    conn.close()
+    # One query per page, users streamed with their fingerprint counts
+    for user in repository.iter_enrollments():
+        print(f"{user.user_id} | {user.name} | {user.nik}")
+        print(f"  Fingerprints enrolled: {user.fingerprints}")
 
 def delete_enrollment_table():
-    # Connect to the SQLite database
-    conn = sqlite3.connect('fingerprint_enrollment.db')
+    # Take the shared writer connection
+    conn = repository.acquire_writer()
     
     try:
         # Create a cursor object
@@ -1113,41 +1284,20 @@ def delete_enrollment_table():
         
         # Commit the changes
         conn.commit()
+        verification_cache.clear()
+        image_cache.clear()
         print("Enrollment table deleted successfully.")
         
     except sqlite3.Error as e:
         print(f"[ERROR] An error occurred: {e}")
         
     finally:
-        # Close the database connection
-        conn.close()
+        # Give the writer connection back
+        repository.release_writer()
 
 def create_database():
-    # Connect to the SQLite database
-    conn = sqlite3.connect('fingerprint_enrollment.db')
-    
-    # Create Users table
-    conn.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL UNIQUE,
-        name TEXT NOT NULL,
-        nik TEXT NOT NULL
-    )
-    ''')
-
-    # Create Fingerprints table
-    conn.execute('''
-    CREATE TABLE IF NOT EXISTS fingerprints (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        fingerprint BLOB NOT NULL,
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
-    )
-    ''')
-
-    conn.commit()
-    conn.close()
+    # Create the tables and indexes, upgrading tables created before templates were stored
+    repository.ensure_schema()
 
 def check_user_exists(user_id):
     # user_id = self.user_id_input.text()
@@ -1156,13 +1306,8 @@ def check_user_exists(user_id):
         print("Input Error", "Please enter a User ID.")
         return
 
-    # Koneksi ke database
-    conn = sqlite3.connect('fingerprint_enrollment.db')
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-        exists = cursor.fetchone()
+        exists = repository.user_exists(user_id)
 
         if exists:
             print("User Check", f"User ID {user_id} exists in the database.")
@@ -1171,8 +1316,6 @@ def check_user_exists(user_id):
 
     except sqlite3.Error as e:
         print("Database Error", f"An error occurred: {e}")
-    finally:
-        conn.close()
 
 # Main Program
 if __name__ == "__main__":
@@ -1212,7 +1355,32 @@ if __name__ == "__main__":
     # enroll_user(dev, user_id=user_id, name=user_name, nik=user_nik)
     # Display the enrollment data
     # identify_user(dev)
+
+    # Identification: 1:N search on worker processes sharing one copy of the gallery
+    with IdentificationWorkerPool(repository.db_path) as pool:
+        pool.load()
+        identify_user_1n(dev, pool)
+
+    # In-process alternative, required to reject duplicates during enrollment:
+    # from identification_engine import IdentificationEngine
+    # engine = IdentificationEngine('fingerprint_enrollment.db', shards=4)
+    # engine.load()
+    # identify_user_1n(dev, engine)
+    # To match only the closest 20% of the gallery by minutiae statistics:
+    # from prefilter_index import PrefilterIndex
+    # engine = IdentificationEngine('fingerprint_enrollment.db', prefilter=PrefilterIndex(keep_fraction=0.2))
+    # MCC index kept next to the database and updated by every enrollment:
+    # from mcc_index import MCCIndex, index_path_for
+    # mcc_index = MCCIndex(index_path_for('fingerprint_enrollment.db'))
+    # mcc_index.load()
+    # mcc_index.sync('fingerprint_enrollment.db')
+    # enroll_user(dev, user_id=user_id, name=user_name, nik=user_nik, index=mcc_index)
+    # Reject a finger already enrolled under another ID, using the loaded gallery:
+    # enroll_user(dev, user_id=user_id, name=user_name, nik=user_nik, engine=engine)
+    # candidates = mcc_index.search(fmd_data, max_candidates=100)
+    # engine.identify_templates(fmd_data, candidates, max_candidates=1, threshold_score=DEFAULT_THRESHOLD_SCORE)
     # display_enrollment_data()
+    # diagnose_stored_fingerprints(user_id)
     # delete_enrollment_table()
     # Close the database connection
     # close_database()
@@ -3,8 +3,10 @@ import ctypes
 from ctypes import c_int, c_uint, POINTER, Structure, c_void_p, c_char_p, c_ubyte, byref
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QLabel, QLineEdit, QPushButton, QTextEdit, QTabWidget, 
-                             QMessageBox, QStatusBar, QProgressBar)
+                             QMessageBox, QStatusBar, QProgressBar, QTableWidget, QTableWidgetItem,
+                             QAbstractItemView)
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
+from PyQt6.QtGui import QImage, QPixmap
 import sqlite3
 import logging
 from PIL import Image
@@ -12,6 +14,28 @@ import io
 import os
 import wsq
 import time
+from identification_engine import IdentificationEngine, create_fmd, get_sdk_version, load_dpfj_dll
+from match_scores import DEFAULT_THRESHOLD_SCORE, first_match
+from fir_parser import DPFPDD_IMG_FMT_ISOIEC19794, raw_image_from_fir
+from image_quality import assess_image, sample_score
+from template_cache import TemplateCache
+from image_cache import DecodedImageCache
+from wsq_codec import decode_wsq
+from enrollment_repository import get_repository, StagedEnrollment, KEEP_SAMPLES, MAX_EXTRA_SCANS
+
+# Templates, name and NIK of recently verified users, shared by the GUI threads
+verification_cache = TemplateCache()
+
+# Decoded images of recently used fingerprint rows (previews and template re-extraction)
+image_cache = DecodedImageCache()
+
+# Shared database access: one read connection per thread, one writer
+repository = get_repository('fingerprint_enrollment.db')
+
+# Users shown per page in the enrolled users tab
+USERS_PAGE_SIZE = 100
+# Height in pixels of the fingerprint previews in the enrolled users tab
+PREVIEW_HEIGHT = 150
 
 # Setup logging
 logging.basicConfig(
@@ -112,7 +136,7 @@ class FingerprintCaptureThread(QThread):
             # Setup capture parameters
             capture_param = DPFPDD_CAPTURE_PARAM()
             capture_param.size = ctypes.sizeof(DPFPDD_CAPTURE_PARAM)
-            capture_param.image_fmt = 0x01010007  # ISO format
+            capture_param.image_fmt = DPFPDD_IMG_FMT_ISOIEC19794  # ISO format
             capture_param.image_proc = 2  # Enhanced processing
             capture_param.image_res = 500  # 500 DPI
 
@@ -162,38 +186,42 @@ class EnrollmentThread(QThread):
     enrollment_complete = pyqtSignal(bool, str)
     scan_complete = pyqtSignal(int, bool)
 
-    def __init__(self, dev, user_id, name, nik, num_scans=4):
+    def __init__(self, dev, user_id, name, nik, num_scans=4, gallery=None, reject_duplicates=True,
+                 keep_samples=KEEP_SAMPLES):
         super().__init__()
         self.dev = dev
         self.user_id = user_id
         self.name = name
         self.nik = nik
         self.num_scans = num_scans
+        # Only the best scans are stored; extra scans are taken while too few are good
+        self.keep_samples = keep_samples
+        # Loaded IdentificationEngine used to catch a finger enrolled under another ID
+        self.gallery = gallery
+        self.reject_duplicates = reject_duplicates
 
     def run(self):
         print(f"Enrolling user {self.user_id}...")
         try:
-            conn = sqlite3.connect('fingerprint_enrollment.db')
-            cursor = conn.cursor()
-
-            # Start a transaction
-            conn.execute("BEGIN TRANSACTION")
-            
             # Check if user exists
-            cursor.execute("SELECT id FROM users WHERE user_id = ?", (self.user_id,))
-            if cursor.fetchone():
+            if repository.user_exists(self.user_id):
                 self.enrollment_complete.emit(False, f"User ID {self.user_id} already exists")
                 print(f"[ERROR] User ID {self.user_id} already exists.")
                 return False
 
-            # Insert user data
-            cursor.execute("INSERT INTO users (user_id, name, nik) VALUES (?, ?, ?)", 
-                          (self.user_id, self.name, self.nik))
-            
-            successful_scans = 0
-            for i in range(self.num_scans):
+            # Stage the scans in memory; the database is only locked for the final commit
+            staged = StagedEnrollment(self.user_id, self.name, self.nik, DPFJ_FMD_ANSI_378_2004, get_sdk_version())
+            # Bring the warm gallery up to date with enrollments made by other processes
+            if self.gallery is not None:
+                self.gallery.sync()
+            for i in range(self.num_scans + MAX_EXTRA_SCANS):
+                if i >= self.num_scans:
+                    if not staged.needs_more_samples(self.keep_samples):
+                        break
+                    self.update_progress.emit(i+1, f"Too few good scans, capturing extra fingerprint {i+1}")
+                else:
+                    self.update_progress.emit(i+1, f"Capturing fingerprint {i+1} of {self.num_scans}")
                 print(f"Capture fingerprint {i + 1}...")
-                self.update_progress.emit(i+1, f"Capturing fingerprint {i+1} of {self.num_scans}")
                 
                 # Capture fingerprint
                 image_data = self.capture_fingerprint()
@@ -202,8 +230,9 @@ class EnrollmentThread(QThread):
                     self.scan_complete.emit(i+1, False)
                     continue
 
-                # Validate image quality
-                if not self.validate_image_quality(image_data):
+                # Validate image quality; the assessment is reused for the sample score
+                assessment = self.validate_image_quality(image_data)
+                if not assessment:
                     print("[ERROR] Image quality is poor. Skipping this scan.")
                     continue
 
@@ -214,31 +243,57 @@ class EnrollmentThread(QThread):
                     print("[ERROR] Failed to extract raw image data.")
                     continue
 
+                # Create FMD so identification does not have to re-extract it
+                fmd_data = create_fmd(raw_image["data"], raw_image["width"], raw_image["height"], raw_image["dpi"])
+                if not fmd_data:
+                    self.scan_complete.emit(i+1, False)
+                    print("[ERROR] Failed to create FMD from raw image data.")
+                    continue
+
+                # Check the warm gallery for the same finger under another user ID
+                if self.gallery is not None:
+                    duplicate = self.gallery.find_duplicate(fmd_data, self.user_id, threshold_score=DEFAULT_THRESHOLD_SCORE)
+                    if duplicate:
+                        message = f"Fingerprint already enrolled as user {duplicate.user_id}"
+                        print(f"[ERROR] {message} (score {duplicate.score}).")
+                        logging.error(f"Duplicate enrollment: {self.user_id} matches {duplicate.user_id} (score {duplicate.score}).")
+                        if self.reject_duplicates:
+                            self.enrollment_complete.emit(False, message)
+                            return False
+                        self.update_progress.emit(i+1, f"Warning: {message}")
+
                 # Compress image
-                compressed_data = self.compress_raw(raw_image)
+                compressed_data = self.compress_raw(raw_image["data"], raw_image["width"], raw_image["height"])
                 if compressed_data:
-                    # Save compressed fingerprint to the database
-                    cursor.execute("INSERT INTO fingerprints (user_id, fingerprint) VALUES (?, ?)", 
-                              (self.user_id, compressed_data))
-                    print(f"Compressed image saved for user {self.user_id}, scan {i + 1}.")
+                    score = sample_score(raw_image["image"], fmd_data, assessment=assessment)
+                    staged.add_sample(compressed_data, fmd_data, score, raw_image["finger_pos"],
+                                      raw_image["width"], raw_image["height"])
+                    print(f"Compressed image staged for user {self.user_id}, scan {i + 1} (score {score}).")
                     self.scan_complete.emit(i+1, True)
                 else:
                     print(f"[ERROR] Failed to compress image for scan {i + 1}.")
                     self.scan_complete.emit(i+1, False)
-                successful_scans += 1
 
-            conn.commit()
-            
-            if successful_scans > 0:
-                self.enrollment_complete.emit(True, f"Enrolled {successful_scans} fingerprints")
-            else:
+            if not len(staged):
                 self.enrollment_complete.emit(False, "No successful scans")
-                
+                return False
+
+            # Store only the best samples: a smaller gallery, and verification tries them first
+            staged.keep_best(self.keep_samples)
+
+            # Store the user and all samples in one short transaction
+            enrolled_templates = repository.commit_enrollment(staged)
+            verification_cache.invalidate(self.user_id)
+            if self.gallery is not None:
+                for template_id, fmd_data in enrolled_templates:
+                    self.gallery.add_template(template_id, self.user_id, fmd_data)
+
+            self.enrollment_complete.emit(True, f"Enrolled {len(staged)} fingerprints")
+
+        except sqlite3.IntegrityError:
+            self.enrollment_complete.emit(False, f"User ID {self.user_id} already exists")
         except Exception as e:
-            conn.rollback()
             self.enrollment_complete.emit(False, f"Database error: {str(e)}")
-        finally:
-            conn.close()
     
     # Fungsi untuk memvalidasi kualitas gambar menggunakan OpenCV
     def validate_image_quality(self, image_data):
@@ -246,38 +301,47 @@ class EnrollmentThread(QThread):
         Validate the quality of the captured fingerprint image.
 
         :param image_data: The raw image data (bytes).
-        :return: True if image quality is good, False otherwise.
+        :return: The assess_image result if image quality is good (reused for the sample
+                 score), None otherwise.
         """
         # Example: Check if image size is within expected range
         if len(image_data) < 10000 or len(image_data) > 200046:
             print("[ERROR] Invalid image size. Expected size between 10000 and 50000 bytes.")
-            return False
+            return None
 
         # Example: Check if image contains enough detail (placeholder logic)
         # You can use image processing libraries like OpenCV for more advanced checks.
-        if not self.has_enough_detail(image_data):
+        assessment = self.has_enough_detail(image_data)
+        if not assessment:
             print("[ERROR] Image does not contain enough detail.")
-            return False
+            return None
 
         print("Image quality is good.")
-        return True
+        return assessment
     
     def has_enough_detail(self, image_data):
         """
-        Placeholder function to check if the image contains enough detail.
+        Check that the image contains enough ridge detail to be worth extracting.
 
-        :param image_data: The raw image data (bytes).
-        :return: True if the image contains enough detail, False otherwise.
+        :param image_data: The captured image record (bytes-like).
+        :return: The assess_image result if the image contains enough detail, None otherwise.
         """
-        # Implement your logic here (e.g., using OpenCV to analyze image quality).
-        return True  # Placeholder
+        assessment = assess_image(image_data)
+        if assessment is None:
+            return None
+        print(f"[DEBUG] Image quality score: {assessment['score']}, coverage: {assessment['coverage']:.0%}, "
+              f"condition: {assessment['condition']}")
+        if not assessment["usable"]:
+            print(f"[ERROR] Unusable capture: {', '.join(assessment['reasons'])}.")
+            return None
+        return assessment
 
     def capture_fingerprint(self):
         """Capture fingerprint using device"""
         try:
             capture_param = DPFPDD_CAPTURE_PARAM()
             capture_param.size = ctypes.sizeof(DPFPDD_CAPTURE_PARAM)
-            capture_param.image_fmt = 0x01010007
+            capture_param.image_fmt = DPFPDD_IMG_FMT_ISOIEC19794
             capture_param.image_proc = 2
             capture_param.image_res = 500
 
@@ -299,24 +363,20 @@ class EnrollmentThread(QThread):
                 self.dev, byref(capture_param), 5000,
                 byref(capture_result), byref(image_size), image_buffer
             )
-            return bytes(image_buffer) if result == 0 else None
+            # A view over the capture buffer: the pixels are parsed and extracted in place
+            return memoryview(image_buffer).cast("B")[:image_size.value] if result == 0 else None
             
         except Exception:
             return None
 
-    def extract_raw_image(self, image_data, width=400, height=500):
-        """Extract raw image data from captured data"""
-        expected_size = width * height
-        header_size = len(image_data) - expected_size
-        if header_size < 0:
-            print(f"[ERROR] Image data is too small. Expected at least {expected_size} bytes, got {len(image_data)} bytes.")
+    def extract_raw_image(self, image_data, image_fmt=DPFPDD_IMG_FMT_ISOIEC19794):
+        """Locate the pixels and geometry of the captured ISO/ANSI record, without copying"""
+        raw_image = raw_image_from_fir(image_data, image_fmt)
+        if raw_image is None:
+            print(f"[ERROR] Invalid finger image record ({len(image_data)} bytes).")
             return None
-        raw_image_data = image_data[header_size:]
-        if len(raw_image_data) != expected_size:
-            print(f"[ERROR] Invalid raw image data size. Expected {expected_size} bytes, got {len(raw_image_data)} bytes.")
-            return None
-        print(f"[DEBUG] Raw image data size: {len(raw_image_data)} bytes")
-        return raw_image_data
+        print(f"[DEBUG] Raw image data: {raw_image['width']}x{raw_image['height']} at {raw_image['dpi']} dpi")
+        return raw_image
 
     def compress_raw(self, image_data, width=400, height=500):
         """Compress raw image using WSQ"""
@@ -351,55 +411,25 @@ class IdentificationThread(QThread):
     def init_fingerprint_device(self):
         """Initialize the fingerprint device"""
         try:
-            global dpfj_dll
-            dpfj_dll = ctypes.WinDLL("dpfj.dll")
-            # Define dpfj_compare function
-            dpfj_dll.dpfj_compare.argtypes = [
-                DPFJ_FMD_FORMAT,          # fmd1_type
-                ctypes.POINTER(c_ubyte),  # fmd1
-                c_uint,                   # fmd1_size
-                c_uint,                   # fmd1_view_idx
-                DPFJ_FMD_FORMAT,          # fmd2_type
-                ctypes.POINTER(c_ubyte),  # fmd2
-                c_uint,                   # fmd2_size
-                c_uint,                   # fmd2_view_idx
-                ctypes.POINTER(c_uint)    # score
-            ]
-            dpfj_dll.dpfj_compare.restype = c_int
-            # Define dpfj_create_fmd_from_raw function
-            dpfj_dll.dpfj_create_fmd_from_raw.argtypes = [
-                ctypes.POINTER(ctypes.c_ubyte),  # image_data
-                ctypes.c_uint,                   # image_size
-                ctypes.c_uint,                   # image_width
-                ctypes.c_uint,                   # image_height
-                ctypes.c_uint,                   # image_dpi
-                DPFJ_FINGER_POSITION,            # finger_pos
-                ctypes.c_uint,                   # cbeff_id
-                DPFJ_FMD_FORMAT,                 # fmd_type
-                ctypes.POINTER(ctypes.c_ubyte),  # fmd
-                ctypes.POINTER(ctypes.c_uint)    # fmd_size
-            ]
-            dpfj_dll.dpfj_create_fmd_from_raw.restype = ctypes.c_int
-
+            load_dpfj_dll()
         except Exception as e:
             self.status_update.emit(f"dpfj error: {str(e)}")
             self.identification_complete.emit(False, f"dpfj initialization error: {str(e)}", "", "")
 
     def run(self):
         try:
-            conn = sqlite3.connect('fingerprint_enrollment.db')
-            cursor = conn.cursor()
-            
-            # Step 1: Check if user exists
-            cursor.execute("SELECT name, nik FROM users WHERE user_id = ?", (self.user_id,))
-            user_info = cursor.fetchone()
-            
-            if not user_info:
-                self.identification_complete.emit(False, "User ID not found", "", "")
-                conn.close()
-                return
-            
-            name, nik = user_info
+            # Step 1: Check if user exists, using the cached templates when possible
+            cached_user = verification_cache.get(self.user_id)
+            if cached_user is None:
+                user_info = repository.get_user(self.user_id)
+                if not user_info:
+                    self.identification_complete.emit(False, "User ID not found", "", "")
+                    return
+
+                enrolled_fmds = self.load_enrolled_fmds()
+                cached_user = verification_cache.put(self.user_id, user_info.name, user_info.nik, enrolled_fmds)
+
+            name, nik, enrolled_fmds = cached_user
             
             # Step 2: Capture fingerprint
             self.status_update.emit("Please place your finger on the scanner...")
@@ -408,71 +438,85 @@ class IdentificationThread(QThread):
             image_data = self.capture_fingerprint()
             if not image_data:
                 self.identification_complete.emit(False, "Failed to capture fingerprint", "", "")
-                conn.close()
                 return
                 
+            # Reject unusable captures before any SDK call
+            assessment = assess_image(image_data)
+            if assessment is None or not assessment["usable"]:
+                reasons = ", ".join(assessment["reasons"]) if assessment else "unreadable image"
+                self.identification_complete.emit(False, f"Poor fingerprint image ({reasons}), please scan again", "", "")
+                return
+
             self.status_update.emit("Processing captured fingerprint...")
             
             # Step 3: Extract raw image data
-            raw_image_data = self.extract_raw_image(image_data)
-            if not raw_image_data:
+            raw_image = self.extract_raw_image(image_data)
+            if not raw_image:
                 self.identification_complete.emit(False, "Failed to extract raw image", "", "")
-                conn.close()
                 return
 
             # Step 4: Create FMD from raw image
-            fmd_data = self.create_fmd_from_raw(raw_image_data)
+            fmd_data = create_fmd(raw_image["data"], raw_image["width"], raw_image["height"], raw_image["dpi"])
             if not fmd_data:
                 self.identification_complete.emit(False, "Failed to create FMD", "", "")
-                conn.close()
                 return
 
-            # Step 5: Load and compare with enrolled templates
-            cursor.execute("SELECT fingerprint FROM fingerprints WHERE user_id = ?", (self.user_id,))
-            match_found = False
-            
-            for row in cursor:
-                compressed_data = row[0]
-                
-                # Decompress the stored fingerprint
-                decompressed_data = self.decompress_wsq(compressed_data)
-                if not decompressed_data:
-                    self.status_update.emit("Failed to decompress stored fingerprint")
-                    continue
-                
-                # Create FMD from decompressed data
-                enrolled_fmd = self.create_fmd_from_raw(decompressed_data["data"])
-                if not enrolled_fmd:
-                    self.status_update.emit("Failed to create FMD from stored fingerprint")
-                    continue
-                
-                # Compare FMDs
-                score = self.compare_fmds(fmd_data, enrolled_fmd)
-                if score is not None and score < 100:  # Adjust threshold as needed
-                    match_found = True
-                    break
+            # Step 5: Compare with the enrolled templates, best sample first, until one matches
+            scores = ((self.compare_fmds(fmd_data, enrolled_fmd), i) for i, enrolled_fmd in enumerate(enrolled_fmds))
+            match = first_match(scores, threshold_score=DEFAULT_THRESHOLD_SCORE)
             
-            if match_found:
+            if match:
+                self.status_update.emit(f"Match score: {match[0]}")
                 self.identification_complete.emit(True, "Match found!", name, nik)
             else:
                 self.identification_complete.emit(False, "No matching fingerprint found", "", "")
                 
             self.status_update.emit(f"User found: {name}")
-            conn.close()
+            logging.debug(f"Verification cache: {verification_cache.stats()}")
                 
         except Exception as e:
             self.identification_complete.emit(False, f"Error: {str(e)}", "", "")
-            try:
-                conn.close()
-            except:
-                pass
+
+    def load_enrolled_fmds(self):
+        """Load the user's stored FMDs, extracting and saving any that are missing"""
+        enrolled_fmds = []
+        sdk_version = None
+        image_sizes = None
+        for row_id, _, fmd, fmd_type in repository.get_user_templates(self.user_id):
+            if fmd and fmd_type == DPFJ_FMD_ANSI_378_2004:
+                enrolled_fmds.append(bytes(fmd))
+                continue
+
+            # No stored template: fall back to decompress + extract, once
+            if image_sizes is None:
+                image_cache.sync(repository)
+                image_sizes = dict(repository.get_user_images(self.user_id))
+            decompressed_data = image_cache.decode(row_id, image_sizes.get(row_id),
+                                                   repository.get_fingerprint, self.decompress_wsq)
+            if not decompressed_data:
+                self.status_update.emit("Failed to decompress stored fingerprint")
+                continue
+
+            enrolled_fmd = create_fmd(decompressed_data["data"],
+                                      decompressed_data["width"],
+                                      decompressed_data["height"])
+            if not enrolled_fmd:
+                self.status_update.emit("Failed to create FMD from stored fingerprint")
+                continue
+
+            if sdk_version is None:
+                sdk_version = get_sdk_version()
+            repository.update_template(row_id, enrolled_fmd, DPFJ_FMD_ANSI_378_2004, sdk_version)
+            enrolled_fmds.append(enrolled_fmd)
+        logging.debug(f"Decoded image cache: {image_cache.stats()}")
+        return enrolled_fmds
 
     def capture_fingerprint(self):
         """Capture fingerprint using device"""
         try:
             capture_param = DPFPDD_CAPTURE_PARAM()
             capture_param.size = ctypes.sizeof(DPFPDD_CAPTURE_PARAM)
-            capture_param.image_fmt = 0x01010007  # ISO format
+            capture_param.image_fmt = DPFPDD_IMG_FMT_ISOIEC19794  # ISO format
             capture_param.image_proc = 2  # Enhanced processing
             capture_param.image_res = 500  # 500 DPI
 
@@ -501,7 +545,7 @@ class IdentificationThread(QThread):
             
             if result == 0:
                 self.status_update.emit("Fingerprint captured successfully.")
-                return bytes(image_buffer)       
+                return memoryview(image_buffer).cast("B")[:image_size.value]
             else:
                 self.status_update.emit(f"Capture failed: 0x{result:08X}")
                 return None
@@ -510,45 +554,12 @@ class IdentificationThread(QThread):
             self.status_update.emit(f"Capture exception: {str(e)}")
             return None
 
-    def extract_raw_image(self, image_data, width=400, height=500):
-        """Extract raw image data from captured data"""
-        expected_size = width * height
-        header_size = len(image_data) - expected_size
-        if header_size < 0:
-            self.status_update.emit(f"Image data too small. Expected {expected_size} bytes, got {len(image_data)}")
-            return None
-        return image_data[header_size:]
-
-    def create_fmd_from_raw(self, image_data, width=400, height=500, dpi=500, 
-                          finger_pos=0, cbeff_id=0, fmd_type=0x001B0001):
-        """Create FMD from raw image data"""
-        try:
-            image_data_array = (ctypes.c_ubyte * len(image_data)).from_buffer_copy(image_data)
-            fmd_size = c_uint(0)
-            
-            # First call to get size
-            result = dpfj_dll.dpfj_create_fmd_from_raw(
-                image_data_array, len(image_data), width, height, dpi,
-                finger_pos, cbeff_id, fmd_type, None, byref(fmd_size))
-            
-            if result != DPFJ_E_MORE_DATA:
-                self.status_update.emit(f"Failed to get FMD size. Error: 0x{result:08X}")
-                return None
-                
-            # Second call to create FMD
-            fmd = (ctypes.c_ubyte * fmd_size.value)()
-            result = dpfj_dll.dpfj_create_fmd_from_raw(
-                image_data_array, len(image_data), width, height, dpi,
-                finger_pos, cbeff_id, fmd_type, fmd, byref(fmd_size))
-                
-            if result == DPFJ_SUCCESS:
-                return bytes(fmd[:fmd_size.value])
-            else:
-                self.status_update.emit(f"Failed to create FMD. Error: 0x{result:08X}")
-                return None
-        except Exception as e:
-            self.status_update.emit(f"FMD creation exception: {str(e)}")
-            return None
+    def extract_raw_image(self, image_data, image_fmt=DPFPDD_IMG_FMT_ISOIEC19794):
+        """Locate the pixels and geometry of the captured ISO/ANSI record, without copying"""
+        raw_image = raw_image_from_fir(image_data, image_fmt)
+        if raw_image is None:
+            self.status_update.emit(f"Invalid finger image record ({len(image_data)} bytes)")
+        return raw_image
 
     def decompress_wsq(self, compressed_data):
         """Decompress WSQ image data"""
@@ -568,6 +579,7 @@ class IdentificationThread(QThread):
     def compare_fmds(self, fmd1, fmd2):
         """Compare two FMDs and return dissimilarity score"""
         try:
+            dpfj_dll = load_dpfj_dll()
             fmd1_array = (ctypes.c_ubyte * len(fmd1)).from_buffer_copy(fmd1)
             fmd2_array = (ctypes.c_ubyte * len(fmd2)).from_buffer_copy(fmd2)
             score = c_uint(0)
@@ -589,6 +601,8 @@ class FingerprintApp(QMainWindow):
         self.dev = None
         self.capture_thread = None
         self.enrollment_thread = None
+        # In-memory gallery kept warm for the duplicate check at enrollment
+        self.gallery = IdentificationEngine('fingerprint_enrollment.db')
         
         self.setWindowTitle("Fingerprint Enrollment System")
         self.setGeometry(100, 100, 800, 600)
@@ -607,12 +621,15 @@ class FingerprintApp(QMainWindow):
         # Create tabs
         self.enrollment_tab = QWidget()
         self.identification_tab = QWidget()
+        self.users_tab = QWidget()
         self.tabs.addTab(self.enrollment_tab, "Enrollment")
         self.tabs.addTab(self.identification_tab, "Identification")
+        self.tabs.addTab(self.users_tab, "Enrolled Users")
         
         # Setup tab UIs
         self.setup_enrollment_tab()
         self.setup_identification_tab()
+        self.setup_users_tab()
         
         # Status bar
         self.status_bar = QStatusBar()
@@ -692,6 +709,109 @@ class FingerprintApp(QMainWindow):
         
         self.identification_tab.setLayout(layout)
 
+    def setup_users_tab(self):
+        """Setup the enrolled users tab UI, listed one page at a time"""
+        layout = QVBoxLayout()
+        
+        self.users_table = QTableWidget(0, 4)
+        self.users_table.setHorizontalHeaderLabels(["User ID", "Name", "NIK", "Fingerprints"])
+        self.users_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.users_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.users_table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.users_table.itemSelectionChanged.connect(self.show_user_fingerprints)
+        layout.addWidget(self.users_table)
+        
+        # Stored fingerprints of the selected user
+        self.users_fingerprints_layout = QHBoxLayout()
+        self.users_fingerprints_layout.setAlignment(Qt.AlignmentFlag.AlignLeft)
+        layout.addLayout(self.users_fingerprints_layout)
+        
+        # Page navigation
+        nav_layout = QHBoxLayout()
+        self.users_prev_button = QPushButton("Previous")
+        self.users_prev_button.clicked.connect(lambda: self.show_users_page(-1))
+        nav_layout.addWidget(self.users_prev_button)
+        self.users_page_label = QLabel()
+        self.users_page_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        nav_layout.addWidget(self.users_page_label)
+        self.users_refresh_button = QPushButton("Refresh")
+        self.users_refresh_button.clicked.connect(lambda: self.show_users_page(0))
+        nav_layout.addWidget(self.users_refresh_button)
+        self.users_next_button = QPushButton("Next")
+        self.users_next_button.clicked.connect(lambda: self.show_users_page(1))
+        nav_layout.addWidget(self.users_next_button)
+        layout.addLayout(nav_layout)
+        
+        # Keyset cursor (last user ID of the previous page) of every page opened so far
+        self.users_page_starts = [None]
+        self.users_page_last = None
+        
+        self.users_tab.setLayout(layout)
+
+    def show_users_page(self, step):
+        """Show the previous (-1), current (0) or next (1) page of enrolled users"""
+        if step > 0 and self.users_page_last is not None:
+            self.users_page_starts.append(self.users_page_last)
+        elif step < 0 and len(self.users_page_starts) > 1:
+            self.users_page_starts.pop()
+        
+        try:
+            # One extra row tells whether a next page exists
+            users = repository.list_enrollments(self.users_page_starts[-1], USERS_PAGE_SIZE + 1)
+        except sqlite3.Error as e:
+            self.status_bar.showMessage(f"Failed to list users: {str(e)}")
+            logging.error(f"Failed to list users: {e}")
+            return
+        has_next = len(users) > USERS_PAGE_SIZE
+        users = users[:USERS_PAGE_SIZE]
+        
+        self.users_table.setRowCount(len(users))
+        for row, user in enumerate(users):
+            for column, value in enumerate(user):
+                self.users_table.setItem(row, column, QTableWidgetItem(str(value)))
+        
+        self.users_page_last = users[-1].user_id if users else None
+        self.users_page_label.setText(f"Page {len(self.users_page_starts)}")
+        self.users_prev_button.setEnabled(len(self.users_page_starts) > 1)
+        self.users_next_button.setEnabled(has_next)
+
+    def show_user_fingerprints(self):
+        """Show previews of the stored fingerprints of the selected user"""
+        while self.users_fingerprints_layout.count():
+            self.users_fingerprints_layout.takeAt(0).widget().deleteLater()
+        
+        rows = self.users_table.selectionModel().selectedRows()
+        if not rows:
+            return
+        user_id = self.users_table.item(rows[0].row(), 0).text()
+        
+        try:
+            # Drop cached images whose rows were rewritten since the last lookup
+            image_cache.sync(repository)
+            stored_images = repository.get_user_images(user_id)
+            for stored in stored_images:
+                # Going back to a user shows the decoded images from the cache
+                decompressed_data = image_cache.decode(stored.id, stored.size,
+                                                       repository.get_fingerprint, decode_wsq)
+                if not decompressed_data:
+                    continue
+                width = decompressed_data["width"]
+                height = decompressed_data["height"]
+                image = QImage(bytes(decompressed_data["data"]), width, height, width,
+                               QImage.Format.Format_Grayscale8).copy()
+                preview = QLabel()
+                preview.setPixmap(QPixmap.fromImage(image).scaledToHeight(
+                    PREVIEW_HEIGHT, Qt.TransformationMode.SmoothTransformation))
+                preview.setToolTip(f"Fingerprint {stored.id} ({width}x{height})")
+                self.users_fingerprints_layout.addWidget(preview)
+        except sqlite3.Error as e:
+            self.status_bar.showMessage(f"Failed to load fingerprints: {str(e)}")
+            logging.error(f"Failed to load fingerprints of user {user_id}: {e}")
+            return
+        
+        self.status_bar.showMessage(f"User {user_id}: {len(stored_images)} fingerprint(s), "
+                                    f"image cache hit rate {image_cache.hit_rate():.0%}")
+
     def init_fingerprint_device(self):
         """Initialize the fingerprint device"""
         try:
@@ -749,24 +869,9 @@ class FingerprintApp(QMainWindow):
     def create_database(self):
         """Create the SQLite database if it doesn't exist"""
         try:
-            conn = sqlite3.connect('fingerprint_enrollment.db')
-            conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL UNIQUE,
-                name TEXT NOT NULL,
-                nik TEXT NOT NULL
-            )
-            ''')
-            conn.execute('''
-            CREATE TABLE IF NOT EXISTS fingerprints (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                fingerprint BLOB NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-            ''')
-            conn.close()
+            repository.ensure_schema()
+            self.gallery.load()
+            self.show_users_page(0)
         except Exception as e:
             QMessageBox.critical(self, "Database Error", f"Failed to create database: {str(e)}")
 
@@ -792,7 +897,7 @@ class FingerprintApp(QMainWindow):
         self.enroll_log.append("Starting enrollment process...")
         
         # Start enrollment thread
-        self.enrollment_thread = EnrollmentThread(self.dev, user_id, name, nik)
+        self.enrollment_thread = EnrollmentThread(self.dev, user_id, name, nik, gallery=self.gallery)
         self.enrollment_thread.update_progress.connect(self.update_enrollment_progress)
         self.enrollment_thread.scan_complete.connect(self.handle_scan_complete)
         self.enrollment_thread.enrollment_complete.connect(self.handle_enrollment_complete)
@@ -821,6 +926,7 @@ class FingerprintApp(QMainWindow):
         # Show result
         if success:
             self.enroll_log.append("Enrollment completed successfully!")
+            self.show_users_page(0)
             QMessageBox.information(self, "Success", message)
         else:
             self.enroll_log.append("Enrollment failed!")
@@ -896,8 +1002,8 @@ class FingerprintApp(QMainWindow):
         """Process the captured fingerprint for identification"""
         self.update_identify_finger_status()
         try:
-            conn = sqlite3.connect('fingerprint_enrollment.db')
-            cursor = conn.cursor()
+            # The shared reader connection stays open for the other queries
+            cursor = repository.reader().cursor()
             
             # Get user info
             cursor.execute("SELECT name, nik FROM users WHERE user_id = ?", (user_id,))
@@ -909,7 +1015,7 @@ class FingerprintApp(QMainWindow):
                     continue
 
                 # Create FMD from decompressed raw image data
-                enrolled_fmd = self.create_fmd_from_raw(
+                enrolled_fmd = create_fmd(
                     decompressed_data["data"],
                     width=400,
                     height=500,
@@ -926,7 +1032,6 @@ class FingerprintApp(QMainWindow):
                 score = self.compare_fmds(fmd_data, enrolled_fmd)
                 if score is not None and score < 100:  # Adjust threshold as needed
                     print(f"Match found! User: {name}, NIK: {nik}")
-                    conn.close()
                     return name, nik  # Return user's name and NIK
 
             user_info = cursor.fetchone()
@@ -956,7 +1061,7 @@ class FingerprintApp(QMainWindow):
                 return None
 
             # Step 5: Create FMD from raw image data
-            fmd_data = self.create_fmd_from_raw(
+            fmd_data = create_fmd(
                 raw_image_data,
                 width=400,
                 height=500,
@@ -967,7 +1072,6 @@ class FingerprintApp(QMainWindow):
             )
             if not fmd_data:
                 print("[ERROR] Failed to create FMD from raw image data.")
-                conn.close()
                 return None
             
             # Step 6: Load enrolled FMDs for the user
@@ -986,8 +1090,6 @@ class FingerprintApp(QMainWindow):
             
         except Exception as e:
             self.identify_result.append(f"Error: {str(e)}")
-        finally:
-            conn.close()
 
     def handle_capture_error(self, error_msg):
         """Handle fingerprint capture errors"""
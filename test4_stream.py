@@ -2,6 +2,7 @@ import ctypes
 from ctypes import c_int, c_uint, POINTER, Structure, c_void_p, c_char_p, cast, c_ubyte
 from PIL import Image
 import numpy as np
+from fir_parser import raw_image_from_fir
 
 # Load the DPFPDD DLL
 dll = ctypes.WinDLL("dpfpdd.dll")
@@ -377,19 +378,25 @@ def save_fingerprint_png(image_data, width, height, bpp, filename="fingerprint.p
         filename (str): Output filename.
     """
     bytes_per_pixel = bpp // 8  # Convert bits-per-pixel to bytes-per-pixel
+
+    # ISO/ANSI record: take the pixels and geometry from its headers
+    if bytes(image_data[:4]) == b"FIR\0":
+        raw_image = raw_image_from_fir(image_data)
+        if raw_image is None:
+            print("[ERROR] Invalid finger image record.")
+            return
+        image_data, width, height, bytes_per_pixel = raw_image["data"], raw_image["width"], raw_image["height"], 1
     expected_size = width * height * bytes_per_pixel
 
-    # Remove header (first 46 bytes)
-    header_size = 46
-    if len(image_data) < header_size + expected_size:
-        print(f"[ERROR] Image data size {len(image_data)} is smaller than expected {header_size + expected_size}")
+    if len(image_data) < expected_size:
+        print(f"[ERROR] Image data size {len(image_data)} is smaller than expected {expected_size}")
         return
     
-    # Remove header and take only the required size
-    image_data = image_data[header_size:header_size + expected_size]
+    # Take only the required size
+    image_data = image_data[:expected_size]
     
     # Debug: Print data after removing header
-    print(f"[DEBUG] First 10 bytes after removing header: {image_data[:10]}")
+    print(f"[DEBUG] First 10 bytes after removing header: {bytes(image_data[:10])}")
     
     # Convert to numpy array
     image_array = np.frombuffer(image_data, dtype=np.uint8)
@@ -471,7 +478,7 @@ def get_stream_image(dev, image_format=DPFPDD_IMG_FMT_ISOIEC19794, image_proc=DP
         image_res (int): Image resolution (default: 500 DPI).
     
     Returns:
-        bytes: Raw image data (without header), or None if failed.
+        memoryview: Raw image data (without header) over the capture buffer, or None if failed.
     """
     if not dev:
         print("Invalid device handle. Cannot get stream image.")
@@ -511,16 +518,19 @@ def get_stream_image(dev, image_format=DPFPDD_IMG_FMT_ISOIEC19794, image_proc=DP
         print(f"[DEBUG] Image Info - Width: {capture_result.info.width}, Height: {capture_result.info.height}, Resolution: {capture_result.info.res}, BPP: {capture_result.info.bpp}")
         print(f"[DEBUG] First 100 bytes of raw data: {bytes(image_buffer[:100])}")
         
-        # Remove header (first 46 bytes)
-        header_size = 46
-        if image_size.value < header_size:
-            print(f"[ERROR] Image data size {image_size.value} is smaller than header size {header_size}")
+        image_data = memoryview(image_buffer).cast("B")[:image_size.value]
+        if image_format == DPFPDD_IMG_FMT_PIXEL_BUFFER:
+            return image_data
+
+        # Skip the record headers, whose size depends on the format and view count
+        raw_image = raw_image_from_fir(image_data, image_format)
+        if raw_image is None:
+            print(f"[ERROR] Invalid finger image record ({image_size.value} bytes)")
             return None
+        print(f"[DEBUG] Image data size after removing header: {len(raw_image['data'])} bytes "
+              f"({raw_image['width']}x{raw_image['height']})")
         
-        image_data = bytes(image_buffer[header_size:])
-        print(f"[DEBUG] Image data size after removing header: {len(image_data)} bytes")
-        
-        return image_data
+        return raw_image["data"]
     else:
         print(f"[ERROR] Failed to get stream image. Code: 0x{result:08X}")
         return None
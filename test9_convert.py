@@ -1,6 +1,7 @@
 import ctypes
 from ctypes import c_int, c_uint, POINTER, Structure, c_void_p, c_char_p, c_ubyte, byref
 import os
+from match_scores import DEFAULT_THRESHOLD_SCORE, top_k
 
 # Load the DPFPDD and DPFJ DLLs
 dpfpdd_dll = ctypes.WinDLL("dpfpdd.dll")
@@ -491,13 +492,14 @@ def identify_user(dev, database_dir):
                 enrolled_fmds.append(f.read())
                 user_ids.append(filename.split("_")[1].split(".")[0])  # Extract user ID from filename
 
-    # Compare the extracted FMD with enrolled templates
-    for i, enrolled_fmd in enumerate(enrolled_fmds):
-        score = compare_fmds(fmd_data, enrolled_fmd)
-        if score is not None and score < 100:  # Adjust threshold as needed
-            user_id = user_ids[i]
-            print(f"Match found! User ID: {user_id}, Score: {score}")
-            return user_id
+    # Compare the extracted FMD with every enrolled template and keep the best one
+    scores = ((compare_fmds(fmd_data, enrolled_fmd), i) for i, enrolled_fmd in enumerate(enrolled_fmds))
+    best = top_k(scores, 1, threshold_score=DEFAULT_THRESHOLD_SCORE)
+    if best:
+        score, i = best[0]
+        user_id = user_ids[i]
+        print(f"Match found! User ID: {user_id}, Score: {score}")
+        return user_id
 
     print("No match found.")
     return None
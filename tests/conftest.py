@@ -0,0 +1,110 @@
+import ctypes
+import os
+import random
+import struct
+import sys
+
+import pytest
+
+# The modules live at the repository root, next to the scripts that use them
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import identification_engine
+from db_schema import open_database
+
+def make_fmd(minutiae, iso=False, width=400, height=500, quality=60):
+    """
+    Build a one-view ANSI 378-2004 or ISO 19794-2-2005 FMD.
+
+    :param minutiae: A list of (type, x, y, angle, quality) tuples, angle in record units.
+    :param iso: Build an ISO record instead of an ANSI one.
+    :param width: The image width in the record header.
+    :param height: The image height in the record header.
+    :param quality: The view quality.
+    :return: The FMD (bytes).
+    """
+    body = b"".join(struct.pack(">HHBB", (kind << 14) | x, y, angle, minutia_quality)
+                    for kind, x, y, angle, minutia_quality in minutiae)
+    view = bytes([1, 0, quality, len(minutiae)]) + body + b"\0\0"
+    if iso:
+        header = struct.pack(">HHHHHBB", 0, width, height, 197, 197, 1, 0)
+        return b"FMR\0 20\0" + struct.pack(">I", 12 + len(header) + len(view)) + header + view
+    header = struct.pack(">IHHHHHBB", 0, 0, width, height, 197, 197, 1, 0)
+    return b"FMR\0 20\0" + struct.pack(">H", 10 + len(header) + len(view)) + header + view
+
+def random_fmd(rnd):
+    # Few distinct minutiae, so many templates tie on score
+    return make_fmd([(1, rnd.randrange(2), rnd.randrange(2), rnd.randrange(2), 50) for _ in range(6)])
+
+def fill_gallery(db_path, users, scans_per_user=2, seed=1):
+    """
+    Enroll users with random_fmd templates in a new database.
+
+    :param db_path: Path to the SQLite database (created with the current schema).
+    :param users: Number of users, named u0, u1, ...
+    :param scans_per_user: Fingerprints per user.
+    :param seed: Seed of the templates.
+    """
+    rnd = random.Random(seed)
+    conn = open_database(db_path)
+    try:
+        for user in range(users):
+            conn.execute("INSERT INTO users (user_id, name, nik) VALUES (?, ?, ?)", (f"u{user}", f"n{user}", f"k{user}"))
+            for _ in range(scans_per_user):
+                conn.execute("INSERT INTO fingerprints (user_id, fmd, fmd_type, fingerprint) VALUES (?, ?, ?, ?)",
+                             (f"u{user}", random_fmd(rnd), identification_engine.DPFJ_FMD_ANSI_378_2004, b"wsq"))
+        conn.commit()
+    finally:
+        conn.close()
+
+def fake_score(fmd1, fmd2):
+    # Dissimilarity of two byte strings: 10 per differing byte
+    return 10 * (sum(a != b for a, b in zip(fmd1, fmd2)) + abs(len(fmd1) - len(fmd2)))
+
+def fake_fmd(image_data, width, height):
+    # A template that follows the image: six minutiae taken from its first pixels
+    pixels = bytes(image_data[:18])
+    return make_fmd([(1, pixels[i], pixels[i + 1], pixels[i + 2] % 180, 50) for i in range(0, 18, 3)],
+                    width=width, height=height, quality=70)
+
+class FakeDpfj:
+    """Stand-in for dpfj.dll: dpfj_identify and dpfj_compare over fake_score, extraction with fake_fmd."""
+
+    version = (3, 4, 1)
+
+    def dpfj_identify(self, fmd1_type, fmd1, fmd1_size, fmd1_view_idx, fmds_type, fmds_cnt, fmds, fmds_size,
+                      threshold_score, candidate_cnt, candidates):
+        probe = ctypes.string_at(fmd1, fmd1_size)
+        scored = sorted((fake_score(probe, ctypes.string_at(fmds[i], fmds_size[i])), i) for i in range(fmds_cnt))
+        matches = [i for score, i in scored if score < threshold_score][:candidate_cnt._obj.value]
+        for n, i in enumerate(matches):
+            candidates[n].fmd_idx = i
+            candidates[n].view_idx = 0
+        candidate_cnt._obj.value = len(matches)
+        return identification_engine.DPFJ_SUCCESS
+
+    def dpfj_compare(self, fmd1_type, fmd1, fmd1_size, fmd1_view_idx, fmd2_type, fmd2, fmd2_size, fmd2_view_idx,
+                     score):
+        score._obj.value = fake_score(ctypes.string_at(fmd1, fmd1_size), ctypes.string_at(fmd2, fmd2_size))
+        return identification_engine.DPFJ_SUCCESS
+
+    def dpfj_create_fmd_from_raw(self, image_data, image_size, width, height, dpi, finger_pos, cbeff_id, fmd_type,
+                                 fmd, fmd_size):
+        created = fake_fmd(bytes(image_data), width, height)
+        if fmd is None:
+            fmd_size._obj.value = len(created)
+            return identification_engine.DPFJ_E_MORE_DATA
+        ctypes.memmove(fmd, created, len(created))
+        fmd_size._obj.value = len(created)
+        return identification_engine.DPFJ_SUCCESS
+
+    def dpfj_version(self, version):
+        version._obj.lib_ver.major, version._obj.lib_ver.minor, version._obj.lib_ver.maintanance = self.version
+        return identification_engine.DPFJ_SUCCESS
+
+@pytest.fixture
+def fake_dpfj(monkeypatch):
+    dll = FakeDpfj()
+    monkeypatch.setattr(identification_engine, "dpfj_dll", dll)
+    return dll
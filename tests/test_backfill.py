@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from backfill import process_row, run_backfill
+from conftest import fake_fmd, make_fmd
+from db_schema import open_database
+from identification_engine import DPFJ_FMD_ANSI_378_2004
+from wsq_codec import decode_wsq, encode_wsq
+
+def _image(seed):
+    return np.random.default_rng(seed).integers(0, 256, (500, 400), dtype=np.uint8).tobytes()
+
+@pytest.fixture
+def backfill_db(tmp_path):
+    db_path = str(tmp_path / "backfill.db")
+    conn = open_database(db_path)
+    rows = [
+        # Images without a template, as the older scripts stored them
+        ("u1", encode_wsq(_image(1), 400, 500), None),
+        ("u1", encode_wsq(_image(2), 400, 500), None),
+        ("u2", encode_wsq(_image(3), 400, 500), None),
+        # A template missing only its sample metadata
+        ("u2", b"wsq", make_fmd([(1, 10, 20, 30, 50)], width=320, height=480, quality=55)),
+        # An image that cannot be decoded
+        ("u3", b"not a wsq stream", None),
+    ]
+    for user_id, fingerprint, fmd in rows:
+        conn.execute("INSERT INTO fingerprints (user_id, fingerprint, fmd, fmd_type) VALUES (?, ?, ?, ?)",
+                     (user_id, fingerprint, fmd, DPFJ_FMD_ANSI_378_2004 if fmd else None))
+    conn.commit()
+    conn.close()
+    return db_path
+
+def _stored(db_path):
+    conn = open_database(db_path)
+    try:
+        return conn.execute(
+            "SELECT id, fmd, fmd_type, sdk_version, quality, finger_pos, width, height FROM fingerprints ORDER BY id"
+        ).fetchall()
+    finally:
+        conn.close()
+
+def test_process_row_reads_the_metadata_of_a_stored_template():
+    fmd = make_fmd([(1, 10, 20, 30, 50)], width=320, height=480, quality=55)
+    assert process_row(7, None, fmd) == (7, fmd, 55, 1, 320, 480, False)
+
+def test_process_row_extracts_from_the_image(fake_dpfj):
+    compressed = encode_wsq(_image(1), 400, 500)
+    row_id, fmd, quality, finger_pos, width, height, extracted = process_row(7, compressed, None)
+    assert fmd == fake_fmd(decode_wsq(compressed)["data"], 400, 500)
+    assert (row_id, quality, width, height, extracted) == (7, 70, 400, 500, True)
+    assert process_row(8, b"not a wsq stream", None) == (8, None, None, None, None, None, False)
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_backfill_fills_every_row(fake_dpfj, backfill_db, workers):
+    report = run_backfill(backfill_db, workers=workers, batch_size=2)
+    assert (report["processed"], report["extracted"], report["failed"]) == (5, 3, 1)
+    rows = _stored(backfill_db)
+    for row_id, fmd, fmd_type, sdk_version, quality, finger_pos, width, height in rows[:3]:
+        assert fmd == fake_fmd(decode_wsq(encode_wsq(_image(row_id), 400, 500))["data"], 400, 500)
+        assert (fmd_type, sdk_version, quality, finger_pos, width, height) == \
+            (DPFJ_FMD_ANSI_378_2004, "3.4.1", 70, 1, 400, 500)
+    # A stored template keeps its (unknown) SDK version and gets its header metadata
+    assert rows[3][3:] == (None, 55, 1, 320, 480)
+    assert rows[4][1:] == (None,) * 7
+
+def test_backfill_resumes_after_its_checkpoint(fake_dpfj, backfill_db):
+    run_backfill(backfill_db, workers=0)
+    conn = open_database(backfill_db)
+    conn.execute("INSERT INTO fingerprints (user_id, fingerprint) VALUES ('u4', ?)", (encode_wsq(_image(6), 400, 500),))
+    conn.commit()
+    conn.close()
+
+    # Only the row added after the checkpoint is read; the failed row is not retried
+    assert run_backfill(backfill_db, workers=0)["processed"] == 1
+    assert run_backfill(backfill_db, workers=0)["processed"] == 0
+    # Starting over reads the rows still pending, which is only the failed one
+    assert run_backfill(backfill_db, workers=0, restart=True)["processed"] == 1
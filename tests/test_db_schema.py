@@ -0,0 +1,82 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from conftest import REPO_ROOT
+from db_schema import FINGERPRINTS_COLUMNS, MIGRATIONS, SCHEMA_VERSION, migrate, open_database, schema_version
+
+ENROLLMENT_DB = os.path.join(REPO_ROOT, "fingerprint_enrollment.db")
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    # Migrate a copy: the shipped database stays at its original version
+    db_path = str(tmp_path / "enrollment.db")
+    shutil.copyfile(ENROLLMENT_DB, db_path)
+    return db_path
+
+def _columns(conn):
+    return tuple(row[1] for row in conn.execute("PRAGMA table_info(fingerprints)"))
+
+def _rows(conn):
+    return conn.execute("SELECT id, user_id, fingerprint FROM fingerprints ORDER BY id").fetchall()
+
+def _names(conn, kind):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = ?", (kind,))}
+
+def test_shipped_database_is_unversioned():
+    conn = sqlite3.connect(f"file:{ENROLLMENT_DB}?mode=ro", uri=True)
+    try:
+        assert schema_version(conn) == 0
+        assert _columns(conn) == ("id", "user_id", "fingerprint")
+    finally:
+        conn.close()
+
+def test_migrate_legacy_database(legacy_db):
+    conn = sqlite3.connect(legacy_db)
+    before = _rows(conn)
+    assert migrate(conn) == SCHEMA_VERSION == 5
+    assert schema_version(conn) == SCHEMA_VERSION
+    assert _columns(conn) == FINGERPRINTS_COLUMNS
+    assert _rows(conn) == before
+    assert "idx_fingerprints_user_id" in _names(conn, "index")
+    assert {"fingerprints_log_insert", "fingerprints_log_delete", "fingerprints_log_update"} <= _names(conn, "trigger")
+    assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    conn.close()
+
+def test_migrate_step_by_step(legacy_db):
+    conn = sqlite3.connect(legacy_db)
+    for version, _, step in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        step(conn)
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        assert schema_version(conn) == version
+    # Nothing is left to apply
+    assert migrate(conn) == SCHEMA_VERSION
+    assert _columns(conn) == FINGERPRINTS_COLUMNS
+    conn.close()
+
+def test_migrate_resumes_from_intermediate_version(legacy_db):
+    conn = sqlite3.connect(legacy_db)
+    conn.execute("BEGIN IMMEDIATE")
+    for _, _, step in MIGRATIONS[:2]:
+        step(conn)
+    conn.execute("PRAGMA user_version = 2")
+    conn.commit()
+    assert migrate(conn) == SCHEMA_VERSION
+    assert _columns(conn) == FINGERPRINTS_COLUMNS
+    conn.close()
+
+def test_rebuild_keeps_ids_and_change_feed(legacy_db):
+    conn = open_database(legacy_db)
+    last_id = conn.execute("SELECT MAX(id) FROM fingerprints").fetchone()[0]
+    conn.execute("DELETE FROM fingerprints WHERE id = ?", (last_id,))
+    cursor = conn.execute("INSERT INTO fingerprints (user_id, fingerprint) VALUES ('u', x'00')")
+    conn.commit()
+    # A deleted id is never handed out again, and both changes reach the feed
+    assert cursor.lastrowid == last_id + 1
+    operations = conn.execute("SELECT fingerprint_id, operation FROM fingerprint_changes ORDER BY seq").fetchall()
+    assert operations == [(last_id, "delete"), (last_id + 1, "insert")]
+    conn.close()
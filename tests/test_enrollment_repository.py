@@ -0,0 +1,139 @@
+import sqlite3
+
+import pytest
+
+from conftest import make_fmd
+from enrollment_repository import EnrollmentRepository, StagedEnrollment
+
+@pytest.fixture
+def repository(tmp_path):
+    repository = EnrollmentRepository(str(tmp_path / "enrollment.db"))
+    yield repository
+    repository.close()
+
+def _insert(repository, user_id, fmd, fmd_type=1):
+    with repository.transaction() as conn:
+        return conn.execute("INSERT INTO fingerprints (user_id, fmd, fmd_type, fingerprint) VALUES (?, ?, ?, ?)",
+                            (user_id, fmd, fmd_type, b"wsq")).lastrowid
+
+def test_changes_since_reports_the_current_state_once_per_fingerprint(repository):
+    first = _insert(repository, "u1", b"a")
+    second = _insert(repository, "u1", b"b")
+    other_format = _insert(repository, "u2", b"c", fmd_type=2)
+    watermark = repository.change_watermark()
+    assert watermark == 3
+
+    repository.update_template(first, b"a2", 1, "1.0")
+    with repository.transaction() as conn:
+        conn.execute("DELETE FROM fingerprints WHERE id = ?", (second,))
+    # Columns the gallery does not use are not logged
+    with repository.transaction() as conn:
+        conn.execute("UPDATE fingerprints SET quality = 50 WHERE id = ?", (first,))
+
+    changes = repository.changes_since(0, 1)
+    assert [(c.fingerprint_id, c.operation, c.user_id, c.fmd) for c in changes] == [
+        (other_format, "insert", None, None),
+        (first, "update", "u1", b"a2"),
+        (second, "delete", None, None),
+    ]
+    assert [c.fingerprint_id for c in repository.changes_since(watermark, 1)] == [first, second]
+    assert repository.changes_since(repository.change_watermark(), 1) == []
+
+def test_trim_changes_keeps_the_retention_margin(repository):
+    for i in range(10):
+        _insert(repository, "u1", bytes([i]))
+    assert repository.trim_changes(10, retention=5) == 0
+    assert repository.first_change_seq() == 1
+
+    assert repository.trim_changes(10, retention=4) == 6
+    assert repository.first_change_seq() == 7
+    assert len(repository.changes_since(6, 1)) == 4
+
+def test_prune_keeps_the_latest_entry(repository):
+    _insert(repository, "u1", b"a")
+    _insert(repository, "u1", b"b")
+    assert repository.prune_changes(100) == 1
+    assert repository.first_change_seq() == 2
+
+def test_image_rewrites_reach_the_change_feed(repository):
+    first = _insert(repository, "u1", b"a")
+    second = _insert(repository, "u1", b"b")
+    watermark = repository.change_watermark()
+    assert repository.changed_fingerprint_ids(watermark) == (watermark, set())
+
+    # Same size, new content: logged even though the template did not change
+    with repository.transaction() as conn:
+        conn.execute("UPDATE fingerprints SET fingerprint = ? WHERE id = ?", (b"WSQ", first))
+        conn.execute("UPDATE fingerprints SET fingerprint = fingerprint WHERE id = ?", (second,))
+    assert repository.changed_fingerprint_ids(watermark) == (watermark + 1, {first})
+    assert repository.changed_fingerprint_ids(0) == (watermark + 1, {first, second})
+
+def _staged(user_id, scores, fmd_type=1):
+    staged = StagedEnrollment(user_id, "Name", "NIK", fmd_type, "3.4.1")
+    for scan, score in enumerate(scores):
+        staged.add_sample(f"wsq{scan}".encode(), bytes([scan]), score=score, finger_pos=2, width=400, height=500)
+    return staged
+
+def test_staged_sample_quality_falls_back_to_the_fmd_header():
+    staged = StagedEnrollment("u1", "Name", "NIK", 1, "3.4.1")
+    staged.add_sample(b"wsq", make_fmd([(1, 10, 10, 0, 50)], quality=42))
+    staged.add_sample(b"wsq", b"not an fmd")
+    assert [sample.quality for sample in staged.samples] == [42, None]
+
+def test_staged_enrollment_keeps_the_best_samples():
+    staged = _staged("u1", [70, None, 40, 90, 70, 65])
+    assert not staged.needs_more_samples(keep=3, min_score=65)
+    assert staged.needs_more_samples(keep=3, min_score=71)
+    assert staged.keep_best(keep=3) == 3
+    # Best first; the earlier of two equal scores wins
+    assert [(sample.image, sample.quality) for sample in staged.samples] == [(b"wsq3", 90), (b"wsq0", 70), (b"wsq4", 70)]
+    assert _staged("u2", [None, 10]).keep_best(keep=1) == 1
+
+def test_commit_enrollment_stores_user_and_samples(repository):
+    staged = _staged("u1", [80, 60])
+    stored = repository.commit_enrollment(staged)
+    assert [fmd for _, fmd in stored] == [bytes([0]), bytes([1])]
+    assert repository.get_user("u1") == ("u1", "Name", "NIK")
+    rows = repository.reader().execute(
+        "SELECT id, fingerprint, fmd_type, sdk_version, quality, finger_pos, width, height, created_at IS NOT NULL "
+        "FROM fingerprints WHERE user_id = 'u1' ORDER BY id"
+    ).fetchall()
+    assert rows == [(stored[0][0], b"wsq0", 1, "3.4.1", 80, 2, 400, 500, 1),
+                    (stored[1][0], b"wsq1", 1, "3.4.1", 60, 2, 400, 500, 1)]
+    # Verification reads the best sample first
+    assert [template.id for template in repository.get_user_templates("u1")] == [row_id for row_id, _ in stored]
+    assert [change.operation for change in repository.changes_since(0, 1)] == ["insert", "insert"]
+
+def test_failed_commit_writes_nothing(repository):
+    repository.commit_enrollment(_staged("u1", [80]))
+    with pytest.raises(sqlite3.IntegrityError):
+        repository.commit_enrollment(_staged("u1", [90, 90]))
+    assert repository.count_fingerprints("u1") == 1
+    # The writer is usable again after the rollback
+    repository.commit_enrollment(_staged("u2", [50]))
+    assert repository.count_fingerprints("u2") == 1
+
+def _enroll_users(repository, counts):
+    with repository.transaction() as conn:
+        for user, count in enumerate(counts):
+            conn.execute("INSERT INTO users (user_id, name, nik) VALUES (?, ?, ?)", (f"u{user:02d}", f"n{user}", f"k{user}"))
+            conn.executemany("INSERT INTO fingerprints (user_id, fingerprint) VALUES (?, ?)",
+                             [(f"u{user:02d}", b"wsq")] * count)
+
+def test_list_enrollments_pages_by_user_id(repository):
+    _enroll_users(repository, [2, 0, 3, 1, 4])
+    first = repository.list_enrollments(limit=2)
+    assert first == [("u00", "n0", "k0", 2), ("u01", "n1", "k1", 0)]
+    second = repository.list_enrollments(after_user_id=first[-1].user_id, limit=2)
+    assert [(summary.user_id, summary.fingerprints) for summary in second] == [("u02", 3), ("u03", 1)]
+    assert [summary.user_id for summary in repository.list_enrollments(after_user_id="u03")] == ["u04"]
+    assert repository.list_enrollments(after_user_id="u04") == []
+
+@pytest.mark.parametrize("page_size", [1, 2, 5, 100])
+def test_iter_enrollments_streams_every_user(repository, page_size):
+    _enroll_users(repository, [2, 0, 3, 1, 4])
+    assert list(repository.iter_enrollments(page_size=page_size)) == repository.list_enrollments()
+    assert [summary.fingerprints for summary in repository.iter_enrollments(page_size=page_size)] == [2, 0, 3, 1, 4]
+
+def test_iter_enrollments_of_an_empty_database(repository):
+    assert list(repository.iter_enrollments(page_size=2)) == []
@@ -0,0 +1,92 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from conftest import REPO_ROOT
+from fir_parser import (COMPRESSION_UNCOMPRESSED, COMPRESSION_WSQ, DPFPDD_IMG_FMT_ANSI381,
+                        DPFPDD_IMG_FMT_ISOIEC19794, SCALE_UNITS_PPCM, SCALE_UNITS_PPI, parse_fir, raw_image_from_fir)
+
+CAPTURED_IMAGE = os.path.join(REPO_ROOT, "captured_image.raw")
+
+def _fir(views, ansi=False, scale_units=SCALE_UNITS_PPI, resolution=500, compression=COMPRESSION_UNCOMPRESSED,
+         finger_pos=2):
+    # views: a list of (width, height, pixels)
+    blocks = b"".join(struct.pack(">IBBBBBHHx", 14 + len(pixels), finger_pos, 1, number, 80, 0, width, height)
+                      + pixels for number, (width, height, pixels) in enumerate(views, 1))
+    tail = struct.pack(">HHBBHHHHBBxx", 0, 31, len(views), scale_units, resolution, resolution,
+                       resolution, resolution, 8, compression)
+    header_size = 36 if ansi else 32
+    length = (header_size + len(blocks)).to_bytes(6, "big")
+    product_id = b"\0\0\0\0" if ansi else b""
+    return b"FIR\x00010\x00" + length + product_id + tail + blocks
+
+def _pixels(width, height, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, width * height, dtype=np.uint8).tobytes()
+
+@pytest.mark.parametrize("ansi, image_fmt", [
+    (False, DPFPDD_IMG_FMT_ISOIEC19794),
+    (True, DPFPDD_IMG_FMT_ANSI381),
+])
+def test_parse_header_and_view(ansi, image_fmt):
+    pixels = _pixels(40, 30)
+    record = _fir([(40, 30, pixels)], ansi=ansi)
+    parsed = parse_fir(record, image_fmt)
+    assert parsed["format"] == image_fmt
+    assert parsed["record_length"] == len(record)
+    assert (parsed["acquisition_level"], parsed["pixel_depth"], parsed["dpi"]) == (31, 8, 500)
+    [view] = parsed["views"]
+    assert (view["width"], view["height"], view["finger_pos"], view["quality"]) == (40, 30, 2, 80)
+    assert view["image"].shape == (30, 40)
+    assert view["image"].tobytes() == pixels
+
+@pytest.mark.parametrize("ansi, image_fmt", [
+    (True, DPFPDD_IMG_FMT_ISOIEC19794),
+    (False, DPFPDD_IMG_FMT_ANSI381),
+])
+def test_layout_is_detected_when_the_format_hint_is_wrong(ansi, image_fmt):
+    pixels = _pixels(16, 16)
+    parsed = parse_fir(_fir([(16, 16, pixels)], ansi=ansi), image_fmt)
+    assert parsed["format"] == (DPFPDD_IMG_FMT_ANSI381 if ansi else DPFPDD_IMG_FMT_ISOIEC19794)
+    assert parsed["views"][0]["image"].tobytes() == pixels
+
+def test_pixels_are_views_of_the_record():
+    record = bytearray(_fir([(8, 8, bytes(64))]))
+    raw_image = raw_image_from_fir(record)
+    record[-1] = 255
+    assert raw_image["image"][7, 7] == 255
+
+def test_resolution_in_pixels_per_centimeter():
+    parsed = parse_fir(_fir([(8, 8, bytes(64))], scale_units=SCALE_UNITS_PPCM, resolution=197))
+    assert parsed["dpi"] == 500
+
+def test_multiple_views():
+    views = [(8, 8, _pixels(8, 8, 1)), (10, 6, _pixels(10, 6, 2))]
+    parsed = parse_fir(_fir(views))
+    assert [(view["view_number"], view["width"], view["height"]) for view in parsed["views"]] == [(1, 8, 8), (2, 10, 6)]
+    assert parsed["views"][1]["image"].tobytes() == views[1][2]
+
+def test_captured_record():
+    # captured_image.raw is an ISO 19794-4 record as returned by dpfpdd_capture
+    with open(CAPTURED_IMAGE, "rb") as f:
+        record = f.read()
+    parsed = parse_fir(record)
+    assert parsed["format"] == DPFPDD_IMG_FMT_ISOIEC19794
+    assert parsed["record_length"] == len(record)
+    raw_image = raw_image_from_fir(record)
+    assert (raw_image["width"], raw_image["height"], raw_image["dpi"], raw_image["bpp"]) == (400, 500, 500, 8)
+    assert bytes(raw_image["data"]) == record[-400 * 500:]
+
+def test_compressed_view_has_no_raw_image():
+    record = _fir([(8, 8, b"\xff\xa0\xff\xa1")], compression=COMPRESSION_WSQ)
+    assert parse_fir(record)["views"][0]["image"] is None
+    assert raw_image_from_fir(record) is None
+
+@pytest.mark.parametrize("record", [
+    b"",
+    b"FMR\0" + bytes(60),
+    _fir([(40, 30, _pixels(40, 30))])[:-10],
+])
+def test_malformed_records_are_rejected(record):
+    assert parse_fir(record) is None
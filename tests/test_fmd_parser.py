@@ -0,0 +1,68 @@
+import struct
+
+import numpy as np
+import pytest
+
+from conftest import make_fmd
+from fmd_parser import (DPFJ_FMD_ANSI_378_2004, DPFJ_FMD_ISO_19794_2_2005, MINUTIA_TYPE_BIFURCATION,
+                        MINUTIA_TYPE_RIDGE_ENDING, parse_fmd, parse_fmds)
+
+MINUTIAE = [
+    (MINUTIA_TYPE_RIDGE_ENDING, 120, 300, 45, 80),
+    (MINUTIA_TYPE_BIFURCATION, 399, 0, 179, 40),
+    (MINUTIA_TYPE_RIDGE_ENDING, 0, 499, 0, 100),
+]
+
+@pytest.mark.parametrize("iso, fmd_type, angle_unit", [
+    (False, DPFJ_FMD_ANSI_378_2004, 2.0),
+    (True, DPFJ_FMD_ISO_19794_2_2005, 360.0 / 256.0),
+])
+def test_parse_header_and_minutiae(iso, fmd_type, angle_unit):
+    fmd = make_fmd(MINUTIAE, iso=iso, width=400, height=500, quality=73)
+    parsed = parse_fmd(fmd, fmd_type)
+    assert parsed["format"] == fmd_type
+    assert parsed["record_length"] == len(fmd)
+    assert (parsed["width"], parsed["height"], parsed["x_res"], parsed["y_res"]) == (400, 500, 197, 197)
+    [view] = parsed["views"]
+    assert (view["finger_pos"], view["quality"]) == (1, 73)
+    minutiae = view["minutiae"]
+    assert minutiae["type"].tolist() == [m[0] for m in MINUTIAE]
+    assert minutiae["x"].tolist() == [m[1] for m in MINUTIAE]
+    assert minutiae["y"].tolist() == [m[2] for m in MINUTIAE]
+    assert np.allclose(minutiae["angle"], [m[3] * angle_unit for m in MINUTIAE])
+    assert minutiae["quality"].tolist() == [m[4] for m in MINUTIAE]
+
+def test_parse_ansi_long_record_length():
+    fmd = make_fmd(MINUTIAE)
+    # A zero 2-byte length is followed by the 4-byte length
+    long_fmd = fmd[:8] + b"\0\0" + struct.pack(">I", len(fmd) + 4) + fmd[10:]
+    parsed = parse_fmd(long_fmd)
+    assert parsed["record_length"] == len(long_fmd)
+    assert (parsed["width"], parsed["height"]) == (400, 500)
+    assert parsed["views"][0]["minutiae"]["x"].tolist() == [m[1] for m in MINUTIAE]
+
+def test_parse_empty_view():
+    parsed = parse_fmd(make_fmd([]))
+    assert len(parsed["views"][0]["minutiae"]) == 0
+
+@pytest.mark.parametrize("fmd", [
+    b"",
+    b"XYZ\0" + bytes(40),
+    make_fmd(MINUTIAE)[:-8],
+])
+def test_malformed_records_are_rejected(fmd):
+    assert parse_fmd(fmd) is None
+
+@pytest.mark.parametrize("iso, fmd_type", [
+    (False, DPFJ_FMD_ANSI_378_2004),
+    (True, DPFJ_FMD_ISO_19794_2_2005),
+])
+def test_batch_parse_matches_single_parse(iso, fmd_type):
+    fmds = [make_fmd(MINUTIAE[:count], iso=iso, quality=10 * count) for count in range(len(MINUTIAE) + 1)]
+    batch = parse_fmds(fmds, fmd_type)
+    assert batch["valid"].all()
+    for i, fmd in enumerate(fmds):
+        view = parse_fmd(fmd, fmd_type)["views"][0]
+        start, count = batch["starts"][i], batch["counts"][i]
+        assert batch["quality"][i] == view["quality"]
+        assert np.array_equal(batch["minutiae"][start:start + count], view["minutiae"])
@@ -0,0 +1,117 @@
+import ctypes
+
+from gallery_arena import GalleryArena
+
+def _fmd(template_id, size=20):
+    return bytes([template_id % 256]) * size
+
+def _assert_tables_match(arena, expected):
+    # Every live slot points at the bytes of its own template
+    assert len(arena) == len(expected)
+    for slot, template_id in enumerate(arena.template_ids):
+        assert arena.slot_of(template_id) == slot
+        size = arena.fmds_sizes[slot]
+        assert ctypes.string_at(arena.fmds_ptrs[slot], size) == expected[template_id]
+        assert bytes(arena.template(slot)) == expected[template_id]
+
+def test_append_grows_buffer_and_tables():
+    arena = GalleryArena(template_capacity=2, byte_capacity=16)
+    expected = {template_id: _fmd(template_id, 10 + template_id) for template_id in range(1, 40)}
+    for template_id, fmd in expected.items():
+        arena.append(template_id, f"u{template_id}", fmd)
+    _assert_tables_match(arena, expected)
+    assert arena.used_bytes == sum(len(fmd) for fmd in expected.values())
+
+def test_remove_moves_last_template_into_the_slot():
+    arena = GalleryArena()
+    expected = {template_id: _fmd(template_id) for template_id in range(1, 6)}
+    for template_id, fmd in expected.items():
+        arena.append(template_id, f"u{template_id}", fmd)
+
+    assert arena.remove(2)
+    del expected[2]
+    assert arena.template_ids == [1, 5, 3, 4]
+    assert arena.user_ids == ["u1", "u5", "u3", "u4"]
+    assert arena.wasted_bytes == 20
+    assert 2 not in arena
+    assert not arena.remove(2)
+    _assert_tables_match(arena, expected)
+
+def test_remove_last_template():
+    arena = GalleryArena()
+    arena.append(1, "u1", _fmd(1))
+    arena.append(2, "u2", _fmd(2))
+    assert arena.remove(2)
+    assert arena.template_ids == [1]
+    _assert_tables_match(arena, {1: _fmd(1)})
+
+def test_compact_reclaims_tombstones():
+    arena = GalleryArena()
+    expected = {template_id: _fmd(template_id) for template_id in range(1, 11)}
+    for template_id, fmd in expected.items():
+        arena.append(template_id, f"u{template_id}", fmd)
+    for template_id in (3, 7):
+        arena.remove(template_id)
+        del expected[template_id]
+
+    arena.compact()
+    assert arena.wasted_bytes == 0
+    assert arena.used_bytes == 20 * len(expected)
+    assert sorted(arena.offsets) == list(range(0, arena.used_bytes, 20))
+    _assert_tables_match(arena, expected)
+
+def test_remove_compacts_once_half_is_wasted():
+    arena = GalleryArena()
+    for template_id in range(1, 5):
+        arena.append(template_id, "u", _fmd(template_id))
+    arena.remove(1)
+    arena.remove(2)
+    assert arena.wasted_bytes == 40
+    arena.remove(3)
+    assert arena.wasted_bytes == 0
+    _assert_tables_match(arena, {4: _fmd(4)})
+
+def test_remove_user():
+    arena = GalleryArena()
+    for template_id in range(1, 7):
+        arena.append(template_id, f"u{template_id % 2}", _fmd(template_id))
+    assert arena.remove_user("u0") == 3
+    assert sorted(arena.template_ids) == [1, 3, 5]
+    _assert_tables_match(arena, {template_id: _fmd(template_id) for template_id in (1, 3, 5)})
+
+def test_append_replaces_existing_template():
+    arena = GalleryArena()
+    arena.append(1, "u1", _fmd(1))
+    arena.append(1, "u1", _fmd(9, 30))
+    assert len(arena) == 1
+    _assert_tables_match(arena, {1: _fmd(9, 30)})
+
+def test_shard_ranges_cover_every_slot():
+    arena = GalleryArena()
+    for template_id in range(10):
+        arena.append(template_id, "u", _fmd(template_id))
+    assert arena.shard_ranges(3) == [(0, 4), (4, 7), (7, 10)]
+    assert arena.shard_ranges(20) == [(slot, slot + 1) for slot in range(10)]
+    assert GalleryArena().shard_ranges(4) == []
+
+def test_snapshot_is_unaffected_by_later_changes():
+    arena = GalleryArena(template_capacity=2, byte_capacity=64)
+    expected = {template_id: _fmd(template_id) for template_id in range(1, 5)}
+    for template_id, fmd in expected.items():
+        arena.append(template_id, f"u{template_id}", fmd)
+    snapshot = arena.snapshot()
+
+    # Removal, compaction and growth all rewrite the live tables
+    arena.remove(1)
+    arena.remove(2)
+    for template_id in range(10, 30):
+        arena.append(template_id, f"u{template_id}", _fmd(template_id))
+    arena.compact()
+
+    assert snapshot.template_ids == [1, 2, 3, 4]
+    assert snapshot.user_ids == ["u1", "u2", "u3", "u4"]
+    assert snapshot.slot_of(3) == 2 and snapshot.slot_of(10) is None
+    for slot, template_id in enumerate(snapshot.template_ids):
+        assert ctypes.string_at(snapshot.fmds_ptrs[slot], snapshot.fmds_sizes[slot]) == expected[template_id]
+    ptrs, sizes = snapshot.gather_tables([3, 0])
+    assert ctypes.string_at(ptrs[0], sizes[0]) == expected[4]
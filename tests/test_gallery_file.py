@@ -0,0 +1,97 @@
+import ctypes
+import random
+import sqlite3
+
+import pytest
+
+from conftest import fill_gallery, random_fmd
+from gallery_arena import GalleryArena, GalleryTables
+from gallery_file import GALLERY_HEADER, GalleryFile, build_gallery_file, gallery_path_for
+from identification_engine import IdentificationEngine
+
+@pytest.fixture
+def gallery_db(tmp_path):
+    db_path = str(tmp_path / "gallery.db")
+    fill_gallery(db_path, users=25, scans_per_user=3)
+    return db_path
+
+def _stored(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT id, user_id, fmd FROM fingerprints ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+def test_round_trip(gallery_db):
+    path = gallery_path_for(gallery_db)
+    assert build_gallery_file(gallery_db) == 75
+    stored = _stored(gallery_db)
+
+    with GalleryFile(path) as gallery:
+        assert gallery.open()
+        assert isinstance(gallery, GalleryTables)
+        assert len(gallery) == 75
+        assert gallery.template_ids == [row_id for row_id, _, _ in stored]
+        assert list(gallery.user_ids) == [user_id for _, user_id, _ in stored]
+        assert gallery.last_row_id == 75
+        for slot, (row_id, _, fmd) in enumerate(stored):
+            assert gallery.slot_of(row_id) == slot
+            assert ctypes.string_at(gallery.fmds_ptrs[slot], gallery.fmds_sizes[slot]) == fmd
+            assert bytes(gallery.template(slot)) == fmd
+
+        # Shards and gathered tables see the same templates as the full tables
+        assert gallery.shard_ranges(4) == [(0, 19), (19, 38), (38, 57), (57, 75)]
+        ptrs, sizes = gallery.tables_at(57)
+        assert ctypes.string_at(ptrs[0], sizes[0]) == stored[57][2]
+        ptrs, sizes = gallery.gather_tables([70, 3])
+        assert [ctypes.string_at(ptrs[i], sizes[i]) for i in range(2)] == [stored[70][2], stored[3][2]]
+
+        arena = gallery.to_arena()
+    assert isinstance(arena, GalleryArena)
+    assert arena.template_ids == [row_id for row_id, _, _ in stored]
+    assert [bytes(arena.template(slot)) for slot in range(len(arena))] == [fmd for _, _, fmd in stored]
+
+def test_empty_gallery(tmp_path):
+    db_path = str(tmp_path / "empty.db")
+    fill_gallery(db_path, users=0)
+    assert build_gallery_file(db_path) == 0
+    with GalleryFile(gallery_path_for(db_path)) as gallery:
+        assert gallery.open()
+        assert len(gallery) == 0
+        assert gallery.shard_ranges(4) == []
+
+@pytest.mark.parametrize("damage", ["magic", "truncated", "missing"])
+def test_invalid_files_are_rejected(gallery_db, damage):
+    path = gallery_path_for(gallery_db)
+    build_gallery_file(gallery_db)
+    if damage == "missing":
+        path += ".missing"
+    else:
+        with open(path, "r+b") as f:
+            if damage == "magic":
+                f.write(b"NOTAGALL")
+            else:
+                f.truncate(GALLERY_HEADER.size + 8)
+    gallery = GalleryFile(path)
+    assert not gallery.open()
+    assert len(gallery) == 0
+
+def test_engine_serves_the_file_like_the_database(fake_dpfj, gallery_db):
+    build_gallery_file(gallery_db)
+    from_db = IdentificationEngine(gallery_db, shards=2)
+    from_db.load()
+    from_file = IdentificationEngine(gallery_db, shards=2)
+    assert from_file.load_file(gallery_path_for(gallery_db)) == 75
+    rnd = random.Random(3)
+    try:
+        for _ in range(5):
+            probe = random_fmd(rnd)
+            assert from_file.identify(probe, max_candidates=5, threshold_score=10000) == \
+                from_db.identify(probe, max_candidates=5, threshold_score=10000)
+        # The first change copies the mapped gallery into an arena
+        from_file.add_template(1000, "u99", probe)
+        assert isinstance(from_file.arena, GalleryArena)
+        assert from_file.identify(probe, max_candidates=1)[0].template_id == 1000
+    finally:
+        from_db.close()
+        from_file.close()
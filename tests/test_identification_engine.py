@@ -0,0 +1,150 @@
+import random
+import sqlite3
+import threading
+
+import pytest
+
+from conftest import fill_gallery, random_fmd
+from db_schema import open_database
+from enrollment_repository import EnrollmentRepository
+from identification_engine import DPFJ_FMD_ANSI_378_2004, IdentificationEngine
+from prefilter_index import PrefilterIndex
+
+# Above every fake score, so the tests decide what matches through max_candidates
+THRESHOLD = 10000
+
+@pytest.fixture
+def gallery_db(tmp_path):
+    db_path = str(tmp_path / "gallery.db")
+    fill_gallery(db_path, users=60)
+    return db_path
+
+def _engine(db_path, **kwargs):
+    engine = IdentificationEngine(db_path, **kwargs)
+    engine.load()
+    return engine
+
+def test_load_reads_every_template(fake_dpfj, gallery_db):
+    engine = _engine(gallery_db)
+    assert len(engine) == 120
+    assert engine.template_ids == list(range(1, 121))
+    engine.close()
+
+@pytest.mark.parametrize("shards", [2, 3, 7, 200])
+def test_shards_return_the_single_shard_result(fake_dpfj, gallery_db, shards):
+    single = _engine(gallery_db)
+    sharded = _engine(gallery_db, shards=shards)
+    rnd = random.Random(2)
+    try:
+        for _ in range(10):
+            probe = random_fmd(rnd)
+            for max_candidates in (1, 5, 30):
+                expected = single.identify(probe, max_candidates=max_candidates, threshold_score=THRESHOLD)
+                assert len(expected) == max_candidates
+                assert sharded.identify(probe, max_candidates=max_candidates, threshold_score=THRESHOLD) == expected
+    finally:
+        single.close()
+        sharded.close()
+
+def test_identify_is_sorted_and_thresholded(fake_dpfj, gallery_db):
+    engine = _engine(gallery_db, shards=3)
+    probe = random_fmd(random.Random(3))
+    matches = engine.identify(probe, max_candidates=120, threshold_score=THRESHOLD)
+    assert [(c.score, c.template_id) for c in matches] == sorted((c.score, c.template_id) for c in matches)
+    cut = matches[len(matches) // 2].score
+    assert all(c.score < cut for c in engine.identify(probe, max_candidates=120, threshold_score=cut))
+    engine.close()
+
+def test_rank_matches_identify(fake_dpfj, gallery_db):
+    engine = _engine(gallery_db)
+    probe = random_fmd(random.Random(4))
+    assert engine.rank(probe, max_candidates=10, threshold_score=THRESHOLD) == \
+        engine.identify(probe, max_candidates=10, threshold_score=THRESHOLD)
+    engine.close()
+
+def test_prefilter_keeping_everything_matches_full_scan(fake_dpfj, gallery_db):
+    full = _engine(gallery_db)
+    prefiltered = _engine(gallery_db, prefilter=PrefilterIndex(keep_fraction=1.0))
+    probe = random_fmd(random.Random(5))
+    assert prefiltered.identify(probe, max_candidates=10, threshold_score=THRESHOLD) == \
+        full.identify(probe, max_candidates=10, threshold_score=THRESHOLD)
+    full.close()
+    prefiltered.close()
+
+def test_exact_template_is_found(fake_dpfj, gallery_db):
+    engine = _engine(gallery_db, shards=4)
+    conn = sqlite3.connect(gallery_db)
+    template_id, user_id, fmd = conn.execute("SELECT id, user_id, fmd FROM fingerprints WHERE id = 77").fetchone()
+    conn.close()
+    best = engine.identify(fmd, max_candidates=1)[0]
+    assert (best.user_id, best.score) == (user_id, 0)
+    engine.close()
+
+def test_remove_and_add_keep_identify_consistent(fake_dpfj, gallery_db):
+    engine = _engine(gallery_db, shards=3)
+    probe = random_fmd(random.Random(6))
+    assert engine.remove_user("u1") == 2
+    assert "u1" not in engine.user_ids
+    engine.add_template(500, "u99", probe)
+    best = engine.identify(probe, max_candidates=1)[0]
+    assert (best.template_id, best.user_id, best.score) == (500, "u99", 0)
+    engine.close()
+
+def test_sync_applies_inserts_and_deletes(fake_dpfj, gallery_db):
+    engine = _engine(gallery_db)
+    probe = random_fmd(random.Random(7))
+    conn = open_database(gallery_db)
+    conn.execute("INSERT INTO fingerprints (user_id, fmd, fmd_type, fingerprint) VALUES (?, ?, ?, ?)",
+                 ("u5", probe, DPFJ_FMD_ANSI_378_2004, b"wsq"))
+    conn.execute("DELETE FROM fingerprints WHERE user_id = 'u0'")
+    conn.commit()
+    conn.close()
+
+    assert engine.sync() == 3
+    assert len(engine) == 119
+    assert "u0" not in engine.user_ids
+    best = engine.identify(probe, max_candidates=1)[0]
+    assert (best.user_id, best.score) == ("u5", 0)
+    assert engine.sync() == 0
+    engine.close()
+
+def test_changes_are_not_blocked_by_a_running_match(fake_dpfj, gallery_db, monkeypatch):
+    engine = _engine(gallery_db)
+    probe = random_fmd(random.Random(8))
+    matching = threading.Event()
+    release = threading.Event()
+    dpfj_identify = fake_dpfj.dpfj_identify
+
+    def slow_identify(*args):
+        matching.set()
+        release.wait(5)
+        return dpfj_identify(*args)
+    monkeypatch.setattr(fake_dpfj, "dpfj_identify", slow_identify)
+
+    results = []
+    worker = threading.Thread(target=lambda: results.append(engine.identify(probe, max_candidates=1)))
+    worker.start()
+    try:
+        assert matching.wait(5)
+        # The match in progress holds no lock, so enrollment and removal go through
+        engine.add_template(500, "u99", probe)
+        assert engine.remove_user("u0") == 2
+    finally:
+        release.set()
+        worker.join(5)
+
+    # The running match saw the gallery as it was when it started
+    [best] = results[0]
+    assert best.template_id != 500
+    monkeypatch.setattr(fake_dpfj, "dpfj_identify", dpfj_identify)
+    best = engine.identify(probe, max_candidates=1)[0]
+    assert (best.template_id, best.score) == (500, 0)
+    engine.close()
+
+def test_sync_trims_the_change_feed(fake_dpfj, gallery_db, monkeypatch):
+    engine = _engine(gallery_db)
+    trimmed = []
+    monkeypatch.setattr(EnrollmentRepository, "trim_changes", lambda self, seq: trimmed.append(seq))
+    engine.sync()
+    assert trimmed == [engine.change_seq] == [120]
+    engine.close()
@@ -0,0 +1,140 @@
+import random
+from multiprocessing import shared_memory
+
+import pytest
+
+import identification_workers
+from conftest import fill_gallery, random_fmd
+from db_schema import open_database
+from gallery_file import build_gallery_file, gallery_path_for
+from identification_engine import DPFJ_FMD_ANSI_378_2004, IdentificationEngine
+from identification_workers import IdentificationWorkerPool
+
+# Above every fake score, so the tests decide what matches through max_candidates
+THRESHOLD = 10000
+
+@pytest.fixture
+def gallery_db(tmp_path):
+    db_path = str(tmp_path / "gallery.db")
+    fill_gallery(db_path, users=30)
+    return db_path
+
+@pytest.fixture
+def pool(fake_dpfj, gallery_db):
+    # Workers are forked, so they inherit the stubbed library
+    pool = IdentificationWorkerPool(gallery_db, workers=2)
+    pool.load()
+    yield pool
+    pool.close()
+
+def _engine(db_path):
+    engine = IdentificationEngine(db_path)
+    engine.load()
+    return engine
+
+def _same_results(pool, engine, seed, max_candidates=(1, 5, 20)):
+    rnd = random.Random(seed)
+    for _ in range(5):
+        probe = random_fmd(rnd)
+        for k in max_candidates:
+            found = pool.identify(probe, max_candidates=k, threshold_score=THRESHOLD)
+            expected = engine.identify(probe, max_candidates=k, threshold_score=THRESHOLD)
+            # Ties may be broken in another order; everything better than the last score must agree
+            assert [c.score for c in found] == [c.score for c in expected]
+            cut = expected[-1].score
+            assert {c for c in found if c.score < cut} == {c for c in expected if c.score < cut}
+
+def _change(db_path, statements):
+    conn = open_database(db_path)
+    for sql, args in statements:
+        conn.execute(sql, args)
+    conn.commit()
+    conn.close()
+
+def test_load_and_identify_match_the_engine(pool, gallery_db):
+    assert len(pool) == 60
+    assert pool.template_ids == list(range(1, 61))
+    engine = _engine(gallery_db)
+    _same_results(pool, engine, seed=1)
+    engine.close()
+
+def test_exact_template_is_found(pool, gallery_db):
+    conn = open_database(gallery_db)
+    user_id, fmd = conn.execute("SELECT user_id, fmd FROM fingerprints WHERE id = 33").fetchone()
+    conn.close()
+    best = pool.identify(fmd, max_candidates=1)[0]
+    assert (best.template_id, best.user_id, best.score) == (33, user_id, 0)
+
+def test_load_file_serves_the_same_gallery(fake_dpfj, gallery_db, pool):
+    path = gallery_path_for(gallery_db)
+    build_gallery_file(gallery_db, path)
+    with IdentificationWorkerPool(gallery_db, workers=2) as file_pool:
+        assert file_pool.load_file(path) == 60
+        probe = random_fmd(random.Random(2))
+        assert file_pool.identify(probe, max_candidates=10, threshold_score=THRESHOLD) == \
+            pool.identify(probe, max_candidates=10, threshold_score=THRESHOLD)
+
+def test_close_stops_the_workers_and_unlinks_the_block(fake_dpfj, gallery_db):
+    pool = IdentificationWorkerPool(gallery_db, workers=2)
+    pool.load()
+    name = pool._shm.name
+    pool.close()
+    assert pool._executor is None and pool._shm is None
+    assert len(pool) == 0
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+    # A reload replaces the block
+    with IdentificationWorkerPool(gallery_db, workers=1) as pool:
+        pool.load()
+        pool.load()
+        assert len(pool) == 60
+
+def test_empty_gallery(fake_dpfj, tmp_path):
+    db_path = str(tmp_path / "empty.db")
+    fill_gallery(db_path, users=0)
+    with IdentificationWorkerPool(db_path, workers=2) as pool:
+        assert pool.load() == 0
+        assert pool.identify(random_fmd(random.Random(1))) == []
+
+def test_sync_patches_the_loaded_gallery(pool, gallery_db):
+    probe = random_fmd(random.Random(9))
+    _change(gallery_db, [
+        ("INSERT INTO fingerprints (user_id, fmd, fmd_type, fingerprint) VALUES (?, ?, ?, ?)",
+         ("u5", probe, DPFJ_FMD_ANSI_378_2004, b"wsq")),
+        ("DELETE FROM fingerprints WHERE user_id = 'u0'", ()),
+        ("UPDATE fingerprints SET fmd = ? WHERE id = 10", (random_fmd(random.Random(10)),)),
+    ])
+    shm = pool._shm
+
+    assert pool.sync() == 4
+    # Patched in place: the shared block and the workers were kept
+    assert pool._shm is shm
+    assert len(pool) == 59
+    best = pool.identify(probe, max_candidates=1)[0]
+    assert (best.user_id, best.score) == ("u5", 0)
+    engine = _engine(gallery_db)
+    _same_results(pool, engine, seed=11)
+    engine.close()
+    assert pool.sync() == 0
+
+def test_sync_reloads_past_the_threshold(pool, gallery_db, monkeypatch):
+    monkeypatch.setattr(identification_workers, "SYNC_RELOAD_MIN", 3)
+    monkeypatch.setattr(identification_workers, "SYNC_RELOAD_FRACTION", 0)
+    shm = pool._shm
+    _change(gallery_db, [("DELETE FROM fingerprints WHERE user_id IN ('u1', 'u2')", ())])
+    assert pool.sync() == 4
+    assert pool._shm is not shm
+    assert (len(pool), len(pool._removed), len(pool._delta)) == (56, 0, 0)
+
+def test_removing_every_loaded_template(pool, gallery_db, monkeypatch):
+    monkeypatch.setattr(identification_workers, "SYNC_RELOAD_MIN", 1000)
+    probe = random_fmd(random.Random(12))
+    _change(gallery_db, [
+        ("DELETE FROM fingerprints", ()),
+        ("INSERT INTO fingerprints (user_id, fmd, fmd_type, fingerprint) VALUES (?, ?, ?, ?)",
+         ("u7", probe, DPFJ_FMD_ANSI_378_2004, b"wsq")),
+    ])
+    pool.sync()
+    assert len(pool) == 1
+    [best] = pool.identify(probe, max_candidates=5, threshold_score=THRESHOLD)
+    assert (best.user_id, best.score) == ("u7", 0)
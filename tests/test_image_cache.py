@@ -0,0 +1,158 @@
+import numpy as np
+import pytest
+
+from image_cache import ENTRY_OVERHEAD, DecodedImageCache
+
+WIDTH, HEIGHT = 40, 50
+ENTRY_SIZE = ENTRY_OVERHEAD + WIDTH * HEIGHT
+
+class Store:
+    """Stored images by row ID, counting loads and decodes."""
+
+    def __init__(self, rows=10):
+        self.images = {row_id: bytes([row_id]) * (100 + row_id) for row_id in range(1, rows + 1)}
+        self.loads = 0
+        self.decodes = 0
+
+    def size(self, row_id):
+        return len(self.images[row_id])
+
+    def load(self, row_id):
+        self.loads += 1
+        return self.images.get(row_id)
+
+    def decode(self, compressed_data):
+        self.decodes += 1
+        return {"data": bytes([compressed_data[0]]) * (WIDTH * HEIGHT), "width": WIDTH, "height": HEIGHT, "dpi": 500}
+
+def _decode(cache, store, row_id):
+    return cache.decode(row_id, store.size(row_id), store.load, store.decode)
+
+def test_repeat_decode_is_a_hit():
+    cache = DecodedImageCache()
+    store = Store()
+    first = _decode(cache, store, 1)
+    second = _decode(cache, store, 1)
+    assert (store.loads, store.decodes) == (1, 1)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert second["image"].shape == (HEIGHT, WIDTH)
+    assert (second["width"], second["height"], second["dpi"], second["bpp"]) == (WIDTH, HEIGHT, 500, 8)
+    assert np.array_equal(first["data"], second["data"])
+    assert second["data"][0] == 1
+
+def test_cached_pixels_are_read_only():
+    cache = DecodedImageCache()
+    decoded = _decode(cache, Store(), 1)
+    with pytest.raises(ValueError):
+        decoded["image"][0, 0] = 0
+
+def test_changed_image_size_is_a_miss():
+    cache = DecodedImageCache()
+    store = Store()
+    _decode(cache, store, 1)
+    store.images[1] = bytes([9]) * 500
+    decoded = _decode(cache, store, 1)
+    assert decoded["data"][0] == 9
+    assert store.decodes == 2
+    assert cache.get(1, 500).image_size == 500
+
+def test_least_recently_used_is_evicted():
+    cache = DecodedImageCache(max_bytes=3 * ENTRY_SIZE)
+    store = Store()
+    for row_id in (1, 2, 3):
+        _decode(cache, store, row_id)
+    _decode(cache, store, 1)
+    _decode(cache, store, 4)
+    assert 2 not in cache
+    assert all(row_id in cache for row_id in (1, 3, 4))
+    assert cache.evictions == 1
+    assert cache.used_bytes == 3 * ENTRY_SIZE
+
+def test_oversized_image_is_returned_but_not_cached():
+    cache = DecodedImageCache(max_bytes=ENTRY_SIZE - 1)
+    decoded = _decode(cache, Store(), 1)
+    assert decoded["width"] == WIDTH
+    assert len(cache) == 0 and cache.used_bytes == 0
+
+def test_failed_load_or_decode_returns_none():
+    cache = DecodedImageCache()
+    store = Store()
+    assert cache.decode(99, 100, store.load, store.decode) is None
+    assert cache.decode(1, store.size(1), store.load, lambda compressed_data: None) is None
+    assert len(cache) == 0
+
+def test_put_rejects_wrong_pixel_count():
+    cache = DecodedImageCache()
+    assert cache.put(1, 100, bytes(10), WIDTH, HEIGHT, 500) is None
+
+def test_invalidate_and_clear():
+    cache = DecodedImageCache()
+    store = Store()
+    _decode(cache, store, 1)
+    _decode(cache, store, 2)
+    assert cache.invalidate(1)
+    assert 1 not in cache
+    cache.clear()
+    assert len(cache) == 0 and cache.used_bytes == 0
+
+def test_stored_wsq_images_round_trip(tmp_path):
+    wsq_codec = pytest.importorskip("wsq_codec")
+    from enrollment_repository import EnrollmentRepository
+    rnd = np.random.default_rng(0)
+    pixels = rnd.integers(0, 256, (500, 400), dtype=np.uint8)
+    compressed = wsq_codec.encode_wsq(pixels.tobytes(), 400, 500)
+    assert wsq_codec.wsq_dimensions(compressed) == (400, 500)
+
+    repository = EnrollmentRepository(str(tmp_path / "images.db"))
+    with repository.transaction() as conn:
+        conn.execute("INSERT INTO fingerprints (user_id, fingerprint) VALUES ('u1', ?)", (compressed,))
+    cache = DecodedImageCache()
+    [stored] = repository.get_user_images("u1")
+    assert stored.size == len(compressed)
+    for _ in range(2):
+        decoded = cache.decode(stored.id, stored.size, repository.get_fingerprint, wsq_codec.decode_wsq)
+        assert decoded["image"].shape == (500, 400)
+    assert (cache.hits, cache.misses) == (1, 1)
+    repository.close()
+
+def _stored_image_db(tmp_path, images):
+    from enrollment_repository import EnrollmentRepository
+    repository = EnrollmentRepository(str(tmp_path / "images.db"))
+    with repository.transaction() as conn:
+        for image in images:
+            conn.execute("INSERT INTO fingerprints (user_id, fingerprint) VALUES ('u1', ?)", (image,))
+    return repository
+
+def _decode_stored(cache, repository, store):
+    return [cache.decode(stored.id, stored.size, repository.get_fingerprint, store.decode)["data"][0]
+            for stored in repository.get_user_images("u1")]
+
+def test_sync_drops_images_rewritten_with_the_same_size(tmp_path):
+    repository = _stored_image_db(tmp_path, [bytes([1]) * 100, bytes([2]) * 100])
+    cache = DecodedImageCache()
+    store = Store()
+    assert cache.sync(repository) == 0
+    assert _decode_stored(cache, repository, store) == [1, 2]
+
+    with repository.transaction() as conn:
+        conn.execute("UPDATE fingerprints SET fingerprint = ? WHERE id = 1", (bytes([7]) * 100,))
+    # The size check alone still serves the old decode
+    assert _decode_stored(cache, repository, store) == [1, 2]
+    assert cache.sync(repository) == 1
+    assert _decode_stored(cache, repository, store) == [7, 2]
+    assert store.decodes == 3
+    assert cache.sync(repository) == 0
+    repository.close()
+
+def test_sync_clears_when_the_feed_was_pruned(tmp_path):
+    repository = _stored_image_db(tmp_path, [bytes([1]) * 100, bytes([2]) * 100])
+    cache = DecodedImageCache()
+    cache.sync(repository)
+    _decode_stored(cache, repository, Store())
+    with repository.transaction() as conn:
+        conn.execute("INSERT INTO fingerprints (user_id, fingerprint) VALUES ('u2', x'00')")
+        conn.execute("INSERT INTO fingerprints (user_id, fingerprint) VALUES ('u2', x'00')")
+    repository.prune_changes(repository.change_watermark())
+    assert cache.sync(repository) == 2
+    assert len(cache) == 0 and cache.change_seq == repository.change_watermark()
+    repository.close()
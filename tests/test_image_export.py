@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from enrollment_repository import EnrollmentRepository
+from image_export import FORMAT_RAW, export_images, image_path
+from wsq_codec import decode_wsq, encode_wsq
+
+def _image(seed, width, height=500):
+    return np.random.default_rng(seed).integers(0, 256, (height, width), dtype=np.uint8).tobytes()
+
+@pytest.fixture
+def image_db(tmp_path):
+    db_path = str(tmp_path / "images.db")
+    repository = EnrollmentRepository(db_path)
+    with repository.transaction() as conn:
+        for row, user_id in enumerate(["u1", "u1", "u2", "../u3"]):
+            conn.execute("INSERT INTO fingerprints (user_id, fingerprint) VALUES (?, ?)",
+                         (user_id, encode_wsq(_image(row, 392 + row), 392 + row, 500)))
+        # A corrupt image and a template-only row
+        conn.execute("INSERT INTO fingerprints (user_id, fingerprint) VALUES ('u2', ?)", (b"not a wsq stream",))
+        conn.execute("INSERT INTO fingerprints (user_id, fingerprint, fmd) VALUES ('u2', ?, ?)", (b"", b"fmd"))
+    repository.close()
+    return db_path
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_export_writes_every_decodable_image(image_db, tmp_path, workers):
+    output = str(tmp_path / "export")
+    report = export_images(output, image_db, workers=workers, batch_size=2)
+    assert (report["exported"], report["failed"]) == (4, 1)
+    for row_id, user_id in [(1, "u1"), (2, "u1"), (3, "u2"), (4, "../u3")]:
+        path = image_path(output, user_id, row_id)
+        assert path.startswith(output + "/") and ".." not in path
+        with Image.open(path) as img:
+            assert img.size == (391 + row_id, 500)
+            assert round(img.info["dpi"][0]) == 500
+
+def test_export_one_user_as_raw(image_db, tmp_path):
+    output = str(tmp_path / "export")
+    report = export_images(output, image_db, user_id="u1", workers=0, image_format=FORMAT_RAW)
+    assert report["exported"] == 2
+    with open(image_path(output, "u1", 2, FORMAT_RAW), "rb") as f:
+        assert f.read() == decode_wsq(encode_wsq(_image(1, 393), 393, 500))["data"]
@@ -0,0 +1,73 @@
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+from conftest import REPO_ROOT
+from image_quality import assess_image, has_enough_detail
+
+CAPTURED_IMAGE = os.path.join(REPO_ROOT, "captured_image.raw")
+ENROLLMENT_DB = os.path.join(REPO_ROOT, "fingerprint_enrollment.db")
+
+def _ridges(size=(500, 400), finger=(150, 210), period=9.0, blank=250):
+    # Whorl-like ridge pattern inside an ellipse on an empty platen
+    height, width = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    theta = np.arctan2(y - height / 2, x - width / 2) * 0.5
+    wave = np.sin(2 * np.pi * (x * np.cos(theta) + y * np.sin(theta)) / period)
+    mask = ((x - width / 2) / finger[0]) ** 2 + ((y - height / 2) / finger[1]) ** 2 < 1
+    noise = np.random.default_rng(0).normal(0, 6, size)
+    return wave, mask, noise, blank
+
+def _image(pixels, mask, noise, blank):
+    return np.clip(np.where(mask, pixels, blank) + noise, 0, 255).astype(np.uint8)
+
+def test_captured_image_passes():
+    with open(CAPTURED_IMAGE, "rb") as f:
+        assessment = assess_image(f.read())
+    assert assessment["usable"], assessment["reasons"]
+
+def test_enrolled_images_pass():
+    wsq_codec = pytest.importorskip("wsq_codec")
+    conn = sqlite3.connect(f"file:{ENROLLMENT_DB}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT id, fingerprint FROM fingerprints").fetchall()
+    finally:
+        conn.close()
+    assert rows
+    for row_id, compressed in rows:
+        image = wsq_codec.decode_wsq(compressed)
+        assessment = assess_image(image["data"], image["width"], image["height"])
+        assert assessment["usable"], (row_id, assessment["reasons"])
+
+def test_synthetic_print_passes():
+    wave, mask, noise, blank = _ridges()
+    assert has_enough_detail(_image(128 + 90 * wave, mask, noise, blank))
+
+@pytest.mark.parametrize("case, reason", [
+    ("blank", "finger covers"),
+    ("noise", "ridge coherence"),
+    ("small", "finger covers"),
+    ("dry", "too dry"),
+    ("wet", "too wet"),
+])
+def test_bad_captures_are_rejected(case, reason):
+    wave, mask, noise, blank = _ridges()
+    if case == "blank":
+        image = _image(np.full(mask.shape, 250.0), mask, noise, blank)
+    elif case == "noise":
+        image = np.random.default_rng(1).integers(0, 256, mask.shape, dtype=np.uint8)
+    elif case == "small":
+        _, small_mask, _, _ = _ridges(finger=(40, 50))
+        image = _image(128 + 90 * wave, small_mask, 0, blank)
+    elif case == "dry":
+        image = _image(np.where(wave < -0.7, 60, 225), mask, noise, blank)
+    else:
+        image = _image(np.where(wave > 0.7, 200, 25), mask, noise, blank)
+    assessment = assess_image(image)
+    assert not assessment["usable"]
+    assert any(reason in text for text in assessment["reasons"])
+
+def test_raw_buffer_must_hold_the_frame():
+    assert assess_image(b"\0" * 100, 400, 500) is None
@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from conftest import fake_fmd, make_fmd
+from db_schema import open_database
+from legacy_import import KIND_FMD, KIND_METADATA, KIND_WSQ, find_legacy_files, import_legacy
+from wsq_codec import decode_wsq, encode_wsq
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def _image(seed):
+    return np.random.default_rng(seed).integers(0, 256, (500, 400), dtype=np.uint8).tobytes()
+
+@pytest.fixture
+def legacy_dirs(tmp_path):
+    # "database" as enroll_user in test14 wrote it, and a working directory with copies and strays
+    database, workdir = tmp_path / "database", tmp_path / "work"
+    database.mkdir()
+    workdir.mkdir()
+    _write(database / "user_a_scan_1.wsq", encode_wsq(_image(1), 400, 500))
+    _write(database / "user_a_scan_2.wsq", encode_wsq(_image(2), 400, 500))
+    _write(database / "user_a.json", json.dumps({"name": "Alice", "nik": "123",
+                                                 "enrollment_date": "2024-01-02 03:04:05"}).encode())
+    _write(database / "user_d_scan_1.wsq", b"not a wsq stream")
+    _write(workdir / "fmd_b.dat", make_fmd([(1, 10, 20, 30, 50)], quality=44))
+    _write(workdir / "fmd_e.dat", b"not an fmd")
+    _write(workdir / "user_c.json", json.dumps({"name": "Carol", "nik": "456"}).encode())
+    _write(workdir / "user_f.json", b"{not json")
+    _write(workdir / "notes.txt", b"ignored")
+    shutil.copyfile(database / "user_a_scan_1.wsq", workdir / "user_a_scan_1.wsq")
+    return str(database), str(workdir)
+
+def test_find_legacy_files_orders_metadata_first(legacy_dirs):
+    database, workdir = legacy_dirs
+    found = find_legacy_files([database, workdir, database + "/"])
+    assert [(f.kind, f.user_id, f.scan) for f in found] == [
+        (KIND_METADATA, "a", 0), (KIND_METADATA, "c", 0), (KIND_METADATA, "f", 0),
+        (KIND_WSQ, "a", 1), (KIND_WSQ, "a", 1), (KIND_WSQ, "a", 2), (KIND_WSQ, "d", 1),
+        (KIND_FMD, "b", 0), (KIND_FMD, "e", 0),
+    ]
+    assert find_legacy_files([os.path.join(database, "missing")]) == []
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_import_stores_users_and_fingerprints(fake_dpfj, legacy_dirs, tmp_path, workers):
+    db_path = str(tmp_path / "imported.db")
+    report = import_legacy(legacy_dirs, db_path, workers=workers, batch_size=2)
+    assert {key: report[key] for key in ("files", "users", "imported", "duplicates", "rejected")} == \
+        {"files": 9, "users": 3, "imported": 3, "duplicates": 1, "rejected": 3}
+
+    conn = open_database(db_path)
+    assert conn.execute("SELECT user_id, name, nik FROM users ORDER BY user_id").fetchall() == [
+        ("a", "Alice", "123"), ("b", "", ""), ("c", "Carol", "456")]
+    rows = conn.execute("SELECT user_id, fingerprint, fmd, sdk_version, quality, width, height, created_at "
+                        "FROM fingerprints ORDER BY id").fetchall()
+    conn.close()
+    for scan, (user_id, fingerprint, fmd, sdk_version, quality, width, height, created_at) in enumerate(rows[:2], 1):
+        assert fingerprint == encode_wsq(_image(scan), 400, 500)
+        assert fmd == fake_fmd(decode_wsq(fingerprint)["data"], 400, 500)
+        assert (user_id, sdk_version, quality, width, height, created_at) == \
+            ("a", "3.4.1", 70, 400, 500, "2024-01-02 03:04:05")
+    # A template-only file keeps an empty image and no SDK version
+    assert rows[2][:2] == ("b", b"") and rows[2][3:5] == (None, 44)
+
+def test_import_skips_what_is_already_stored(fake_dpfj, legacy_dirs, tmp_path):
+    db_path = str(tmp_path / "imported.db")
+    conn = open_database(db_path)
+    conn.execute("INSERT INTO users (user_id, name, nik) VALUES ('a', 'Old name', '999')")
+    conn.commit()
+    conn.close()
+
+    import_legacy(legacy_dirs, db_path, workers=0)
+    report = import_legacy(legacy_dirs, db_path, workers=0)
+    assert (report["imported"], report["duplicates"], report["users"]) == (0, 4, 0)
+    conn = open_database(db_path)
+    # Existing users keep their stored name and NIK
+    assert conn.execute("SELECT name, nik FROM users WHERE user_id = 'a'").fetchone() == ("Old name", "999")
+    assert conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0] == 3
+    conn.close()
+
+def test_nothing_to_import(tmp_path):
+    report = import_legacy([str(tmp_path)], str(tmp_path / "imported.db"), workers=0)
+    assert report == {"files": 0, "users": 0, "imported": 0, "duplicates": 0, "rejected": 0}
@@ -0,0 +1,41 @@
+import pytest
+
+from match_scores import (DEFAULT_THRESHOLD_SCORE, DPFJ_PROBABILITY_ONE, first_match, fmr_to_threshold,
+                          resolve_threshold, top_k)
+
+def test_fmr_to_threshold():
+    assert fmr_to_threshold(1) == DPFJ_PROBABILITY_ONE
+    assert fmr_to_threshold(0.00001) == 21474
+    assert fmr_to_threshold(1e-12) == 1
+    for target_fmr in (0, -0.1, 1.5):
+        with pytest.raises(ValueError):
+            fmr_to_threshold(target_fmr)
+
+def test_resolve_threshold():
+    assert resolve_threshold() == DEFAULT_THRESHOLD_SCORE
+    assert resolve_threshold(threshold_score=5) == 5
+    assert resolve_threshold(0.00001, threshold_score=5) == 21474
+
+def test_top_k_keeps_the_best_below_the_threshold():
+    scored = [(50, 0), (None, 1), (10, 2), (100, 3), (30, 4), (10, 5), (70, 6)]
+    assert top_k(scored, 3, threshold_score=100) == [(10, 2), (10, 5), (30, 4)]
+    assert top_k(scored, 10, threshold_score=40) == [(10, 2), (10, 5), (30, 4)]
+    assert top_k(scored, 0) == []
+
+def test_top_k_ties_do_not_depend_on_arrival_order():
+    scored = [(score, index, "extra") for index, score in enumerate([5, 1, 5, 5, 1, 5])]
+    expected = top_k(scored, 3)
+    assert expected == [(1, 1, "extra"), (1, 4, "extra"), (5, 0, "extra")]
+    assert top_k(reversed(scored), 3) == expected
+
+def test_first_match_stops_at_the_first_score_below_the_threshold():
+    consumed = []
+
+    def scores():
+        for entry in [(None, 0), (150, 1), (20, 2), (10, 3)]:
+            consumed.append(entry[1])
+            yield entry
+    assert first_match(scores(), threshold_score=100) == (20, 2)
+    assert consumed == [0, 1, 2]
+    assert first_match([(100, 0)], threshold_score=100) is None
+    assert first_match([]) is None
@@ -0,0 +1,133 @@
+import os
+import random
+
+import numpy as np
+import pytest
+
+from conftest import make_fmd
+from db_schema import open_database
+from fmd_parser import parse_fmd
+from identification_engine import DPFJ_FMD_ANSI_378_2004, IdentificationEngine
+from mcc_index import MCCIndex, benchmark, compute_descriptors
+
+def _minutiae(rnd, count=30):
+    # Dense enough that every cylinder has neighbours
+    return [(1, rnd.randrange(100, 300), rnd.randrange(100, 350), rnd.randrange(180), 50) for _ in range(count)]
+
+def _shifted(minutiae, dx, dy):
+    return [(kind, x + dx, y + dy, angle, quality) for kind, x, y, angle, quality in minutiae]
+
+def _index(count=40, seed=1, **kwargs):
+    rnd = random.Random(seed)
+    index = MCCIndex(**kwargs)
+    fmds = {}
+    for template_id in range(1, count + 1):
+        fmds[template_id] = make_fmd(_minutiae(rnd))
+        assert index.add_template(template_id, f"u{template_id % 10}", fmds[template_id])
+    return index, fmds
+
+def _descriptors(minutiae):
+    return compute_descriptors(parse_fmd(make_fmd(minutiae))["views"][0]["minutiae"])
+
+def test_descriptors_are_translation_invariant():
+    minutiae = _minutiae(random.Random(2))
+    descriptors = _descriptors(minutiae)
+    assert descriptors.shape[0] == len(minutiae) and descriptors.any()
+    assert np.array_equal(_descriptors(_shifted(minutiae, 37, -21)), descriptors)
+
+def test_too_few_minutiae_have_no_descriptors():
+    assert _descriptors([(1, 100, 100, 0, 50), (1, 110, 100, 0, 50)]).shape[0] == 0
+
+def test_search_ranks_the_source_template_first():
+    index, fmds = _index()
+    for template_id, fmd in fmds.items():
+        assert index.search(fmd, max_candidates=5)[0] == template_id
+
+def test_search_finds_a_shifted_probe():
+    rnd = random.Random(3)
+    index, _ = _index()
+    minutiae = _minutiae(rnd)
+    index.add_template(100, "u100", make_fmd(minutiae))
+    assert index.search(make_fmd(_shifted(minutiae, 12, 8)), max_candidates=3)[0] == 100
+
+def test_removed_templates_are_not_returned():
+    index, fmds = _index()
+    assert index.remove_template(3)
+    assert not index.remove_template(3)
+    assert 3 not in index.search(fmds[3], max_candidates=40)
+    assert index.remove_user("u1") == 4
+    assert len(index) == 35
+    assert not {1, 11, 21, 31} & set(index.search(fmds[11], max_candidates=40))
+
+def test_unparsable_fmd_is_not_indexed():
+    index = MCCIndex()
+    assert not index.add_template(1, "u1", b"not an fmd")
+    assert len(index) == 0 and index.search(b"not an fmd") == []
+
+def test_persisted_index_replays_adds_and_removals(tmp_path):
+    path = str(tmp_path / "gallery.mcc")
+    index, fmds = _index(path=path)
+    index.remove_template(5)
+    # A re-added template replaces its earlier record
+    index.add_template(7, "u-new", fmds[8])
+
+    loaded = MCCIndex(path=path)
+    assert loaded.load() == 39
+    assert 5 not in loaded
+    assert loaded.search(fmds[8], max_candidates=2) == index.search(fmds[8], max_candidates=2)
+    assert loaded.user_ids[loaded.template_ids.index(7)] == "u-new"
+
+    size = os.path.getsize(path)
+    loaded.save()
+    assert os.path.getsize(path) < size
+    assert MCCIndex(path=path).load() == 39
+
+def test_index_with_other_parameters_is_discarded(tmp_path):
+    path = str(tmp_path / "gallery.mcc")
+    _index(count=3, path=path)
+    assert MCCIndex(path=path, seed=1).load() == 0
+    assert not os.path.exists(path)
+
+def test_truncated_record_is_ignored(tmp_path):
+    path = str(tmp_path / "gallery.mcc")
+    _index(count=3, path=path)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 5)
+    assert MCCIndex(path=path).load() == 2
+
+@pytest.fixture
+def mcc_db(tmp_path):
+    db_path = str(tmp_path / "gallery.db")
+    rnd = random.Random(4)
+    conn = open_database(db_path)
+    for template_id in range(1, 31):
+        conn.execute("INSERT INTO fingerprints (user_id, fmd, fmd_type, fingerprint) VALUES (?, ?, ?, ?)",
+                     (f"u{template_id}", make_fmd(_minutiae(rnd)), DPFJ_FMD_ANSI_378_2004, b"wsq"))
+    conn.commit()
+    conn.close()
+    return db_path
+
+def test_sync_follows_the_database(mcc_db):
+    index = MCCIndex()
+    assert index.sync(mcc_db) == (30, 0)
+    conn = open_database(mcc_db)
+    conn.execute("DELETE FROM fingerprints WHERE id IN (1, 2)")
+    conn.execute("INSERT INTO fingerprints (user_id, fmd, fmd_type, fingerprint) VALUES ('u99', ?, ?, ?)",
+                 (make_fmd(_minutiae(random.Random(5))), DPFJ_FMD_ANSI_378_2004, b"wsq"))
+    conn.commit()
+    conn.close()
+    assert index.sync(mcc_db) == (1, 2)
+    assert index.sync(mcc_db) == (0, 0)
+    assert len(index) == 29 and 31 in index and 1 not in index
+
+def test_benchmark_recalls_exact_probes(fake_dpfj, mcc_db):
+    engine = IdentificationEngine(mcc_db)
+    engine.load()
+    index = MCCIndex()
+    index.sync(mcc_db)
+    conn = open_database(mcc_db)
+    probes = [bytes(row[0]) for row in conn.execute("SELECT fmd FROM fingerprints WHERE id <= 10")]
+    conn.close()
+    report = benchmark(engine, index, probes, max_candidates=5)
+    assert (report["probes"], report["matched"], report["recall"]) == (10, 10, 1.0)
+    engine.close()
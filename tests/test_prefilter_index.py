@@ -0,0 +1,75 @@
+import random
+
+import numpy as np
+
+from conftest import make_fmd
+from gallery_arena import GalleryArena
+from identification_engine import IdentificationEngine
+from prefilter_index import PrefilterIndex
+
+def _template(rnd):
+    count = rnd.randrange(5, 30)
+    return make_fmd([(rnd.randrange(1, 3), rnd.randrange(400), rnd.randrange(500), rnd.randrange(256), 50)
+                     for _ in range(count)])
+
+def _arena(fmds):
+    arena = GalleryArena()
+    for template_id, fmd in enumerate(fmds, 1):
+        arena.append(template_id, f"u{template_id}", fmd)
+    return arena
+
+def _rebuilt(arena):
+    index = PrefilterIndex()
+    index.build(arena)
+    return index
+
+def test_scale_follows_appends_and_removals():
+    rnd = random.Random(1)
+    arena = _arena([_template(rnd) for _ in range(50)])
+    index = _rebuilt(arena)
+    for template_id in range(51, 81):
+        fmd = _template(rnd)
+        arena.append(template_id, "u", fmd)
+        index.append(fmd)
+    for template_id in rnd.sample(range(1, 81), 40):
+        slot = arena.slot_of(template_id)
+        arena.remove(template_id)
+        index.remove_slot(slot)
+
+    fresh = _rebuilt(arena)
+    assert np.array_equal(index.features, fresh.features)
+    assert np.allclose(index._scale, fresh._scale, rtol=1e-4)
+
+def test_select_keeps_the_closest_templates():
+    rnd = random.Random(2)
+    fmds = [_template(rnd) for _ in range(200)]
+    index = PrefilterIndex(keep_fraction=0.1, min_keep=1)
+    index.build(_arena(fmds))
+    slots = index.select(fmds[17])
+    assert len(slots) == 20
+    assert 17 in slots
+    assert list(slots) == sorted(slots)
+    assert (index.probes, index.scanned, index.kept) == (1, 200, 20)
+    assert index.pruning_rate() == 0.9
+
+def test_small_gallery_is_not_pruned():
+    rnd = random.Random(3)
+    index = PrefilterIndex(keep_fraction=0.1, min_keep=100)
+    index.build(_arena([_template(rnd) for _ in range(30)]))
+    assert list(index.select(_template(rnd))) == list(range(30))
+
+def test_measure_recall_leaves_the_statistics_alone(fake_dpfj, tmp_path):
+    rnd = random.Random(4)
+    fmds = [_template(rnd) for _ in range(100)]
+    engine = IdentificationEngine(str(tmp_path / "unused.db"), prefilter=PrefilterIndex(keep_fraction=0.2, min_keep=1))
+    for template_id, fmd in enumerate(fmds, 1):
+        engine.add_template(template_id, f"u{template_id}", fmd)
+    engine.prefilter.build(engine.arena)
+
+    report = engine.prefilter.measure_recall(engine, fmds[:10], max_candidates=1)
+    assert report["matched"] == 10
+    # Every probe is in the gallery, and its own template is the closest by features
+    assert report["recall"] == 1.0
+    assert report["pruning_rate"] == 0.8
+    assert (engine.prefilter.probes, engine.prefilter.scanned, engine.prefilter.kept) == (0, 0, 0)
+    engine.close()
@@ -0,0 +1,54 @@
+from template_cache import ENTRY_OVERHEAD, TemplateCache
+
+FMD = bytes(1000)
+
+def _budget(entries):
+    # Room for this many single-template entries of _put
+    return entries * TemplateCache._entry_size("u0", "name", "nik", [FMD])
+
+def _put(cache, user):
+    return cache.put(f"u{user}", "name", "nik", [FMD])
+
+def test_hit_and_miss():
+    cache = TemplateCache()
+    assert cache.get("u1") is None
+    _put(cache, 1)
+    entry = cache.get("u1")
+    assert entry.name == "name" and entry.fmds == (FMD,)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.hit_rate() == 0.5
+
+def test_least_recently_used_is_evicted():
+    cache = TemplateCache(max_bytes=_budget(3))
+    for user in range(3):
+        _put(cache, user)
+    cache.get("u0")
+    _put(cache, 3)
+    assert "u1" not in cache
+    assert all(user_id in cache for user_id in ("u0", "u2", "u3"))
+    assert cache.evictions == 1
+    assert cache.used_bytes <= cache.max_bytes
+
+def test_oversized_entry_is_returned_but_not_cached():
+    cache = TemplateCache(max_bytes=ENTRY_OVERHEAD)
+    entry = _put(cache, 1)
+    assert entry.fmds == (FMD,)
+    assert len(cache) == 0 and cache.used_bytes == 0
+
+def test_put_replaces_entry():
+    cache = TemplateCache()
+    _put(cache, 1)
+    used = cache.used_bytes
+    cache.put("u1", "Name", "nik", [FMD])
+    assert len(cache) == 1 and cache.used_bytes == used
+    assert cache.get("u1").name == "Name"
+
+def test_invalidate_and_clear():
+    cache = TemplateCache()
+    _put(cache, 1)
+    _put(cache, 2)
+    assert cache.invalidate("u1")
+    assert not cache.invalidate("u1")
+    assert cache.get("u1") is None
+    cache.clear()
+    assert len(cache) == 0 and cache.used_bytes == 0
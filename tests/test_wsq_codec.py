@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from enrollment_repository import EnrollmentRepository
+from wsq_codec import WSQCodecPool, decode_wsq, encode_wsq, wsq_dimensions
+
+def _image(seed=0, width=400, height=500):
+    return np.random.default_rng(seed).integers(0, 256, (height, width), dtype=np.uint8).tobytes()
+
+def test_round_trip():
+    compressed = encode_wsq(_image(), 400, 500)
+    assert compressed[:2] == b"\xff\xa0"
+    assert wsq_dimensions(compressed) == (400, 500)
+    decoded = decode_wsq(compressed)
+    assert (decoded["width"], decoded["height"], decoded["dpi"], decoded["bpp"]) == (400, 500, 500, 8)
+    assert len(decoded["data"]) == 400 * 500
+
+def test_decode_from_a_blob_handle(tmp_path):
+    compressed = encode_wsq(_image(1), 400, 500)
+    repository = EnrollmentRepository(str(tmp_path / "images.db"))
+    with repository.transaction() as conn:
+        row_id = conn.execute("INSERT INTO fingerprints (user_id, fingerprint) VALUES ('u1', ?)",
+                              (compressed,)).lastrowid
+    with repository.open_fingerprint(row_id) as blob:
+        assert decode_wsq(blob)["data"] == decode_wsq(compressed)["data"]
+    repository.close()
+
+@pytest.mark.parametrize("data", [b"", b"\xff\xa0garbage", b"not a wsq stream"])
+def test_invalid_streams(data):
+    assert decode_wsq(data) is None
+    assert wsq_dimensions(data) is None
+
+def test_encode_rejects_wrong_size():
+    assert encode_wsq(bytes(10), 400, 500) is None
+
+@pytest.fixture(scope="module")
+def pool():
+    with WSQCodecPool(workers=2, batch_size=3) as codec_pool:
+        yield codec_pool
+
+def test_pool_matches_the_inline_codec_in_order(pool):
+    # Full-size images: the codec does not decode very small ones deterministically
+    images = [(_image(seed, 392 + seed), 392 + seed, 500) for seed in range(8)]
+    compressed = list(pool.encode_many(images))
+    assert compressed == [encode_wsq(*image) for image in images]
+    decoded = list(pool.decode_many(compressed))
+    assert decoded == [decode_wsq(blob) for blob in compressed]
+    assert [image["width"] for image in decoded] == [392 + seed for seed in range(8)]
+
+def test_pool_yields_none_for_failed_images(pool):
+    good = encode_wsq(_image(), 400, 500)
+    assert [image is None for image in pool.decode_many([good, b"junk", b"", good])] == [False, True, True, False]
+    assert [blob is None for blob in pool.encode_many([(bytes(10), 400, 500), (_image(), 400, 500)])] == [True, False]
+
+def test_pool_streams_lazily(pool):
+    def blobs():
+        yield encode_wsq(_image(), 400, 500)
+        raise AssertionError("read past the first batch")
+    decoded = pool.decode_many(blobs())
+    with pytest.raises(AssertionError):
+        next(decoded)
+    # Abandoning a stream frees its batches and leaves the pool usable
+    decoded = pool.decode_many(encode_wsq(_image(seed, 40, 30), 40, 30) for seed in range(20))
+    assert next(decoded)["width"] == 40
+    decoded.close()
+    assert list(pool.decode_many([])) == []
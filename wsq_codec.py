@@ -0,0 +1,302 @@
+import io
+import os
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from PIL import Image
+import wsq  # registers the WSQ format with Pillow
+
+# Resolution assumed when a WSQ stream does not carry one
+DEFAULT_DPI = 500
+# Images per task sent to a codec worker
+DEFAULT_BATCH_SIZE = 32
+# Batches in flight per worker; results are still returned in submission order
+PIPELINE_DEPTH = 2
+# Room reserved for each encoded image beyond its pixel count (WSQ headers and tables)
+ENCODE_SLACK = 4096
+
+# WSQ markers: start and end of image, start of frame, and the segments that carry a length
+WSQ_SOI = 0xFFA0
+WSQ_EOI = 0xFFA1
+WSQ_SOF = 0xFFA2
+WSQ_SEGMENTS = (0xFFA3, 0xFFA4, 0xFFA5, 0xFFA6, 0xFFA7, 0xFFA8)
+
+def decode_wsq(compressed_data):
+    """
+    Decompress WSQ image data to a raw 8-bit grayscale image.
+
+    :param compressed_data: Compressed WSQ image data (bytes), or a readable seekable
+                            file-like object such as the Blob from EnrollmentRepository.open_fingerprint.
+    :return: A dictionary with "data", "width", "height", "dpi" and "bpp", or None if failed.
+    """
+    try:
+        # backfill passes the sqlite3.Blob it opened per row; Pillow would close a
+        # stream it was given, so it gets the bytes and the caller closes the Blob
+        if hasattr(compressed_data, "read"):
+            compressed_data = compressed_data.read()
+        img = Image.open(io.BytesIO(compressed_data))
+        if img.mode != "L":
+            img = img.convert("L")
+        width, height = img.size
+        return {
+            "data": img.tobytes(),
+            "width": width,
+            "height": height,
+            "dpi": int(img.info.get("dpi", (DEFAULT_DPI, DEFAULT_DPI))[0]),
+            "bpp": 8
+        }
+    except Exception as e:
+        logging.error(f"Failed to decompress image using WSQ: {e}")
+        return None
+
+def encode_wsq(image_data, width, height):
+    """
+    Compress a raw 8-bit grayscale image with WSQ.
+
+    :param image_data: The raw image data (bytes-like, width * height bytes).
+    :param width: The width of the image in pixels.
+    :param height: The height of the image in pixels.
+    :return: The compressed image (bytes), or None if failed.
+    """
+    try:
+        if len(image_data) != width * height:
+            logging.error(f"Invalid image data size. Expected {width * height} bytes, got {len(image_data)} bytes.")
+            return None
+        img = Image.frombuffer("L", (width, height), image_data, "raw", "L", 0, 1)
+        with io.BytesIO() as output:
+            img.save(output, format="WSQ")
+            return output.getvalue()
+    except Exception as e:
+        logging.error(f"Failed to compress image using WSQ: {e}")
+        return None
+
+def wsq_dimensions(compressed_data):
+    """
+    Read the image size from the WSQ frame header without decoding.
+
+    :param compressed_data: Compressed WSQ image data (bytes-like).
+    :return: A (width, height) tuple, or None if no frame header was found.
+    """
+    data = memoryview(compressed_data).cast("B")
+    pos = 0
+    while pos + 4 <= len(data):
+        marker = (data[pos] << 8) | data[pos + 1]
+        if marker == WSQ_SOI or marker == WSQ_EOI:
+            pos += 2
+        elif marker == WSQ_SOF:
+            # Marker, frame length, black and white levels, then height and width
+            if pos + 10 > len(data):
+                return None
+            return (data[pos + 8] << 8) | data[pos + 9], (data[pos + 6] << 8) | data[pos + 7]
+        elif marker in WSQ_SEGMENTS:
+            pos += 2 + ((data[pos + 2] << 8) | data[pos + 3])
+        else:
+            return None
+    return None
+
+def _decode_task(in_name, spans, out_name, out_offsets):
+    # Decode each image of the batch from the input segment into its slot of the output one
+    in_shm, out_shm = SharedMemory(name=in_name), SharedMemory(name=out_name)
+    results = []
+    try:
+        for (offset, size), out_offset in zip(spans, out_offsets):
+            # Pillow reads from its own copy of the stream, so the view is released right away
+            with in_shm.buf[offset:offset + size] as view:
+                image = decode_wsq(view)
+            if image is None:
+                results.append(None)
+                continue
+            pixels = image["data"]
+            out_shm.buf[out_offset:out_offset + len(pixels)] = pixels
+            results.append((image["width"], image["height"], image["dpi"]))
+    finally:
+        in_shm.close()
+        out_shm.close()
+    return results
+
+def _encode_task(in_name, spans, shapes, out_name, out_spans):
+    # Encode each image of the batch; an output larger than its slot is returned inline
+    in_shm, out_shm = SharedMemory(name=in_name), SharedMemory(name=out_name)
+    results = []
+    try:
+        for (offset, size), (width, height), (out_offset, capacity) in zip(spans, shapes, out_spans):
+            view = in_shm.buf[offset:offset + size]
+            try:
+                compressed = encode_wsq(view, width, height)
+            finally:
+                view.release()
+            if compressed is None:
+                results.append(None)
+            elif len(compressed) <= capacity:
+                out_shm.buf[out_offset:out_offset + len(compressed)] = compressed
+                results.append(len(compressed))
+            else:
+                results.append(compressed)
+    finally:
+        in_shm.close()
+        out_shm.close()
+    return results
+
+def _pack(buffers):
+    # Copy the inputs of a batch into one shared segment; returns it and each (offset, size)
+    spans = []
+    total = 0
+    for buffer in buffers:
+        spans.append((total, len(buffer)))
+        total += len(buffer)
+    shm = SharedMemory(create=True, size=max(total, 1))
+    for buffer, (offset, size) in zip(buffers, spans):
+        shm.buf[offset:offset + size] = buffer
+    return shm, spans
+
+def _release(*segments):
+    for shm in segments:
+        shm.close()
+        shm.unlink()
+
+class WSQCodecPool:
+    """
+    WSQ encode and decode on a process pool, for bulk jobs (re-extraction, exports).
+
+    Inputs are grouped in batches. Each batch is copied once into a shared
+    memory segment, and the workers write their results into a second segment
+    sized up front, so image bytes are never pickled between processes.
+    Batches are pipelined, and results are yielded in input order as soon as
+    the batch holding them is done.
+    """
+
+    def __init__(self, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param workers: Number of worker processes (None uses every CPU).
+        :param batch_size: Images per task.
+        """
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def _batches(self, items):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _stream(self, items, submit, collect):
+        # Keep up to PIPELINE_DEPTH batches per worker in flight and yield in order
+        in_flight = deque()
+        batches = self._batches(items)
+        try:
+            for batch in batches:
+                in_flight.append(submit(batch))
+                if len(in_flight) >= self.workers * PIPELINE_DEPTH:
+                    yield from collect(*in_flight.popleft())
+            while in_flight:
+                yield from collect(*in_flight.popleft())
+        finally:
+            # Abandoned generator or failure: free the segments of unfinished batches
+            for future, count, segments, *_ in in_flight:
+                future.cancel()
+                try:
+                    future.exception()
+                except Exception:
+                    pass
+                _release(*segments)
+
+    def decode_many(self, blobs):
+        """
+        Decode WSQ images in parallel.
+
+        :param blobs: An iterable of compressed images (bytes-like).
+        :return: A generator of decode_wsq dictionaries (or None for an image that
+                 could not be decoded), in input order.
+        """
+        def submit(batch):
+            in_shm, spans = _pack(batch)
+            out_offsets = []
+            sizes = []
+            total = 0
+            for blob in batch:
+                dimensions = wsq_dimensions(blob)
+                size = dimensions[0] * dimensions[1] if dimensions else 0
+                out_offsets.append(total)
+                sizes.append(size)
+                total += size
+            out_shm = SharedMemory(create=True, size=max(total, 1))
+            future = self.executor.submit(_decode_task, in_shm.name, spans, out_shm.name, out_offsets)
+            return future, len(batch), (in_shm, out_shm), out_offsets, sizes
+
+        def collect(future, count, segments, out_offsets, sizes):
+            in_shm, out_shm = segments
+            try:
+                results = future.result()
+            except Exception as e:
+                logging.error(f"WSQ decode batch failed: {e}")
+                results = [None] * count
+            try:
+                for result, offset, size in zip(results, out_offsets, sizes):
+                    if result is None or result[0] * result[1] != size:
+                        yield None
+                        continue
+                    width, height, dpi = result
+                    yield {
+                        "data": bytes(out_shm.buf[offset:offset + size]),
+                        "width": width,
+                        "height": height,
+                        "dpi": dpi,
+                        "bpp": 8
+                    }
+            finally:
+                _release(in_shm, out_shm)
+
+        return self._stream(blobs, submit, collect)
+
+    def encode_many(self, images):
+        """
+        Encode raw 8-bit grayscale images with WSQ in parallel.
+
+        :param images: An iterable of (image_data, width, height) tuples.
+        :return: A generator of compressed images (bytes, or None for an image that
+                 could not be encoded), in input order.
+        """
+        def submit(batch):
+            in_shm, spans = _pack([image_data for image_data, _, _ in batch])
+            shapes = [(width, height) for _, width, height in batch]
+            out_spans = []
+            total = 0
+            for _, size in spans:
+                out_spans.append((total, size + ENCODE_SLACK))
+                total += size + ENCODE_SLACK
+            out_shm = SharedMemory(create=True, size=max(total, 1))
+            future = self.executor.submit(_encode_task, in_shm.name, spans, shapes, out_shm.name, out_spans)
+            return future, len(batch), (in_shm, out_shm), out_spans
+
+        def collect(future, count, segments, out_spans):
+            in_shm, out_shm = segments
+            try:
+                results = future.result()
+            except Exception as e:
+                logging.error(f"WSQ encode batch failed: {e}")
+                results = [None] * count
+            try:
+                for result, (offset, _) in zip(results, out_spans):
+                    if result is None or isinstance(result, bytes):
+                        yield result
+                    else:
+                        yield bytes(out_shm.buf[offset:offset + result])
+            finally:
+                _release(in_shm, out_shm)
+
+        return self._stream(images, submit, collect)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()